@@ -0,0 +1,97 @@
+"""A loopback IRC server on a simulated clock, for the benchmarks.
+
+Importing this module replaces irclib.monotonic and time.time with
+clock, which only moves when FakeServer.advance() is called.  Delayed
+commands, the flood bucket and the game phases then run as fast as
+the CPU allows, and runs are repeatable.
+"""
+
+import os
+import socket
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import irclib
+
+SERVER_NAME = "irc.example.net"
+ISUPPORT = "MODES=6 TARGMAX=PRIVMSG:4,NOTICE:4 PREFIX=(ov)@+ CHANMODES=b,k,l,imnpst CASEMAPPING=rfc1459"
+
+
+class Clock:
+  def __init__(self, now=1000.0):
+    self.now = now
+
+  def monotonic(self):
+    return self.now
+
+  def time(self):
+    return self.now + 1e9
+
+clock = Clock()
+irclib.monotonic = clock.monotonic
+time.time = clock.time
+
+
+class FakeServer:
+  """Accepts one client and hands its lines to the caller."""
+  def __init__(self, ircobj, isupport=ISUPPORT):
+    self.ircobj = ircobj
+    self.isupport = isupport
+    self.peer = None
+    self.partial = ""
+
+  def connect(self, connection, nickname):
+    """Connect connection, a ServerConnection, and welcome it."""
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(1)
+    connection.connect("127.0.0.1", listener.getsockname()[1], nickname)
+    self.peer, address = listener.accept()
+    self.peer.setblocking(0)
+    # The clock runs far ahead of real time, so don't let Nagle hold
+    # lines back waiting for an ACK, on either side.
+    for sock in (connection.socket, self.peer):
+      sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    listener.close()
+    self.send(":%s 001 %s :Welcome" % (SERVER_NAME, nickname))
+    self.send(":%s 005 %s %s :are supported by this server"
+              % (SERVER_NAME, nickname, self.isupport))
+    return self.pump()
+
+  def send(self, line):
+    """Send line to the client and let it handle it."""
+    self.peer.sendall(line + "\r\n")
+    self.ircobj.process_once(0)
+
+  def pump(self):
+    """Run the client's due work and return the lines it sent."""
+    self.ircobj.process_once(0)
+    return self.read()
+
+  def read(self):
+    data = self.partial
+    while 1:
+      try:
+        chunk = self.peer.recv(65536)
+      except socket.error:
+        break
+      if not chunk:
+        break
+      data = data + chunk
+    lines = data.split("\r\n")
+    self.partial = lines.pop()
+    return lines
+
+  def advance(self, seconds, step=0.1):
+    """Move the clock on by seconds, pumping the client every step.
+
+    Returns a list of (time, line) for the lines the client sent.
+    """
+    sent = []
+    end = clock.now + seconds
+    while clock.now < end:
+      clock.now = min(clock.now + step, end)
+      for line in self.pump():
+        sent.append((clock.now, line))
+    return sent
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+"""Check the output pacing against an ircd's flood limits.
+
+Usage: python bench/flood.py [lines]
+
+The server side models ratbox: a client may send 10 lines at once and
+is then allowed one line per second, and whatever it sends beyond that
+waits in a 2560-byte receive queue.  A client that overflows the queue
+is disconnected with "Excess Flood".  The bot queues a burst of 97-byte
+channel messages, about what it says when a game starts, and each
+pacing is timed on a simulated clock.
+"""
+
+import sys
+
+import fakeserver
+from fakeserver import clock
+import irclib
+import botcommon
+
+FLOOD_GRACE = 10
+RECVQ = 2560
+TEXT = "x" * 97
+
+
+class RecvQ:
+  """The server's view of the client's output."""
+  def __init__(self):
+    self.credit = FLOOD_GRACE
+    self.updated = clock.now
+    self.waiting = []
+    self.queued = 0
+    self.processed = 0
+    self.last = None
+    self.flooded = None
+
+  def receive(self, at, line):
+    self.waiting.append(line)
+    self.queued = self.queued + len(line) + 2
+    self.process(at)
+    if self.queued > RECVQ and self.flooded is None:
+      self.flooded = at
+
+  def process(self, at):
+    """Handle the waiting lines the client has credit for at time at."""
+    self.credit = min(self.credit + (at - self.updated), FLOOD_GRACE)
+    self.updated = at
+    while self.waiting and self.credit >= 1:
+      self.credit = self.credit - 1
+      self.queued = self.queued - len(self.waiting.pop(0)) - 2
+      self.processed = self.processed + 1
+      self.last = at
+
+
+def connect():
+  ircobj = irclib.IRC()
+  server = fakeserver.FakeServer(ircobj)
+  connection = ircobj.server()
+  server.connect(connection, "wolfbot")
+  return server, connection
+
+def run(name, count, send):
+  server, connection = connect()
+  recvq = RecvQ()
+  start = clock.now
+  send(connection, count)
+  # Long enough for the bucket to empty its queue at the default rate.
+  for at, line in server.advance(count * 3, step=0.01):
+    if line.startswith("PRIVMSG"):
+      recvq.receive(at, line)
+    if recvq.flooded is not None:
+      break
+  if recvq.flooded is not None:
+    result = "Excess Flood after %.1f s" % (recvq.flooded - start)
+  else:
+    while recvq.waiting:
+      clock.now = clock.now + 1
+      recvq.process(clock.now)
+    result = "no disconnect, %.2f lines/s sustained" % (
+      recvq.processed / (recvq.last - start))
+  print "%-28s %s" % (name, result)
+
+def fixed_delay(connection, count):
+  # The output loop before the token bucket: one line every 0.01 s.
+  for i in range(count):
+    connection.execute_delayed(i * 0.01, connection.privmsg, ("#wolf", TEXT))
+
+def bucket(rate):
+  def send(connection, count):
+    manager = botcommon.OutputManager(connection, botcommon.TokenBucket(rate=rate))
+    for i in range(count):
+      manager.send(TEXT, "#wolf")
+  return send
+
+def main():
+  if len(sys.argv) > 1:
+    count = int(sys.argv[1])
+  else:
+    count = 60
+  print "%d lines of %d bytes to #wolf" % (count, len(TEXT))
+  run("fixed 0.01 s delay", count, fixed_delay)
+  run("bucket, 4x the default rate", count, bucket(4.0))
+  run("bucket, defaults", count, bucket(1.0))
+
+if __name__ == "__main__":
+  main()
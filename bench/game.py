@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+"""Play whole games through the bot and time the game state lookups.
+
+Usage: python bench/game.py [players] [games]
+
+To compare with an older revision, copy bench/ into a checkout of it
+and run the copy; trees from before the Game object are handled too.
+
+Each game is driven over a loopback connection on a simulated clock:
+the players join and start, act at night with private commands and
+vote in the channel until one side wins.  The time per command covers
+parsing, dispatch and the command handlers.
+"""
+
+import random
+import sys
+import time
+import timeit
+
+import fakeserver
+from fakeserver import clock
+import wolfbot
+
+CHANNEL = "#wolf"
+NICKNAME = "wolfbot"
+
+
+class Table:
+  """A bot in a channel full of players."""
+  def __init__(self, nplayers, seed):
+    random.seed(seed)
+    self.players = ["p%d" % i for i in range(nplayers)]
+    # Let the bot's output through unthrottled.
+    self.bot = wolfbot.WolfBot(CHANNEL, NICKNAME, "", "127.0.0.1",
+        flood_control={'burst': 1e9, 'rate': 1e9})
+    self.server = fakeserver.FakeServer(self.bot.ircobj)
+    self.server.connect(self.bot.connection, NICKNAME)
+    self.server.send(":%s!%s@bot.example.net JOIN :%s" % (NICKNAME, NICKNAME, CHANNEL))
+    self.server.send(":%s 353 %s = %s :@%s %s" % (fakeserver.SERVER_NAME,
+        NICKNAME, CHANNEL, NICKNAME, " ".join(self.players)))
+    self.server.send(":%s 366 %s %s :End of /NAMES list."
+                     % (fakeserver.SERVER_NAME, NICKNAME, CHANNEL))
+    self.commands = 0
+    self.elapsed = 0.0
+
+  def game(self):
+    # Before the Game object, the game state lived on the bot.
+    return getattr(self.bot, "game", self.bot)
+
+  def command(self, line):
+    started = time.clock()
+    self.server.send(line)
+    self.elapsed = self.elapsed + time.clock() - started
+    self.commands = self.commands + 1
+
+  def public(self, nick, text):
+    self.command(":%s!~%s@example.net PRIVMSG %s :%s" % (nick, nick, CHANNEL, text))
+
+  def private(self, nick, text):
+    self.command(":%s!~%s@example.net PRIVMSG %s :%s" % (nick, nick, NICKNAME, text))
+
+  def running(self):
+    return self.bot.gamestate == self.bot.GAMESTATE_RUNNING
+
+  def wait_for(self, condition, limit=200):
+    """Advance the clock until condition() holds or the game ends."""
+    while self.running() and not condition() and limit > 0:
+      self.server.advance(1, step=1)
+      limit = limit - 1
+
+  def start(self):
+    self.public(self.players[0], "!start")
+    for nick in self.players[1:]:
+      self.public(nick, "!join")
+    self.server.advance(25, step=1)
+    self.public(self.players[0], "!start")
+
+  def play(self):
+    """Play until one side wins; return the number of rounds."""
+    bot = self.bot
+    self.start()
+    rounds = 0
+    while self.running():
+      rounds = rounds + 1
+      self.wait_for(lambda: bot.time == "night")
+      if not self.running():
+        break
+      g = self.game()
+      live = list(g.live_players)
+      good = [p for p in live if p not in g.wolves]
+      victim = [p for p in good if p != g.ninja][-1]
+      if g.cupid in live and g.first_night and not g.lovers:
+        self.private(g.cupid, "lovers %s %s" % (good[0], good[1]))
+      if g.seer in live:
+        self.private(g.seer, "see %s" % live[0])
+      if g.mystic in live:
+        self.private(g.mystic, "guard %s" % live[0])
+      if g.ninja in live:
+        self.private(g.ninja, "sleep")
+      for wolf in list(g.wolves):
+        if wolf in live and bot.time == "night":
+          self.private(wolf, "kill %s" % victim)
+      self.wait_for(lambda: bot.time == "day" and bot.voting)
+      if not self.running():
+        break
+      live = list(g.live_players)
+      good = [p for p in live if p not in g.wolves] or live
+      target = good[0]
+      other = [p for p in live if p != target][0]
+      for nick in live:
+        if nick == target:
+          self.public(nick, "!vote %s" % other)
+        else:
+          self.public(nick, "!vote %s" % target)
+        if not self.running() or bot.time != "day":
+          break
+    return rounds
+
+
+def main():
+  nplayers = 50
+  games = 20
+  if len(sys.argv) > 1:
+    nplayers = int(sys.argv[1])
+  if len(sys.argv) > 2:
+    games = int(sys.argv[2])
+
+  commands = 0
+  elapsed = 0.0
+  for seed in range(games):
+    table = Table(nplayers, seed)
+    table.play()
+    elapsed = elapsed + table.elapsed
+    commands = commands + table.commands
+  print "%d games of %d players, %d commands: %.1f us/command" % (
+    games, nplayers, commands, elapsed / commands * 1e6)
+
+  # Lookups in a game that has just started.
+  table = Table(nplayers, games)
+  table.start()
+  bot = table.bot
+  g = table.game()
+  last = table.players[-1]
+  for name, function in (("getRole", lambda: bot.getRole(last)),
+                         ("check_night_done", bot.check_night_done),
+                         ("check_game_over", bot.check_game_over),
+                         ("in live_players", lambda: last in g.live_players)):
+    number = 200000
+    best = min(timeit.repeat(function, number=number, repeat=3))
+    print "%-18s %.3f us" % (name, best / number * 1e6)
+
+if __name__ == "__main__":
+  main()
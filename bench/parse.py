@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+"""Time irclib's message parser against the RFC 1459 regexp it replaced.
+
+Usage: python bench/parse.py [iterations]
+
+Both parsers are run over a sample of the lines a game channel sees,
+and their (prefix, command, arguments) output is checked to be the
+same before anything is timed.
+"""
+
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import irclib
+
+SAMPLE = [
+  ":p3!~p3@host-3.example.net PRIVMSG #wolf :!vote p5",
+  ":p7!~p7@host-7.example.net PRIVMSG wolfbot :see p2",
+  ":p1!~p1@host-1.example.net PRIVMSG #wolf :anyone else think p4 is acting weird?",
+  ":irc.example.net 353 wolfbot = #wolf :@wolfbot +p0 p1 p2 p3 p4 p5 p6 p7 p8 p9",
+  ":irc.example.net 005 wolfbot MODES=6 TARGMAX=PRIVMSG:4,NOTICE:4 PREFIX=(ov)@+ CHANMODES=b,k,l,imnpst CASEMAPPING=rfc1459 :are supported by this server",
+  "PING :irc.example.net",
+  ":p9!~p9@host-9.example.net QUIT :Ping timeout: 240 seconds",
+  ":wolfbot!~wolfbot@bot.example.net MODE #wolf +mv-v p1 p2",
+  ":p2!~p2@host-2.example.net NICK :p2_away",
+  ":p4!~p4@host-4.example.net JOIN :#wolf",
+]
+
+_rfc_1459_command_regexp = re.compile("^(:(?P<prefix>[^ ]+) +)?(?P<command>[^ ]+)( *(?P<argument> .+))?")
+
+def regexp_parse(line):
+  """The split Connection.process_data did before _parse_message."""
+  prefix = None
+  command = None
+  arguments = None
+  m = _rfc_1459_command_regexp.match(line)
+  if m.group("prefix"):
+    prefix = m.group("prefix")
+  if m.group("command"):
+    command = m.group("command").lower()
+  if m.group("argument"):
+    a = m.group("argument").split(" :", 1)
+    arguments = a[0].split()
+    if len(a) == 2:
+      arguments.append(a[1])
+  if command in irclib.numeric_events:
+    command = irclib.numeric_events[command]
+  return prefix, command, arguments or []
+
+def table_parse(line):
+  tags, prefix, command, arguments = irclib._parse_message(line)
+  return prefix, command, arguments
+
+def run(parse):
+  for line in SAMPLE:
+    parse(line)
+
+def main():
+  if len(sys.argv) > 1:
+    number = int(sys.argv[1])
+  else:
+    number = 20000
+  for line in SAMPLE:
+    if regexp_parse(line) != table_parse(line):
+      print "Output differs for %r:" % line
+      print "  regexp:", regexp_parse(line)
+      print "  table: ", table_parse(line)
+      sys.exit(1)
+  for name, parse in (("regexp", regexp_parse), ("_parse_message", table_parse)):
+    best = min(timeit.repeat(lambda: run(parse), number=number, repeat=5))
+    print "%-16s %.2f us/line" % (name, best / number / len(SAMPLE) * 1e6)
+
+if __name__ == "__main__":
+  main()
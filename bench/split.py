@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+"""Time irclib.split_message on the lines the bot sends.
+
+Usage: python bench/split.py [iterations]
+
+A few cases with known results are checked first: formatting carried
+over to a continuation, and a carried colour followed by digits.
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import irclib
+
+CASES = [
+  # Spaces are preferred; the bold is repeated on the next piece.
+  (("\x02bold words here", 11), ["\x02bold words", "\x02here"]),
+  # A carried colour is written with two digits, so the "12" starting
+  # the next piece isn't read as colour 41.
+  (("\x034" + "aaaa " * 4 + "12 players left", 22),
+   ["\x034aaaa aaaa aaaa aaaa", "\x030412 players left"]),
+  (("\x034,1" + "aaaa " * 3 + "12 players", 18),
+   ["\x034,1aaaa aaaa aaaa", "\x0304,0112 players"]),
+]
+
+SHORT = "\x036p3 has voted to lynch \x02p5\x0f!"
+PLAIN = "word " * 200
+FORMATTED = " ".join(["\x034p%d\x0f the \x02Villager\x02" % i for i in range(45)])
+
+def check():
+  ok = 1
+  for (text, width), expected in CASES:
+    pieces = irclib.split_message(text, width)
+    if pieces != expected:
+      print "split_message(%r, %d):" % (text, width)
+      print "  got     ", pieces
+      print "  expected", expected
+      ok = 0
+  # Carried codes that leave no room for text are dropped, rather
+  # than looping forever.
+  for width in range(1, 8):
+    for piece in irclib.split_message("\x02\x1f\x0304,05" + "x" * 20, width):
+      if len(piece) > width:
+        print "width %d: %r is too long" % (width, piece)
+        ok = 0
+  return ok
+
+def main():
+  if len(sys.argv) > 1:
+    number = int(sys.argv[1])
+  else:
+    number = 20000
+  if not check():
+    sys.exit(1)
+  for name, text in (("short line", SHORT),
+                     ("%d bytes, plain" % len(PLAIN), PLAIN),
+                     ("%d bytes, formatted" % len(FORMATTED), FORMATTED)):
+    best = min(timeit.repeat(lambda: irclib.split_message(text, 400),
+                             number=number, repeat=5))
+    print "%-22s %.2f us" % (name, best / number * 1e6)
+
+if __name__ == "__main__":
+  main()
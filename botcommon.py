@@ -6,30 +6,326 @@ Common bits and pieces used by the various bots.
 import sys
 import os
 import time
-from threading import Thread, Event
+from collections import deque
 
+import irclib
 
-class OutputManager(Thread):
-  def __init__(self, connection, delay=.5):
-    Thread.__init__(self)
-    self.setDaemon(1)
+
+# Output priorities, most urgent first.
+PRIORITY_CRITICAL = 0 # Game flow: role intros, phase changes, results.
+PRIORITY_INFO = 1     # Other game announcements.
+PRIORITY_CHATTER = 2  # Command replies, help texts and the like.
+
+
+def pack_segments(segments, width, separator=' '):
+  """Join segments into as few lines of at most width bytes as possible.
+
+  Lines are only broken between segments, and the order is kept.  A
+  segment longer than width gets a line of its own.
+  """
+  lines = []
+  line = None
+  for segment in segments:
+    if line is None:
+      line = segment
+    elif len(line) + len(separator) + len(segment) <= width:
+      line = line + separator + segment
+    else:
+      lines.append(line)
+      line = segment
+  if line is not None:
+    lines.append(line)
+  return lines
+
+
+class FairQueue:
+  """A queue per target, served round-robin."""
+  def __init__(self):
+    self.targets = deque()
+    self.queues = {}
+
+  def __len__(self):
+    return len(self.targets)
+
+  def append(self, target, item):
+    if target in self.queues:
+      self.queues[target].append(item)
+    else:
+      self.queues[target] = deque([item])
+      self.targets.append(target)
+
+  def peek(self):
+    return self.queues[self.targets[0]][0]
+
+  def popleft(self):
+    """Remove the item peek() returned, and move on to the next target."""
+    target = self.targets.popleft()
+    queue = self.queues[target]
+    item = queue.popleft()
+    if queue:
+      self.targets.append(target)
+    else:
+      del self.queues[target]
+    return item
+
+  def pop(self, target):
+    """Remove the first item queued for target, keeping its turn."""
+    queue = self.queues[target]
+    item = queue.popleft()
+    if not queue:
+      del self.queues[target]
+      self.targets.remove(target)
+    return item
+
+  def clear(self):
+    self.targets.clear()
+    self.queues.clear()
+
+
+class TokenBucket:
+  """Flood control modelled on the penalty rules of common ircds.
+
+  Every line costs line_cost plus byte_cost per byte, and credit is
+  earned back at rate per second up to burst.  With the defaults a
+  short line costs about a second and ten seconds' worth may be sent
+  at once, which is what most ircds tolerate before "Excess Flood".
+  After a complaint from the server the rate is halved, and it doubles
+  back towards the configured rate for every burst seconds without
+  another one.
+  """
+  def __init__(self, burst=10.0, rate=1.0, line_cost=1.0,
+               byte_cost=1/120.0, min_rate=0.1):
+    self.burst = burst
+    self.rate = rate
+    self.line_cost = line_cost
+    self.byte_cost = byte_cost
+    self.min_rate = min_rate
+    self.configured_rate = rate
+    self.tokens = burst
+    self.updated = irclib.monotonic()
+    self.calm_since = self.updated
+
+  def cost(self, nbytes):
+    """Return the cost of a line of nbytes bytes."""
+    return min(self.line_cost + nbytes * self.byte_cost, self.burst)
+
+  def _refill(self):
+    now = irclib.monotonic()
+    self.tokens = min(self.tokens + (now - self.updated) * self.rate,
+                      self.burst)
+    self.updated = now
+    if self.rate < self.configured_rate:
+      steps = int((now - self.calm_since) / self.burst)
+      if steps:
+        self.rate = min(self.rate * 2 ** steps, self.configured_rate)
+        self.calm_since = self.calm_since + steps * self.burst
+
+  def wait_time(self, cost):
+    """Return how many seconds to wait before cost can be spent."""
+    self._refill()
+    if self.tokens >= cost:
+      return 0
+    return (cost - self.tokens) / self.rate
+
+  def consume(self, cost):
+    self.tokens = self.tokens - cost
+
+  def slow_down(self, factor=0.5):
+    """Lower the rate after the server complained about flooding."""
+    self._refill()
+    self.rate = max(self.rate * factor, self.min_rate)
+    self.tokens = min(self.tokens, 0)
+    self.calm_since = self.updated
+
+
+class OutputManager:
+  """Queues messages to a connection and paces them with a TokenBucket.
+
+  Messages are queued in one lane per priority.  A lane is only served
+  when all more urgent lanes are empty, so critical messages wait at
+  most for the bucket, and within a lane the targets take turns.
+  When a message goes out, the same text waiting first in line for
+  other targets in its lane is sent along in the same command, as
+  far as the server's TARGMAX and the line length allow.  Otherwise
+  private messages queued next for the same target are joined onto
+  it, separated by separator, as long as the result fits in one line.
+
+  Messages can be given a key, and a message queued with the same key
+  as one still waiting takes its place in the queue; and a ttl, after
+  which a message that hasn't been sent is dropped.  That keeps
+  periodic announcements and status dumps from going out stale.
+
+  Runs off the IRC object's scheduler, so messages are sent from the
+  same thread as everything else the bot writes.  Server complaints
+  about flooding slow the bucket down.
+  """
+  _flood_words = ('flood', 'throttled')
+
+  def __init__(self, connection, bucket=None, separator=' | '):
     self.connection = connection
-    self.delay = delay
-    self.event = Event()
-    self.queue = []
+    self.separator = separator
+    if bucket is None:
+      bucket = TokenBucket()
+    self.bucket = bucket
+    self.lanes = [FairQueue() for priority in
+                  (PRIORITY_CRITICAL, PRIORITY_INFO, PRIORITY_CHATTER)]
+    self.keyed = {} # key -> message waiting in a lane
+    self._held = None # (targets, msg, private, cost) waiting for the bucket
+    self._drain = None
+    for event in ('error', 'privnotice'):
+      connection.add_global_handler(event, self._on_server_message)
 
-  def run(self):
+  def _on_server_message(self, c, e):
+    if e.eventtype() == 'privnotice' and e.user() is not None:
+      # From a user, not the server.
+      return
+    text = ' '.join(e.arguments()).lower()
+    for word in self._flood_words:
+      if word in text:
+        self.bucket.slow_down()
+        return
+
+  def __len__(self):
+    n = sum([len(queue) for lane in self.lanes
+             for queue in lane.queues.values()])
+    if self._held is not None:
+      n = n + 1
+    return n
+
+  def _next_lane(self):
+    for lane in self.lanes:
+      if lane:
+        return lane
+    return None
+
+  def _dequeued(self, item):
+    if item[3] is not None:
+      del self.keyed[item[3]]
+
+  def _send_next(self):
+    bucket = self.bucket
     while 1:
-      self.event.wait()
-      while self.queue:
-        msg,target,private = self.queue.pop(0)
-        if private:
-          self.connection.notice(target, msg)
+      if self._held is not None:
+        targets, msg, private, cost = self._held
+      else:
+        lane = self._next_lane()
+        if lane is None:
+          return
+        msg,target,private,key,expires = lane.peek()
+        if expires is not None and expires <= irclib.monotonic():
+          self._dequeued(lane.popleft())
+          continue
+        # PRIVMSG/NOTICE, the target, the separators and CR LF.
+        cost = bucket.cost(len(msg) + len(target) + 12)
+        wait = bucket.wait_time(cost)
+        if wait:
+          self._drain.reschedule(wait)
+          return
+        self._dequeued(lane.popleft())
+        targets = self._coalesce(lane, msg, target, private)
+        if len(targets) > 1:
+          cost = bucket.cost(len(msg) + len(','.join(targets)) + 12)
+        elif private:
+          msg = self._bundle(lane, msg, target)
+          cost = bucket.cost(len(msg) + len(target) + 12)
+      # Coalescing and bundling make the line dearer than the message
+      # checked above.  If the bucket can't take it yet, hold on to
+      # the line rather than take it apart again.
+      wait = bucket.wait_time(cost)
+      if wait:
+        self._held = (targets, msg, private, cost)
+        self._drain.reschedule(wait)
+        return
+      self._held = None
+      try:
+        if len(targets) > 1:
+          if private:
+            self.connection.notice_many(targets, msg)
+          else:
+            self.connection.privmsg_many(targets, msg)
+        elif private:
+          self.connection.notice(targets[0], msg)
         else:
-          self.connection.privmsg(target, msg)
-        time.sleep(self.delay)
-      self.event.clear()
+          self.connection.privmsg(targets[0], msg)
+      except irclib.ServerNotConnectedError:
+        self.clear()
+        return
+      bucket.consume(cost)
+
+  def _coalesce(self, lane, msg, target, private):
+    """Take the other targets in lane that are waiting for msg next."""
+    if private:
+      command = 'NOTICE'
+    else:
+      command = 'PRIVMSG'
+    limit = self.connection.max_targets(command)
+    targets = [target]
+    keys = {irclib.irc_lower(target): None}
+    # Room left in the line for more ",target"s.
+    room = 510 - len('%s %s :%s' % (command, target, msg))
+    now = irclib.monotonic()
+    for key in list(lane.targets):
+      if limit is not None and len(targets) >= limit:
+        break
+      other_msg, other, other_private, other_key, expires = lane.queues[key][0]
+      if (other_msg == msg and other_private == private
+          and key not in keys and len(other) < room
+          and (expires is None or expires > now)):
+        self._dequeued(lane.pop(key))
+        targets.append(other)
+        keys[key] = None
+        room = room - len(other) - 1
+    return targets
+
+  def _bundle(self, lane, msg, target):
+    """Join the private messages queued next for target onto msg."""
+    key = irclib.irc_lower(target)
+    budget = self.connection.message_budget('NOTICE', target)
+    queue = lane.queues.get(key)
+    now = irclib.monotonic()
+    while queue:
+      next_msg, next_target, private, next_key, expires = queue[0]
+      if expires is not None and expires <= now:
+        self._dequeued(lane.pop(key))
+        queue = lane.queues.get(key)
+        continue
+      bundled = msg + self.separator + next_msg
+      if not private or len(bundled) > budget:
+        break
+      self._dequeued(lane.pop(key))
+      msg = bundled
+      queue = lane.queues.get(key)
+    return msg
+
+  def clear(self):
+    for lane in self.lanes:
+      lane.clear()
+    self.keyed.clear()
+    self._held = None
+
+  def send(self, msg, target, private = False, priority = PRIORITY_INFO,
+           key = None, ttl = None):
+    """Queue msg for target.
 
-  def send(self, msg, target, private = False):
-    self.queue.append((msg.strip(),target,private))
-    self.event.set()
\ No newline at end of file
+    A message with the same key that is still queued is replaced by
+    this one (it should have the same target and priority).  If ttl
+    is given, the message is dropped if it hasn't been sent within
+    ttl seconds.
+    """
+    expires = None
+    if ttl is not None:
+      expires = irclib.monotonic() + ttl
+    msg = msg.strip()
+    if key is not None and key in self.keyed:
+      item = self.keyed[key]
+      item[0] = msg
+      item[4] = expires
+      return
+    item = [msg,target,private,key,expires]
+    if key is not None:
+      self.keyed[key] = item
+    self.lanes[priority].append(irclib.irc_lower(target), item)
+    if self._drain is None:
+      self._drain = self.connection.execute_delayed(0, self._send_next)
+    elif not self._drain.is_pending():
+      self._drain.reschedule(0)
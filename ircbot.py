@@ -25,6 +25,7 @@ write simpler bots.
 """
 
 import sys
+from bisect import bisect_left, insort
 from UserDict import UserDict
 
 from irclib import SimpleIRCClient
@@ -41,8 +42,14 @@ class SingleServerIRCBot(SimpleIRCClient):
     clients that are present in the channels and which of those that
     have operator or voice modes.  The "database" is kept in the
     self.channels attribute, which is an IRCDict of Channels.
+
+    self.nick_channels maps each nick, lowercased according to the
+    server's CASEMAPPING, to the set of joined channels (irc_lower:ed)
+    the nick is in, so that nick changes and quits only have to visit
+    those channels.
     """
-    def __init__(self, server_list, nickname, realname, reconnection_interval=60):
+    def __init__(self, server_list, nickname, realname, reconnection_interval=60,
+                 ircobj=None):
         """Constructor for SingleServerIRCBot objects.
 
         Arguments:
@@ -58,16 +65,18 @@ class SingleServerIRCBot(SimpleIRCClient):
             reconnection_interval -- How long the bot should wait
                                      before trying to reconnect.
 
-            dcc_connections -- A list of initiated/accepted DCC
-            connections.
+            ircobj -- The IRC instance to use.  See
+                      SimpleIRCClient.__init__.
         """
 
-        SimpleIRCClient.__init__(self)
+        SimpleIRCClient.__init__(self, ircobj)
         self.channels = IRCDict()
+        self.nick_channels = {}
         self.server_list = server_list
         if not reconnection_interval or reconnection_interval < 0:
             reconnection_interval = 2**31
         self.reconnection_interval = reconnection_interval
+        self._reconnect_timer = None
 
         self._nickname = nickname
         self._realname = realname
@@ -79,8 +88,7 @@ class SingleServerIRCBot(SimpleIRCClient):
     def _connected_checker(self):
         """[Internal]"""
         if not self.connection.is_connected():
-            self.connection.execute_delayed(self.reconnection_interval,
-                                            self._connected_checker)
+            self._reconnect_timer.reschedule(self.reconnection_interval)
             self.jump_server()
 
     def _connect(self):
@@ -97,19 +105,50 @@ class SingleServerIRCBot(SimpleIRCClient):
         except ServerConnectionError:
             pass
 
+    def _index_add(self, nick, channel):
+        """[Internal]"""
+        key = self.connection.features.lower(nick)
+        channels = self.nick_channels.get(key)
+        if channels is None:
+            self.nick_channels[key] = set([irc_lower(channel)])
+        else:
+            channels.add(irc_lower(channel))
+
+    def _index_remove(self, nick, channel):
+        """[Internal]"""
+        key = self.connection.features.lower(nick)
+        channels = self.nick_channels.get(key)
+        if channels is not None:
+            channels.discard(irc_lower(channel))
+            if not channels:
+                del self.nick_channels[key]
+
+    def _leave_channel(self, channel):
+        """[Internal]"""
+        for nick in self.channels[channel].users():
+            self._index_remove(nick, channel)
+        del self.channels[channel]
+
     def _on_disconnect(self, c, e):
         """[Internal]"""
         self.channels = IRCDict()
-        self.connection.execute_delayed(self.reconnection_interval,
-                                        self._connected_checker)
+        self.nick_channels = {}
+        if self._reconnect_timer is None:
+            self._reconnect_timer = self.connection.execute_delayed(
+                self.reconnection_interval, self._connected_checker)
+        elif not self._reconnect_timer.is_pending():
+            self._reconnect_timer.reschedule(self.reconnection_interval)
 
     def _on_join(self, c, e):
         """[Internal]"""
         ch = e.target()
-        nick = nm_to_n(e.source())
+        nick = e.nick()
         if nick == c.get_nickname():
-            self.channels[ch] = Channel()
+            features = c.features
+            self.channels[ch] = Channel(features.casemapping,
+                                        features.prefix[0])
         self.channels[ch].add_user(nick)
+        self._index_add(nick, ch)
 
     def _on_kick(self, c, e):
         """[Internal]"""
@@ -117,13 +156,14 @@ class SingleServerIRCBot(SimpleIRCClient):
         channel = e.target()
 
         if nick == c.get_nickname():
-            del self.channels[channel]
+            self._leave_channel(channel)
         else:
             self.channels[channel].remove_user(nick)
+            self._index_remove(nick, channel)
 
     def _on_mode(self, c, e):
         """[Internal]"""
-        modes = parse_channel_modes(" ".join(e.arguments()))
+        modes = parse_channel_modes(" ".join(e.arguments()), c.features)
         t = e.target()
         if is_channel(t):
             ch = self.channels[t]
@@ -147,39 +187,51 @@ class SingleServerIRCBot(SimpleIRCClient):
         # e.arguments()[2] == nick list
 
         ch = e.arguments()[1]
+        channel = self.channels[ch]
+        modes, symbols = c.features.prefix
         for nick in e.arguments()[2].split():
-            if nick[0] == "@":
-                nick = nick[1:]
-                self.channels[ch].set_mode("o", nick)
-            elif nick[0] == "+":
-                nick = nick[1:]
-                self.channels[ch].set_mode("v", nick)
-            self.channels[ch].add_user(nick)
+            # With multi-prefix there may be several prefixes.
+            i = 0
+            while i < len(nick) and nick[i] in symbols:
+                i = i + 1
+            channel.add_user(nick[i:])
+            for symbol in nick[:i]:
+                channel.set_mode(modes[symbols.index(symbol)], nick[i:])
+            self._index_add(nick[i:], ch)
 
     def _on_nick(self, c, e):
         """[Internal]"""
-        before = nm_to_n(e.source())
+        before = e.nick()
         after = e.target()
-        for ch in self.channels.values():
-            if ch.has_user(before):
-                ch.change_nick(before, after)
+        lower = self.connection.features.lower
+        channels = self.nick_channels.pop(lower(before), None)
+        if channels is None:
+            return
+        for ch in channels:
+            self.channels[ch].change_nick(before, after)
+        key = lower(after)
+        if key in self.nick_channels:
+            # Stale entry for the new nick; shouldn't happen.
+            channels.update(self.nick_channels[key])
+        self.nick_channels[key] = channels
 
     def _on_part(self, c, e):
         """[Internal]"""
-        nick = nm_to_n(e.source())
+        nick = e.nick()
         channel = e.target()
 
         if nick == c.get_nickname():
-            del self.channels[channel]
+            self._leave_channel(channel)
         else:
             self.channels[channel].remove_user(nick)
+            self._index_remove(nick, channel)
 
     def _on_quit(self, c, e):
         """[Internal]"""
-        nick = nm_to_n(e.source())
-        for ch in self.channels.values():
-            if ch.has_user(nick):
-                ch.remove_user(nick)
+        nick = e.nick()
+        key = self.connection.features.lower(nick)
+        for ch in self.nick_channels.pop(key, ()):
+            self.channels[ch].remove_user(nick)
 
     def die(self, msg="Bye, cruel world!"):
         """Let the bot die.
@@ -229,11 +281,11 @@ class SingleServerIRCBot(SimpleIRCClient):
         to the on_dccchat method.
         """
         if e.arguments()[0] == "VERSION":
-            c.ctcp_reply(nm_to_n(e.source()),
+            c.ctcp_reply(e.nick(),
                          "VERSION " + self.get_version())
         elif e.arguments()[0] == "PING":
             if len(e.arguments()) > 1:
-                c.ctcp_reply(nm_to_n(e.source()),
+                c.ctcp_reply(e.nick(),
                              "PING " + e.arguments()[1])
         elif e.arguments()[0] == "DCC" and e.arguments()[1].split(" ", 1)[0] == "CHAT":
             self.on_dccchat(c, e)
@@ -241,10 +293,19 @@ class SingleServerIRCBot(SimpleIRCClient):
     def on_dccchat(self, c, e):
         pass
 
-    def start(self):
-        """Start the bot."""
+    def start(self, process_forever=True):
+        """Start the bot.
+
+        Arguments:
+
+            process_forever -- If false, only connect and return; the
+                               caller's main loop is then expected to
+                               drive the bot's IRC object through the
+                               hooks described in IRC.__init__.
+        """
         self._connect()
-        SimpleIRCClient.start(self)
+        if process_forever:
+            SimpleIRCClient.start(self)
 
 
 class IRCDict:
@@ -311,57 +372,139 @@ class IRCDict:
 class Channel:
     """A class for keeping information about an IRC channel.
 
-    This class can be improved a lot.
+    The members are kept in self.members, which maps each member's
+    nick, lowercased according to the server's CASEMAPPING, to the
+    nick itself.  The prefix modes (operator, voice and whatever else
+    the server's PREFIX lists) are kept as a bitfield per member in
+    self.prefix_modes, under the same keys; members without any
+    aren't in it.  Iterating over a Channel gives the members' nicks
+    without building a list.
+
+    The keys are also kept in the sorted list self.sorted_keys, so
+    that find_user can complete an abbreviated nick.
     """
 
-    def __init__(self):
-        self.userdict = IRCDict()
-        self.operdict = IRCDict()
-        self.voiceddict = IRCDict()
+    def __init__(self, casemapping="rfc1459", prefix_modes="ov"):
+        """Constructor for Channel objects.
+
+        Arguments:
+
+            casemapping -- The server's CASEMAPPING; see irc_lower.
+
+            prefix_modes -- The modes that give members a nick
+                            prefix, from the server's PREFIX.
+        """
+        self.members = {}
+        self.sorted_keys = []
+        self.prefix_modes = {}
         self.modes = {}
+        self.casemapping = casemapping
+        self.mode_bits = {}
+        for i in range(len(prefix_modes)):
+            self.mode_bits[prefix_modes[i]] = 1 << i
+
+    def _key(self, nick):
+        """[Internal]"""
+        key = irc_lower(nick, self.casemapping)
+        if key == nick:
+            # Share the string.
+            return nick
+        return key
+
+    def __len__(self):
+        return len(self.members)
+
+    def __iter__(self):
+        return self.members.itervalues()
+
+    def __contains__(self, nick):
+        return self.has_user(nick)
+
+    def _with_mode(self, mode):
+        """[Internal]"""
+        bit = self.mode_bits.get(mode, 0)
+        return [self.members[key]
+                for key, modes in self.prefix_modes.iteritems()
+                if modes & bit]
 
     def users(self):
         """Returns an unsorted list of the channel's users."""
-        return self.userdict.keys()
+        return self.members.values()
 
     def opers(self):
         """Returns an unsorted list of the channel's operators."""
-        return self.operdict.keys()
+        return self._with_mode("o")
 
     def voiced(self):
         """Returns an unsorted list of the persons that have voice
         mode set in the channel."""
-        return self.voiceddict.keys()
+        return self._with_mode("v")
 
     def has_user(self, nick):
         """Check whether the channel has a user."""
-        return nick in self.userdict
+        return irc_lower(nick, self.casemapping) in self.members
+
+    def find_user(self, nick):
+        """Look up a user by nick, ignoring case.
+
+        Returns the user's nick as the channel knows it.  If no user
+        has that nick, but exactly one user's nick starts with it,
+        that user's nick is returned.  Otherwise returns None.
+        """
+        key = irc_lower(nick, self.casemapping)
+        found = self.members.get(key)
+        if found is not None or not key:
+            return found
+        keys = self.sorted_keys
+        i = bisect_left(keys, key)
+        if i < len(keys) and keys[i].startswith(key) and \
+           (i + 1 == len(keys) or not keys[i + 1].startswith(key)):
+            return self.members[keys[i]]
+        return None
+
+    def _remove_key(self, key):
+        """[Internal]"""
+        keys = self.sorted_keys
+        del keys[bisect_left(keys, key)]
+
+    def has_prefix_mode(self, mode, nick):
+        """Check whether a user has a prefix mode (such as "o") set
+        in the channel."""
+        modes = self.prefix_modes.get(irc_lower(nick, self.casemapping), 0)
+        return modes & self.mode_bits.get(mode, 0) != 0
 
     def is_oper(self, nick):
         """Check whether a user has operator status in the channel."""
-        return nick in self.operdict
+        return self.has_prefix_mode("o", nick)
 
     def is_voiced(self, nick):
         """Check whether a user has voice mode set in the channel."""
-        return nick in self.voiceddict
+        return self.has_prefix_mode("v", nick)
 
     def add_user(self, nick):
-        self.userdict[nick] = 1
+        key = self._key(nick)
+        if key not in self.members:
+            self.members[key] = nick
+            insort(self.sorted_keys, key)
 
     def remove_user(self, nick):
-        for d in self.userdict, self.operdict, self.voiceddict:
-            if nick in d:
-                del d[nick]
+        key = irc_lower(nick, self.casemapping)
+        if self.members.pop(key, None) is not None:
+            self._remove_key(key)
+            self.prefix_modes.pop(key, None)
 
     def change_nick(self, before, after):
-        self.userdict[after] = 1
-        del self.userdict[before]
-        if before in self.operdict:
-            self.operdict[after] = 1
-            del self.operdict[before]
-        if before in self.voiceddict:
-            self.voiceddict[after] = 1
-            del self.voiceddict[before]
+        key = irc_lower(before, self.casemapping)
+        if self.members.pop(key, None) is None:
+            return
+        self._remove_key(key)
+        modes = self.prefix_modes.pop(key, 0)
+        key = self._key(after)
+        if key not in self.members:
+            insort(self.sorted_keys, key)
+        self.members[key] = after
+        if modes:
+            self.prefix_modes[key] = modes
 
     def set_mode(self, mode, value=None):
         """Set mode on the channel.
@@ -372,12 +515,15 @@ class Channel:
 
             value -- Value
         """
-        if mode == "o":
-            self.operdict[value] = 1
-        elif mode == "v":
-            self.voiceddict[value] = 1
-        else:
+        bit = self.mode_bits.get(mode)
+        if bit is None:
             self.modes[mode] = value
+            return
+        if value is None:
+            return
+        key = irc_lower(value, self.casemapping)
+        if key in self.members:
+            self.prefix_modes[key] = self.prefix_modes.get(key, 0) | bit
 
     def clear_mode(self, mode, value=None):
         """Clear mode on the channel.
@@ -388,15 +534,21 @@ class Channel:
 
             value -- Value
         """
-        try:
-            if mode == "o":
-                del self.operdict[value]
-            elif mode == "v":
-                del self.voiceddict[value]
-            else:
+        bit = self.mode_bits.get(mode)
+        if bit is None:
+            try:
                 del self.modes[mode]
-        except KeyError:
-            pass
+            except KeyError:
+                pass
+            return
+        if value is None:
+            return
+        key = irc_lower(value, self.casemapping)
+        modes = self.prefix_modes.get(key, 0) & ~bit
+        if modes:
+            self.prefix_modes[key] = modes
+        else:
+            self.prefix_modes.pop(key, None)
 
     def has_mode(self, mode):
         return mode in self.modes
@@ -39,8 +39,8 @@ The main features of the IRC client framework are:
   * Messages from an IRC server triggers events, which can be caught
     by event handlers.
   * Reading from and writing to IRC server sockets are normally done
-    by an internal select() loop, but the select()ing may be done by
-    an external main loop.
+    by an internal epoll/poll/select loop, but the polling may be
+    done by an external main loop.
   * Functions can be registered to execute at specified times by the
     event-loop.
   * Decodes CTCP tagging correctly (hopefully); I haven't seen any
@@ -62,6 +62,9 @@ Current limitations:
 """
 
 import bisect
+import errno
+import heapq
+import math
 import re
 import select
 import socket
@@ -79,7 +82,6 @@ DEBUG = 0
 # (maybe) color parser convenience functions
 # documentation (including all event types)
 # (maybe) add awareness of different types of ircds
-# send data asynchronously to the server (and DCC connections)
 # (maybe) automatically close unused, passive DCC connections after a while
 
 # NOTES
@@ -93,6 +95,145 @@ class IRCError(Exception):
     pass
 
 
+def _make_monotonic_clock():
+    """[Internal] Return a function reading a monotonic clock.
+
+    Uses clock_gettime(CLOCK_MONOTONIC) through ctypes when the
+    interpreter doesn't provide time.monotonic, and falls back to
+    time.time if neither is available.
+    """
+    if hasattr(time, "monotonic"):
+        return time.monotonic
+    try:
+        import ctypes
+        import ctypes.util
+
+        class timespec(ctypes.Structure):
+            _fields_ = [("tv_sec", ctypes.c_long),
+                        ("tv_nsec", ctypes.c_long)]
+
+        librt = ctypes.CDLL(ctypes.util.find_library("rt") or "librt.so.1",
+                            use_errno=True)
+        clock_gettime = librt.clock_gettime
+        clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+        ts = timespec()
+        if clock_gettime(1, ctypes.byref(ts)) != 0: # CLOCK_MONOTONIC
+            return time.time
+    except (ImportError, OSError, AttributeError):
+        return time.time
+
+    def monotonic():
+        clock_gettime(1, ctypes.byref(ts))
+        return ts.tv_sec + ts.tv_nsec * 1e-9
+    return monotonic
+
+monotonic = _make_monotonic_clock()
+
+
+POLL_READ = 1   # Same values as select.POLLIN/POLLOUT and
+POLL_WRITE = 4  # select.EPOLLIN/EPOLLOUT.
+_POLL_ERROR = 8 | 16 # POLLERR | POLLHUP
+# How long SelectPoller sleeps when asked to wait on nothing forever.
+_IDLE_SLEEP = 1.0
+
+# socket.error codes meaning "try again later" on a non-blocking socket.
+_WOULD_BLOCK = (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR)
+
+class EpollPoller:
+    """Poller backend using select.epoll (Linux).
+
+    All pollers have the same interface: file descriptors are
+    registered with a mask of POLL_READ and/or POLL_WRITE, and poll()
+    returns a list of (fd, mask) tuples for the descriptors that are
+    ready.  Errors and hangups are reported as readability, so that
+    the owner finds out when it next reads.
+    """
+    def __init__(self):
+        self._epoll = select.epoll()
+
+    def register(self, fd, events):
+        self._epoll.register(fd, events)
+
+    def modify(self, fd, events):
+        self._epoll.modify(fd, events)
+
+    def unregister(self, fd):
+        try:
+            self._epoll.unregister(fd)
+        except (IOError, OSError, ValueError):
+            pass
+
+    def poll(self, timeout=None):
+        if timeout is None:
+            timeout = -1
+        return [(fd, mask & _POLL_ERROR and (mask | POLL_READ) or mask)
+                for fd, mask in self._epoll.poll(timeout)]
+
+
+class PollPoller:
+    """Poller backend using select.poll.  See EpollPoller."""
+    def __init__(self):
+        self._poll = select.poll()
+
+    def register(self, fd, events):
+        self._poll.register(fd, events)
+
+    def modify(self, fd, events):
+        self._poll.modify(fd, events)
+
+    def unregister(self, fd):
+        try:
+            self._poll.unregister(fd)
+        except KeyError:
+            pass
+
+    def poll(self, timeout=None):
+        if timeout is not None:
+            timeout = int(math.ceil(timeout * 1000))
+        return [(fd, mask & _POLL_ERROR and (mask | POLL_READ) or mask)
+                for fd, mask in self._poll.poll(timeout)]
+
+
+class SelectPoller:
+    """Poller backend using select.select.  See EpollPoller."""
+    def __init__(self):
+        self._fds = {}
+
+    def register(self, fd, events):
+        self._fds[fd] = events
+
+    modify = register
+
+    def unregister(self, fd):
+        self._fds.pop(fd, None)
+
+    def poll(self, timeout=None):
+        if not self._fds:
+            # select() can't wait on no descriptors.  Sleep instead, a
+            # bounded while if there's no timeout, so that a caller
+            # looping on poll doesn't spin.
+            if timeout is None:
+                timeout = _IDLE_SLEEP
+            time.sleep(timeout)
+            return []
+        r = [fd for fd, events in self._fds.items() if events & POLL_READ]
+        w = [fd for fd, events in self._fds.items() if events & POLL_WRITE]
+        (r, w, e) = select.select(r, w, [], timeout)
+        ready = dict.fromkeys(r, POLL_READ)
+        for fd in w:
+            ready[fd] = ready.get(fd, 0) | POLL_WRITE
+        return ready.items()
+
+
+def default_poller():
+    """Return the best poller backend available on this platform."""
+    if hasattr(select, "epoll"):
+        return EpollPoller()
+    if hasattr(select, "poll"):
+        return PollPoller()
+    return SelectPoller()
+
+
 class IRC:
     """Class that handles one or several IRC server connections.
 
@@ -100,13 +241,13 @@ class IRC:
     Connection objects that represent the IRC connections.  The
     responsibility of the IRC object is to provide an event-driven
     framework for the connections and to keep the connections alive.
-    It runs a select loop to poll each connection's TCP socket and
-    hands over the sockets with incoming data for processing by the
+    It runs a poll loop over each connection's TCP socket and hands
+    over the sockets with incoming data for processing by the
     corresponding connection.
 
     The methods of most interest for an IRC client writer are server,
     add_global_handler, remove_global_handler, execute_at,
-    execute_delayed, process_once and process_forever.
+    execute_delayed, execute_every, process_once and process_forever.
 
     Here is an example:
 
@@ -123,7 +264,8 @@ class IRC:
 
     def __init__(self, fn_to_add_socket=None,
                  fn_to_remove_socket=None,
-                 fn_to_add_timeout=None):
+                 fn_to_add_timeout=None,
+                 poller=None):
         """Constructor for IRC objects.
 
         Optional arguments are fn_to_add_socket, fn_to_remove_socket
@@ -141,10 +283,19 @@ class IRC:
 
         The three arguments mainly exist to be able to use an external
         main loop (for example Tkinter's or PyGTK's main app loop)
-        instead of calling the process_forever method.
+        instead of calling the process_forever method.  Pass the IRC
+        object to SimpleIRCClient (or a subclass) to run a bot inside
+        such a loop.  Outgoing data is flushed by process_data and
+        process_timeout, and fn_to_add_timeout is also used to ask for
+        a flush when data is queued outside of them.
 
         An alternative is to just call ServerConnection.process_once()
         once in a while.
+
+        The poller argument selects the backend used by process_once
+        (one of EpollPoller, PollPoller and SelectPoller, or anything
+        with the same interface).  By default the best one available
+        is used.
         """
 
         if fn_to_add_socket and fn_to_remove_socket:
@@ -155,9 +306,16 @@ class IRC:
             self.fn_to_remove_socket = None
 
         self.fn_to_add_timeout = fn_to_add_timeout
+        self.poller = poller or default_poller()
         self.connections = []
+        self.fd_map = {} # file descriptor -> Connection
         self.handlers = {}
-        self.delayed_commands = [] # list of tuples in the format (time, function, arguments)
+        self.handler_chains = {}
+        self.delayed_commands = [] # heap of lists in the format [time, sequence, DelayedCommand]
+        self._delayed_sequence = 0
+        self._stale_commands = 0
+        self._unflushed = [] # connections with queued output
+        self._flush_command = DelayedCommand(self, self.flush_output)
 
         self.add_global_handler("ping", _ping_ponger, -42)
 
@@ -173,60 +331,128 @@ class IRC:
 
         Arguments:
 
-            sockets -- A list of socket objects.
+            sockets -- A list of socket objects (or file descriptors).
 
         See documentation for IRC.__init__.
         """
+        fd_map = self.fd_map
         for s in sockets:
-            for c in self.connections:
-                if s == c._get_socket():
-                    c.process_data()
+            if not isinstance(s, int):
+                s = s.fileno()
+            c = fd_map.get(s)
+            if c is not None:
+                c.process_data()
+        if self._unflushed:
+            self.flush_output()
 
     def process_timeout(self):
         """Called when a timeout notification is due.
 
         See documentation for IRC.__init__.
         """
-        t = time.time()
-        while self.delayed_commands:
-            if t >= self.delayed_commands[0][0]:
-                self.delayed_commands[0][1](*self.delayed_commands[0][2])
-                del self.delayed_commands[0]
-            else:
-                break
+        t = monotonic()
+        queue = self.delayed_commands
+        while queue and t >= queue[0][0]:
+            at, sequence, command = heapq.heappop(queue)
+            if command._sequence != sequence:
+                # Cancelled or rescheduled since this entry was pushed.
+                self._stale_commands -= 1
+                continue
+            command._sequence = None
+            if command.interval is not None:
+                # Keep recurring commands in phase, but don't try to
+                # catch up on runs missed while the loop was stalled.
+                at = at + command.interval
+                if at <= t:
+                    at = t + command.interval
+                self._schedule(command, at)
+            command.function(*command.arguments)
+        if self._unflushed:
+            self.flush_output()
 
     def process_once(self, timeout=0):
         """Process data from connections once.
 
         Arguments:
 
-            timeout -- How long the select() call should wait if no
-                       data is available.
+            timeout -- How long the poll should wait if no data is
+                       available.  None means wait until there is.
 
         This method should be called periodically to check and process
         incoming data, if there are any.  If that seems boring, look
         at the process_forever method.
         """
-        sockets = map(lambda x: x._get_socket(), self.connections)
-        sockets = filter(lambda x: x != None, sockets)
-        if sockets:
-            (i, o, e) = select.select(sockets, [], [], timeout)
-            self.process_data(i)
-        else:
-            time.sleep(timeout)
+        fd_map = self.fd_map
+        for fd, mask in self.poller.poll(timeout):
+            # The connection may have gone away while handling an
+            # earlier socket.  Writability needs no handling of its
+            # own: process_timeout flushes all queued output.
+            c = fd_map.get(fd)
+            if c is not None and mask & POLL_READ:
+                c.process_data()
         self.process_timeout()
 
-    def process_forever(self, timeout=0.2):
+    def flush_output(self):
+        """Send output queued on the connections.
+
+        Lines sent on a connection are queued and written together
+        with as few send() calls as possible at the end of each
+        process_data/process_timeout call, so there is normally no
+        need to call this method.  A connection whose socket doesn't
+        take everything is polled for writability and flushed again
+        when it can take more.
+        """
+        self._flush_command.cancel()
+        connections = self._unflushed
+        self._unflushed = []
+        for c in connections:
+            if c._fd is None:
+                # Disconnected after queueing.
+                c._outgoing = []
+            elif c._flush_output():
+                if c._polling_write:
+                    self._poll_write(c, 0)
+            else:
+                self._unflushed.append(c)
+                if not c._polling_write:
+                    self._poll_write(c, 1)
+        if self._unflushed and self.fn_to_add_socket:
+            # An external main loop only tells us about readable
+            # sockets, so retry blocked connections on a timer.
+            self._schedule(self._flush_command, monotonic() + 0.1)
+
+    def process_forever(self, timeout=None):
         """Run an infinite loop, processing data from connections.
 
-        This method repeatedly calls process_once.
+        This method repeatedly calls process_once, sleeping until
+        data arrives or the next delayed command is due.
 
         Arguments:
 
-            timeout -- Parameter to pass to process_once.
+            timeout -- Upper limit on each wait, or None for no limit.
         """
         while 1:
-            self.process_once(timeout)
+            self.process_once(self.time_to_next_command(timeout))
+
+    def time_to_next_command(self, timeout=None):
+        """Return the number of seconds until the next delayed command
+        is due.
+
+        Arguments:
+
+            timeout -- Value to return if no command is due sooner.
+                       None means no limit.
+        """
+        queue = self.delayed_commands
+        while queue and queue[0][2]._sequence != queue[0][1]:
+            heapq.heappop(queue)
+            self._stale_commands -= 1
+        if not queue:
+            return timeout
+        delay = max(queue[0][0] - monotonic(), 0)
+        if timeout is not None and timeout < delay:
+            return timeout
+        return delay
 
     def disconnect_all(self, message=""):
         """Disconnects all connections."""
@@ -258,6 +484,7 @@ class IRC:
         if not event in self.handlers:
             self.handlers[event] = []
         bisect.insort(self.handlers[event], ((priority, handler)))
+        self.handler_chains.clear()
 
     def remove_global_handler(self, event, handler):
         """Removes a global handler function.
@@ -272,11 +499,24 @@ class IRC:
         """
         if not event in self.handlers:
             return 0
-        for h in self.handlers[event]:
-            if handler == h[1]:
-                self.handlers[event].remove(h)
+        handlers = [h for h in self.handlers[event] if handler != h[1]]
+        if handlers:
+            self.handlers[event] = handlers
+        else:
+            # Only subscribed event types are kept; see has_handlers.
+            del self.handlers[event]
+        self.handler_chains.clear()
         return 1
 
+    def has_handlers(self, eventtype):
+        """Check whether any global handler would see an event type.
+
+        Connections don't create events (or do the decoding leading up
+        to them) that nobody would see.
+        """
+        handlers = self.handlers
+        return "all_events" in handlers or eventtype in handlers
+
     def execute_at(self, at, function, arguments=()):
         """Execute a function at a specified time.
 
@@ -287,8 +527,11 @@ class IRC:
             function -- Function to call.
 
             arguments -- Arguments to give the function.
+
+        Returns a DelayedCommand object that can be used to cancel or
+        reschedule the call.
         """
-        self.execute_delayed(at-time.time(), function, arguments)
+        return self.execute_delayed(at-time.time(), function, arguments)
 
     def execute_delayed(self, delay, function, arguments=()):
         """Execute a function after a specified time.
@@ -300,10 +543,61 @@ class IRC:
             function -- Function to call.
 
             arguments -- Arguments to give the function.
+
+        Returns a DelayedCommand object that can be used to cancel or
+        reschedule the call.
+        """
+        command = DelayedCommand(self, function, arguments)
+        self._schedule(command, monotonic() + delay)
+        return command
+
+    def execute_every(self, period, function, arguments=()):
+        """Execute a function periodically.
+
+        Arguments:
+
+            period -- How many seconds to wait between calls.  The
+                      first call is made after one period.
+
+            function -- Function to call.
+
+            arguments -- Arguments to give the function.
+
+        Returns a DelayedCommand object; the calls go on until it is
+        cancelled.
         """
-        bisect.insort(self.delayed_commands, (delay+time.time(), function, arguments))
+        if period <= 0:
+            raise ValueError("period must be positive")
+        command = DelayedCommand(self, function, arguments, period)
+        self._schedule(command, monotonic() + period)
+        return command
+
+    def _schedule(self, command, at):
+        """[Internal]"""
+        if command._sequence is not None:
+            # Already queued; the old heap entry goes stale.
+            self._stale_commands += 1
+        self._delayed_sequence += 1
+        command._sequence = self._delayed_sequence
+        command.at = at
+        heapq.heappush(self.delayed_commands,
+                       [at, self._delayed_sequence, command])
         if self.fn_to_add_timeout:
-            self.fn_to_add_timeout(delay)
+            self.fn_to_add_timeout(max(at - monotonic(), 0))
+
+    def _unschedule(self, command):
+        """[Internal]"""
+        if command._sequence is None:
+            return
+        command._sequence = None
+        self._stale_commands += 1
+        # Cancelled entries are dropped lazily when they reach the top
+        # of the heap; rebuild it if they start to dominate.
+        queue = self.delayed_commands
+        if self._stale_commands > 32 and self._stale_commands * 2 > len(queue):
+            queue[:] = [x for x in queue if x[2]._sequence == x[1]]
+            heapq.heapify(queue)
+            self._stale_commands = 0
 
     def dcc(self, dcctype="chat"):
         """Creates and returns a DCCConnection object.
@@ -321,18 +615,119 @@ class IRC:
 
     def _handle_event(self, connection, event):
         """[Internal]"""
-        h = self.handlers
-        for handler in h.get("all_events", []) + h.get(event.eventtype(), []):
-            if handler[1](connection, event) == "NO MORE":
+        eventtype = event.eventtype()
+        try:
+            chain = self.handler_chains[eventtype]
+        except KeyError:
+            chain = self._compile_chain(eventtype)
+        for handler in chain:
+            if handler(connection, event) == "NO MORE":
                 return
 
+    def _compile_chain(self, eventtype):
+        """[Internal] Build the tuple of handlers called for an event type.
+
+        The chains are dropped whenever a global handler is added or
+        removed, and rebuilt on the next event of each type.
+        """
+        h = self.handlers
+        chain = tuple([handler for priority, handler
+                       in h.get("all_events", []) + h.get(eventtype, [])])
+        self.handler_chains[eventtype] = chain
+        return chain
+
+    def _output_queued(self, connection):
+        """[Internal] Note that a connection has output to flush."""
+        self._unflushed.append(connection)
+        if not self._flush_command.is_pending():
+            # For output queued outside process_data/process_timeout,
+            # e.g. from code driving the connection directly.
+            self._schedule(self._flush_command, monotonic())
+
+    def _poll_write(self, connection, flag):
+        """[Internal] Turn polling for writability on or off."""
+        connection._polling_write = flag
+        if flag:
+            self.poller.modify(connection._fd, POLL_READ | POLL_WRITE)
+        else:
+            self.poller.modify(connection._fd, POLL_READ)
+
     def _remove_connection(self, connection):
         """[Internal]"""
         self.connections.remove(connection)
+        self._remove_socket(connection)
+
+    def _add_socket(self, connection):
+        """[Internal] Start polling the connection's socket."""
+        sock = connection._get_socket()
+        fd = sock.fileno()
+        connection._fd = fd
+        self.fd_map[fd] = connection
+        self.poller.register(fd, POLL_READ)
+        if self.fn_to_add_socket:
+            self.fn_to_add_socket(sock)
+
+    def _remove_socket(self, connection):
+        """[Internal] Stop polling the connection's socket.
+
+        Must be called before the socket is closed.
+        """
+        fd = connection._fd
+        if fd is None:
+            return
+        connection._fd = None
+        connection._polling_write = 0
+        if self.fd_map.get(fd) is connection:
+            del self.fd_map[fd]
+            self.poller.unregister(fd)
         if self.fn_to_remove_socket:
             self.fn_to_remove_socket(connection._get_socket())
 
-_rfc_1459_command_regexp = re.compile("^(:(?P<prefix>[^ ]+) +)?(?P<command>[^ ]+)( *(?P<argument> .+))?")
+class DelayedCommand:
+    """A function call scheduled by IRC.execute_at, IRC.execute_delayed
+    or IRC.execute_every.
+
+    Instance attributes:
+
+        function -- The function to call.
+
+        arguments -- Arguments to give the function.
+
+        interval -- Seconds between calls for recurring commands,
+                    otherwise None.
+
+        at -- When the next call is due, on the clock returned by
+              irclib.monotonic().
+    """
+    def __init__(self, irclibobj, function, arguments=(), interval=None):
+        self.irclibobj = irclibobj
+        self.function = function
+        self.arguments = arguments
+        self.interval = interval
+        self.at = None
+        self._sequence = None
+
+    def cancel(self):
+        """Cancel the call.  Does nothing if it has already been made."""
+        self.irclibobj._unschedule(self)
+
+    def reschedule(self, delay):
+        """Move the next call to delay seconds from now.
+
+        This works on commands that have already been run or
+        cancelled as well; they are queued again.
+        """
+        self.irclibobj._schedule(self, monotonic() + delay)
+
+    def is_pending(self):
+        """Return true if the call is still queued."""
+        return self._sequence is not None
+
+    def time_left(self):
+        """Return the number of seconds until the next call, or None."""
+        if self._sequence is None:
+            return None
+        return max(self.at - monotonic(), 0)
 
 
 class Connection:
@@ -342,18 +737,57 @@ class Connection:
     """
     def __init__(self, irclibobj):
         self.irclibobj = irclibobj
+        self._fd = None
+        self._outgoing = [] # strings waiting to be sent
+        self._polling_write = 0
 
     def _get_socket():
         raise IRCError, "Not overridden"
 
+    def _queue_output(self, data):
+        """[Internal] Queue data to be sent when the IRC object flushes."""
+        if not self._outgoing:
+            self.irclibobj._output_queued(self)
+        self._outgoing.append(data)
+
+    def _flush_output(self):
+        """[Internal] Send as much queued output as the socket takes.
+
+        Returns true if nothing is left in the queue.
+        """
+        if not self._outgoing:
+            return 1
+        if len(self._outgoing) == 1:
+            data = self._outgoing[0]
+        else:
+            data = "".join(self._outgoing)
+        try:
+            n = self.socket.send(data)
+        except socket.error, x:
+            if x.args[0] in _WOULD_BLOCK:
+                n = 0
+            else:
+                # Ouch!
+                self._outgoing = []
+                self.disconnect("Connection reset by peer.")
+                return 1
+        if n < len(data):
+            self._outgoing = [data[n:]]
+            return 0
+        self._outgoing = []
+        return 1
+
     ##############################
     ### Convenience wrappers.
 
     def execute_at(self, at, function, arguments=()):
-        self.irclibobj.execute_at(at, function, arguments)
+        return self.irclibobj.execute_at(at, function, arguments)
 
     def execute_delayed(self, delay, function, arguments=()):
-        self.irclibobj.execute_delayed(delay, function, arguments)
+        return self.irclibobj.execute_delayed(delay, function, arguments)
+
+    def execute_every(self, period, function, arguments=()):
+        return self.irclibobj.execute_every(period, function, arguments)
 
 
 class ServerConnectionError(IRCError):
@@ -363,21 +797,236 @@ class ServerNotConnectedError(ServerConnectionError):
     pass
 
 
-# Huh!?  Crrrrazy EFNet doesn't follow the RFC: their ircd seems to
-# use \n as message separator!  :P
-_linesep_regexp = re.compile("\r?\n")
+class LineBuffer:
+    """Splits data read from a socket into lines.
+
+    Data is received straight into a reusable bytearray, and only the
+    bytes that arrived since the last call are scanned for line
+    separators, so a line that trickles in over many reads is neither
+    copied nor rescanned repeatedly.  Lines may be terminated by LF or
+    CR LF.
+
+    Typical use:
+
+        if not buffer.read_from(sock):
+            # EOF
+        for line in buffer.lines():
+            ...
+        if buffer.pending() > buffer.max_line_length:
+            # The peer is sending an endless line.
+    """
+    def __init__(self, max_line_length=2**14, read_size=2**14):
+        """Constructor for LineBuffer objects.
+
+        Arguments:
+
+            max_line_length -- Longest line (excluding separator) the
+                               buffer makes room for.
+
+            read_size -- Number of bytes to ask for on each read.
+        """
+        self.max_line_length = max_line_length
+        self.read_size = read_size
+        self._buffer = bytearray(max_line_length + read_size)
+        self._view = memoryview(self._buffer)
+        self._start = 0 # Start of the unfinished line.
+        self._scan = 0  # Where to continue looking for a separator.
+        self._end = 0   # End of the received data.
+        self._discarding = 0
+
+    def read_from(self, sock):
+        """Receive data from a socket into the buffer.
+
+        Returns the number of bytes read; 0 means the peer has closed
+        the connection.  Socket errors are passed on.
+        """
+        if self._start == self._end:
+            self._start = self._scan = self._end = 0
+        elif len(self._buffer) - self._end < self.read_size:
+            # Move the unfinished line to the front to make room.
+            n = self._end - self._start
+            self._buffer[:n] = self._buffer[self._start:self._end]
+            self._scan = self._scan - self._start
+            self._start = 0
+            self._end = n
+        room = min(self.read_size, len(self._buffer) - self._end)
+        n = sock.recv_into(self._view[self._end:], room)
+        self._end = self._end + n
+        return n
+
+    def lines(self):
+        """Return a list of the complete lines received so far."""
+        buffer = self._buffer
+        view = self._view
+        start = self._start
+        end = self._end
+        lines = []
+        i = buffer.find("\n", self._scan, end)
+        while i >= 0:
+            j = i
+            if j > start and buffer[j-1] == 13: # CR
+                j = j - 1
+            if self._discarding:
+                self._discarding = 0
+            else:
+                lines.append(view[start:j].tobytes())
+            start = i + 1
+            i = buffer.find("\n", start, end)
+        self._start = start
+        self._scan = end
+        return lines
+
+    def pending(self):
+        """Return the length of the unfinished line in the buffer."""
+        return self._end - self._start
+
+    def discard_pending(self):
+        """Throw away the unfinished line, including the part of it
+        that hasn't been received yet."""
+        self._discarding = 1
+        self._start = self._scan = self._end = 0
+
+    def clear(self):
+        """Throw away everything in the buffer."""
+        self._discarding = 0
+        self._start = self._scan = self._end = 0
+
+class ServerFeatures:
+    """Capabilities of a server, as advertised in RPL_ISUPPORT
+    (numeric 005).
+
+    Instance attributes, with the values assumed until the server
+    says otherwise:
+
+        modes -- How many modes with a parameter one MODE command may
+                 change (3).  None means no limit.
+
+        targmax -- Dictionary mapping command names (upper case) to
+                   the number of targets they accept, None meaning
+                   no limit.  None if TARGMAX wasn't advertised.
+
+        maxtargets -- Target limit from MAXTARGETS, which older
+                      servers send instead of TARGMAX (None).
+
+        casemapping -- "rfc1459", "strict-rfc1459" or "ascii".
+
+        nicklen -- Maximum nickname length (9).
+
+        prefix -- Channel membership modes and the matching nick
+                  prefixes, as a tuple of two strings (("ov", "@+")).
+
+        chanmodes -- Channel modes in the four CHANMODES groups: list
+                     modes, modes that always take a parameter, modes
+                     that take one only when set, and flags.
+
+        linelen -- Maximum length of a line, including CR LF (512).
+
+        raw -- Dictionary mapping all advertised feature names to
+               their values as strings (empty for features that
+               have no value).
+    """
+    def __init__(self):
+        self.raw = {}
+        self._parse()
+
+    def update(self, tokens):
+        """Record the tokens from an RPL_ISUPPORT message."""
+        for token in tokens:
+            if token.startswith("-"):
+                self.raw.pop(token[1:], None)
+            elif "=" in token:
+                name, value = token.split("=", 1)
+                self.raw[name] = value
+            else:
+                self.raw[token] = ""
+        self._parse()
+
+    def _parse(self):
+        """[Internal] Set the attributes from the raw features."""
+        raw = self.raw
+        self.modes = _parse_limit(raw.get("MODES"), 3)
+        self.maxtargets = _parse_limit(raw.get("MAXTARGETS"), None)
+        self.nicklen = _parse_limit(raw.get("NICKLEN"), 9) or 9
+        self.linelen = _parse_limit(raw.get("LINELEN"), 512) or 512
+        self.casemapping = raw.get("CASEMAPPING", "").lower()
+        if self.casemapping not in _casemappings:
+            self.casemapping = "rfc1459"
+
+        self.targmax = None
+        if "TARGMAX" in raw:
+            self.targmax = {}
+            for entry in raw["TARGMAX"].split(","):
+                if entry:
+                    name, limit = (entry.split(":", 1) + [""])[:2]
+                    self.targmax[name.upper()] = _parse_limit(limit, 1)
+
+        self.prefix = ("ov", "@+")
+        value = raw.get("PREFIX")
+        if value is not None:
+            if value.startswith("(") and ")" in value:
+                modes, symbols = value[1:].split(")", 1)
+                if len(modes) == len(symbols):
+                    self.prefix = (modes, symbols)
+            elif not value:
+                self.prefix = ("", "")
+
+        self.chanmodes = ("b", "k", "l", "imnpst")
+        value = raw.get("CHANMODES")
+        if value:
+            self.chanmodes = tuple((value.split(",") + ["", "", ""])[:4])
+
+    def max_targets(self, command):
+        """Return how many targets the server accepts in one command.
+
+        Uses TARGMAX, or MAXTARGETS on older servers.  If the server
+        advertised neither, or TARGMAX doesn't list the command, 1 is
+        returned.  None means that there is no limit.
+        """
+        if self.targmax is not None:
+            return self.targmax.get(command.upper(), 1)
+        return self.maxtargets or 1
+
+    def lower(self, s):
+        """Returns s lowercased according to the server's CASEMAPPING."""
+        return irc_lower(s, self.casemapping)
+
+def _parse_limit(value, default):
+    """[Internal] Parse a numeric feature value.
+
+    Returns default if the feature is missing or malformed, and None
+    (no limit) if it has an empty value.
+    """
+    if value is None:
+        return default
+    if not value:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        return default
+
+# Used for the parts of our own hostmask that we don't know.
+_MAX_USER_LENGTH = 11 # USERLEN 10, plus "~" for unverified idents.
+_MAX_HOST_LENGTH = 63
 
 class ServerConnection(Connection):
     """This class represents an IRC server connection.
 
     ServerConnection objects are instantiated by calling the server
     method on an IRC object.
+
+    The features advertised by the server in RPL_ISUPPORT (numeric
+    005) are kept in the features attribute, a ServerFeatures
+    object.
     """
 
     def __init__(self, irclibobj):
         Connection.__init__(self, irclibobj)
         self.connected = 0  # Not connected yet.
         self.socket = None
+        self.features = ServerFeatures()
+        self.real_nickname = ""
+        self.real_userhost = ""
 
     def connect(self, server, port, nickname, password=None, username=None,
                 ircname=None, localaddress="", localport=0):
@@ -408,10 +1057,12 @@ class ServerConnection(Connection):
         if self.connected:
             self.disconnect("Changing servers")
 
-        self.previous_buffer = ""
+        self.buffer = LineBuffer()
         self.handlers = {}
+        self.features = ServerFeatures()
         self.real_server_name = ""
         self.real_nickname = nickname
+        self.real_userhost = ""
         self.server = server
         self.port = port
         self.nickname = nickname
@@ -429,15 +1080,17 @@ class ServerConnection(Connection):
             self.socket.close()
             self.socket = None
             raise ServerConnectionError, "Couldn't connect to socket: %s" % x
+        self.socket.setblocking(0)
         self.connected = 1
-        if self.irclibobj.fn_to_add_socket:
-            self.irclibobj.fn_to_add_socket(self.socket)
+        self._outgoing = []
+        self.irclibobj._add_socket(self)
 
         # Log on...
         if self.password:
             self.pass_(self.password)
         self.nick(self.nickname)
         self.user(self.username, self.ircname)
+        self.irclibobj.flush_output()
         return self
 
     def close(self):
@@ -478,22 +1131,25 @@ class ServerConnection(Connection):
     def process_data(self):
         """[Internal]"""
 
+        # Huh!?  Crrrrazy EFNet doesn't follow the RFC: their ircd seems
+        # to use \n as message separator!  :P  LineBuffer handles both.
         try:
-            new_data = self.socket.recv(2**14)
+            new_bytes = self.buffer.read_from(self.socket)
         except socket.error, x:
+            if x.args[0] in _WOULD_BLOCK:
+                return
             # The server hung up.
             self.disconnect("Connection reset by peer")
             return
-        if not new_data:
+        if not new_bytes:
             # Read nothing: connection must be down.
             self.disconnect("Connection reset by peer")
             return
 
-        lines = _linesep_regexp.split(self.previous_buffer + new_data)
-
-        # Save the last, unfinished line.
-        self.previous_buffer = lines[-1]
-        lines = lines[:-1]
+        lines = self.buffer.lines()
+        if self.buffer.pending() > self.buffer.max_line_length:
+            # Nothing sane is that long; skip to the next line.
+            self.buffer.discard_pending()
 
         for line in lines:
             if DEBUG:
@@ -502,32 +1158,16 @@ class ServerConnection(Connection):
             if not line:
                 continue
 
-            prefix = None
-            command = None
-            arguments = None
-            self._handle_event(Event("all_raw_messages",
-                                     self.get_server_name(),
-                                     None,
-                                     [line]))
-
-            m = _rfc_1459_command_regexp.match(line)
-            if m.group("prefix"):
-                prefix = m.group("prefix")
-                if not self.real_server_name:
-                    self.real_server_name = prefix
-
-            if m.group("command"):
-                command = m.group("command").lower()
-
-            if m.group("argument"):
-                a = m.group("argument").split(" :", 1)
-                arguments = a[0].split()
-                if len(a) == 2:
-                    arguments.append(a[1])
-
-            # Translate numerics into more readable strings.
-            if command in numeric_events:
-                command = numeric_events[command]
+            wants = self._wants_event
+            if wants("all_raw_messages"):
+                self._handle_event(Event("all_raw_messages",
+                                         self.get_server_name(),
+                                         None,
+                                         [line]))
+
+            tags, prefix, command, arguments = _parse_message(line)
+            if prefix and not self.real_server_name:
+                self.real_server_name = prefix
 
             if command == "nick":
                 if nm_to_n(prefix) == self.real_nickname:
@@ -536,39 +1176,62 @@ class ServerConnection(Connection):
                 # Record the nickname in case the client changed nick
                 # in a nicknameinuse callback.
                 self.real_nickname = arguments[0]
+            elif command == "join":
+                if prefix and "!" in prefix \
+                   and nm_to_n(prefix) == self.real_nickname:
+                    # How the server shows us to others.
+                    self.real_userhost = nm_to_uh(prefix)
+            elif command == "396" and len(arguments) > 1:
+                # RPL_HOSTHIDDEN: our host has been cloaked.
+                if self.real_userhost:
+                    self.real_userhost = "%s@%s" % (
+                        self.real_userhost.split("@")[0], arguments[1])
+            elif command == "featurelist":
+                # RPL_ISUPPORT: nick, tokens..., "are supported by ..."
+                self.features.update(arguments[1:-1])
 
             if command in ["privmsg", "notice"]:
                 target, message = arguments[0], arguments[1]
-                messages = _ctcp_dequote(message)
 
                 if command == "privmsg":
                     if is_channel(target):
                         command = "pubmsg"
+                    ctcp_command = "ctcp"
                 else:
                     if is_channel(target):
                         command = "pubnotice"
                     else:
                         command = "privnotice"
+                    ctcp_command = "ctcpreply"
 
-                for m in messages:
-                    if type(m) is types.TupleType:
-                        if command in ["privmsg", "pubmsg"]:
-                            command = "ctcp"
-                        else:
-                            command = "ctcpreply"
-
-                        m = list(m)
+                if _CTCP_DELIMITER not in message and _LOW_LEVEL_QUOTE not in message:
+                    # Plain text, the common case.
+                    if wants(command):
                         if DEBUG:
                             print "command: %s, source: %s, target: %s, arguments: %s" % (
-                                command, prefix, target, m)
-                        self._handle_event(Event(command, prefix, target, m))
-                        if command == "ctcp" and m[0] == "ACTION":
-                            self._handle_event(Event("action", prefix, target, m[1:]))
-                    else:
+                                command, prefix, target, [message])
+                        self._handle_event(Event(command, prefix, target, [message], tags))
+                    continue
+
+                if not (wants(command) or wants(ctcp_command) or wants("action")):
+                    continue
+
+                for m in _ctcp_dequote(message):
+                    if type(m) is types.TupleType:
+                        command = ctcp_command
+                        m = list(m)
+                        if wants(command):
+                            if DEBUG:
+                                print "command: %s, source: %s, target: %s, arguments: %s" % (
+                                    command, prefix, target, m)
+                            self._handle_event(Event(command, prefix, target, m, tags))
+                        if command == "ctcp" and m[0] == "ACTION" and wants("action"):
+                            self._handle_event(Event("action", prefix, target, m[1:], tags))
+                    elif wants(command):
                         if DEBUG:
                             print "command: %s, source: %s, target: %s, arguments: %s" % (
                                 command, prefix, target, [m])
-                        self._handle_event(Event(command, prefix, target, [m]))
+                        self._handle_event(Event(command, prefix, target, [m], tags))
             else:
                 target = None
 
@@ -584,10 +1247,51 @@ class ServerConnection(Connection):
                     if not is_channel(target):
                         command = "umode"
 
+                if not wants(command):
+                    continue
                 if DEBUG:
                     print "command: %s, source: %s, target: %s, arguments: %s" % (
                         command, prefix, target, arguments)
-                self._handle_event(Event(command, prefix, target, arguments))
+                self._handle_event(Event(command, prefix, target, arguments, tags))
+
+    def max_targets(self, command):
+        """Return how many targets the server accepts in one command.
+
+        See ServerFeatures.max_targets.
+        """
+        return self.features.max_targets(command)
+
+    def _send_message(self, command, targets, longest_target, text):
+        """[Internal] Send a PRIVMSG or NOTICE, split to fit in lines."""
+        if type(text) is types.UnicodeType:
+            text = text.encode("utf-8")
+        budget = self.message_budget(command, longest_target)
+        if len(text) <= budget or text[:1] == _CTCP_DELIMITER:
+            self.send_raw("%s %s :%s" % (command, targets, text))
+        else:
+            for piece in split_message(text, budget):
+                self.send_raw("%s %s :%s" % (command, targets, piece))
+
+    def message_budget(self, command, target):
+        """Return how long the text of a PRIVMSG or NOTICE may be.
+
+        Recipients get the message with our hostmask prepended, and
+        the whole line must fit in 512 bytes.  The hostmask is picked
+        up when we join a channel; until then the longest likely user
+        and host names are assumed.
+        """
+        # ":nick!user@host COMMAND target :text\r\n"
+        if self.real_userhost:
+            userhost = len(self.real_userhost)
+        else:
+            userhost = _MAX_USER_LENGTH + 1 + _MAX_HOST_LENGTH
+        prefix = 1 + len(self.real_nickname) + 1 + userhost + 1
+        return self.features.linelen - prefix - len(command) - 1 \
+               - len(target) - 2 - 2
+
+    def _wants_event(self, eventtype):
+        """[Internal] Check if any handler would see an event type."""
+        return eventtype in self.handlers or self.irclibobj.has_handlers(eventtype)
 
     def _handle_event(self, event):
         """[Internal]"""
@@ -647,7 +1351,11 @@ class ServerConnection(Connection):
         self.connected = 0
 
         self.quit(message)
+        # Best effort; the socket won't wait for the rest.
+        self._flush_output()
+        self._outgoing = []
 
+        self.irclibobj._remove_socket(self)
         try:
             self.socket.close()
         except socket.error, x:
@@ -723,9 +1431,20 @@ class ServerConnection(Connection):
         self.send_raw("NICK " + newnick)
 
     def notice(self, target, text):
-        """Send a NOTICE command."""
-        # Should limit len(text) here!
-        self.send_raw("NOTICE %s :%s" % (target, text))
+        """Send a NOTICE command.
+
+        Text too long for one message is split over several; see
+        split_message.
+        """
+        self._send_message("NOTICE", target, target, text)
+
+    def notice_many(self, targets, text):
+        """Send a NOTICE command to multiple targets."""
+        longest = targets[0]
+        for target in targets:
+            if len(target) > len(longest):
+                longest = target
+        self._send_message("NOTICE", ",".join(targets), longest, text)
 
     def oper(self, nick, password):
         """Send an OPER command."""
@@ -751,14 +1470,20 @@ class ServerConnection(Connection):
         self.send_raw("PONG %s%s" % (target, target2 and (" " + target2)))
 
     def privmsg(self, target, text):
-        """Send a PRIVMSG command."""
-        # Should limit len(text) here!
-        self.send_raw("PRIVMSG %s :%s" % (target, text))
+        """Send a PRIVMSG command.
+
+        Text too long for one message is split over several; see
+        split_message.
+        """
+        self._send_message("PRIVMSG", target, target, text)
 
     def privmsg_many(self, targets, text):
         """Send a PRIVMSG command to multiple targets."""
-        # Should limit len(text) here!
-        self.send_raw("PRIVMSG %s :%s" % (",".join(targets), text))
+        longest = targets[0]
+        for target in targets:
+            if len(target) > len(longest):
+                longest = target
+        self._send_message("PRIVMSG", ",".join(targets), longest, text)
 
     def quit(self, message=""):
         """Send a QUIT command."""
@@ -775,17 +1500,15 @@ class ServerConnection(Connection):
     def send_raw(self, string):
         """Send raw string to the server.
 
-        The string will be padded with appropriate CR LF.
+        The string will be padded with appropriate CR LF.  It is
+        queued and sent when the IRC object next flushes its output,
+        normally at the end of the current event loop iteration.
         """
         if self.socket is None:
             raise ServerNotConnectedError, "Not connected."
-        try:
-            self.socket.send(string + "\r\n")
-            if DEBUG:
-                print "TO SERVER:", string
-        except socket.error, x:
-            # Ouch!
-            self.disconnect("Connection reset by peer.")
+        self._queue_output(string + "\r\n")
+        if DEBUG:
+            print "TO SERVER:", string
 
     def squit(self, server, comment=""):
         """Send an SQUIT command."""
@@ -876,7 +1599,7 @@ class DCCConnection(Connection):
         self.peeraddress = socket.gethostbyname(address)
         self.peerport = port
         self.socket = None
-        self.previous_buffer = ""
+        self.buffer = LineBuffer()
         self.handlers = {}
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.passive = 0
@@ -884,9 +1607,10 @@ class DCCConnection(Connection):
             self.socket.connect((self.peeraddress, self.peerport))
         except socket.error, x:
             raise DCCConnectionError, "Couldn't connect to socket: %s" % x
+        self.socket.setblocking(0)
         self.connected = 1
-        if self.irclibobj.fn_to_add_socket:
-            self.irclibobj.fn_to_add_socket(self.socket)
+        self._outgoing = []
+        self.irclibobj._add_socket(self)
         return self
 
     def listen(self):
@@ -899,7 +1623,7 @@ class DCCConnection(Connection):
         peer, the peer address and port are available as
         self.peeraddress and self.peerport.
         """
-        self.previous_buffer = ""
+        self.buffer = LineBuffer()
         self.handlers = {}
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.passive = 1
@@ -909,6 +1633,7 @@ class DCCConnection(Connection):
             self.socket.listen(10)
         except socket.error, x:
             raise DCCConnectionError, "Couldn't bind socket: %s" % x
+        self.irclibobj._add_socket(self)
         return self
 
     def disconnect(self, message=""):
@@ -922,6 +1647,9 @@ class DCCConnection(Connection):
             return
 
         self.connected = 0
+        self._flush_output()
+        self._outgoing = []
+        self.irclibobj._remove_socket(self)
         try:
             self.socket.close()
         except socket.error, x:
@@ -937,8 +1665,11 @@ class DCCConnection(Connection):
 
         if self.passive and not self.connected:
             conn, (self.peeraddress, self.peerport) = self.socket.accept()
+            self.irclibobj._remove_socket(self)
             self.socket.close()
             self.socket = conn
+            self.socket.setblocking(0)
+            self.irclibobj._add_socket(self)
             self.connected = 1
             if DEBUG:
                 print "DCC connection from %s:%d" % (
@@ -949,8 +1680,13 @@ class DCCConnection(Connection):
             return
 
         try:
-            new_data = self.socket.recv(2**14)
+            if self.dcctype == "chat":
+                new_data = self.buffer.read_from(self.socket)
+            else:
+                new_data = self.socket.recv(2**14)
         except socket.error, x:
+            if x.args[0] in _WOULD_BLOCK:
+                return
             # The server hung up.
             self.disconnect("Connection reset by peer")
             return
@@ -962,15 +1698,11 @@ class DCCConnection(Connection):
         if self.dcctype == "chat":
             # The specification says lines are terminated with LF, but
             # it seems safer to handle CR LF terminations too.
-            chunks = _linesep_regexp.split(self.previous_buffer + new_data)
-
-            # Save the last, unfinished line.
-            self.previous_buffer = chunks[-1]
-            if len(self.previous_buffer) > 2**14:
+            chunks = self.buffer.lines()
+            if self.buffer.pending() > self.buffer.max_line_length:
                 # Bad peer! Naughty peer!
                 self.disconnect()
                 return
-            chunks = chunks[:-1]
         else:
             chunks = [new_data]
 
@@ -996,17 +1728,14 @@ class DCCConnection(Connection):
         """Send data to DCC peer.
 
         The string will be padded with appropriate LF if it's a DCC
-        CHAT session.
+        CHAT session.  Like ServerConnection.send_raw, it is queued
+        and sent when the IRC object flushes its output.
         """
-        try:
-            self.socket.send(string)
-            if self.dcctype == "chat":
-                self.socket.send("\n")
-            if DEBUG:
-                print "TO PEER: %s\n" % string
-        except socket.error, x:
-            # Ouch!
-            self.disconnect("Connection reset by peer.")
+        if self.dcctype == "chat":
+            string = string + "\n"
+        self._queue_output(string)
+        if DEBUG:
+            print "TO PEER: %s\n" % string
 
 class SimpleIRCClient:
     """A simple single-server IRC client class.
@@ -1019,7 +1748,8 @@ class SimpleIRCClient:
     (which is done when the server sends a JOIN messsage/command),
     on_privmsg will be called for "privmsg" events, and so on.  The
     handler methods get two arguments: the connection object (same as
-    self.connection) and the event object.
+    self.connection) and the event object.  Only events that have an
+    on_* method when the object is created are dispatched.
 
     Instance attributes that can be used by sub classes:
 
@@ -1029,18 +1759,33 @@ class SimpleIRCClient:
 
         dcc_connections -- A list of DCCConnection instances.
     """
-    def __init__(self):
-        self.ircobj = IRC()
+    def __init__(self, ircobj=None):
+        """Constructor for SimpleIRCClient objects.
+
+        Arguments:
+
+            ircobj -- The IRC instance to use.  Pass one created with
+                      the main loop hooks (see IRC.__init__) to run
+                      the client inside an external main loop.  By
+                      default a new IRC instance is created.
+        """
+        self.ircobj = ircobj or IRC()
         self.connection = self.ircobj.server()
         self.dcc_connections = []
-        self.ircobj.add_global_handler("all_events", self._dispatcher, -10)
+        self._event_methods = {}
+        for name in dir(self):
+            if name.startswith("on_"):
+                self._event_methods[name[3:]] = getattr(self, name)
+                # Ahead of SingleServerIRCBot's own handlers at -10, as
+                # when this was an "all_events" handler.
+                self.ircobj.add_global_handler(name[3:], self._dispatcher, -15)
         self.ircobj.add_global_handler("dcc_disconnect", self._dcc_disconnect, -10)
 
     def _dispatcher(self, c, e):
         """[Internal]"""
-        m = "on_" + e.eventtype()
-        if hasattr(self, m):
-            getattr(self, m)(c, e)
+        m = self._event_methods.get(e.eventtype())
+        if m is not None:
+            m(c, e)
 
     def _dcc_disconnect(self, c, e):
         self.dcc_connections.remove(c)
@@ -1100,13 +1845,26 @@ class SimpleIRCClient:
         return dcc
 
     def start(self):
-        """Start the IRC client."""
+        """Start the IRC client.
+
+        This runs the IRC object's process_forever loop and does not
+        return.
+        """
         self.ircobj.process_forever()
 
 
-class Event:
-    """Class representing an IRC event."""
-    def __init__(self, eventtype, source, target, arguments=None):
+_UNPARSED = object()
+
+class Event(object):
+    """Class representing an IRC event.
+
+    The nick, user and host parts of the source are split out the
+    first time one of them is asked for, and then remembered.
+    """
+    __slots__ = ("_eventtype", "_source", "_target", "_arguments", "_tags",
+                 "_nick", "_user", "_host")
+
+    def __init__(self, eventtype, source, target, arguments=None, tags=None):
         """Constructor of Event objects.
 
         Arguments:
@@ -1118,6 +1876,8 @@ class Event:
             target -- The target of the event (a nick or a channel).
 
             arguments -- Any event specific arguments.
+
+            tags -- IRCv3 message tags (a dictionary), if any.
         """
         self._eventtype = eventtype
         self._source = source
@@ -1126,6 +1886,8 @@ class Event:
             self._arguments = arguments
         else:
             self._arguments = []
+        self._tags = tags
+        self._nick = _UNPARSED
 
     def eventtype(self):
         """Get the event type."""
@@ -1135,6 +1897,46 @@ class Event:
         """Get the event source."""
         return self._source
 
+    def set_source(self, source):
+        """Replace the event source."""
+        self._source = source
+        self._nick = _UNPARSED
+
+    def _parse_source(self):
+        """[Internal]"""
+        source = self._source
+        if source is None:
+            self._nick = self._user = self._host = None
+            return
+        nick, sep, userhost = source.partition("!")
+        self._nick = nick
+        if sep:
+            self._user, sep, self._host = userhost.partition("@")
+        else:
+            self._user = self._host = None
+
+    def nick(self):
+        """Get the nick part of the source (see nm_to_n).
+
+        For events from a server, this is the server name.  Returns
+        None if the event has no source.
+        """
+        if self._nick is _UNPARSED:
+            self._parse_source()
+        return self._nick
+
+    def user(self):
+        """Get the user part of the source, or None."""
+        if self._nick is _UNPARSED:
+            self._parse_source()
+        return self._user
+
+    def host(self):
+        """Get the host part of the source, or None."""
+        if self._nick is _UNPARSED:
+            self._parse_source()
+        return self._host
+
     def target(self):
         """Get the event target."""
         return self._target
@@ -1143,6 +1945,10 @@ class Event:
         """Get the event arguments."""
         return self._arguments
 
+    def tags(self):
+        """Get the IRCv3 message tags (a dictionary), or None."""
+        return self._tags
+
 _LOW_LEVEL_QUOTE = "\020"
 _CTCP_LEVEL_QUOTE = "\134"
 _CTCP_DELIMITER = "\001"
@@ -1156,6 +1962,14 @@ _low_level_mapping = {
 
 _low_level_regexp = re.compile(_LOW_LEVEL_QUOTE + "(.)")
 
+def _low_level_replace(match_obj):
+    """[Internal]"""
+    ch = match_obj.group(1)
+
+    # If low_level_mapping doesn't have the character as key, we
+    # should just return the character.
+    return _low_level_mapping.get(ch, ch)
+
 def mask_matches(nick, mask):
     """Check if a nick matches a mask.
 
@@ -1175,14 +1989,105 @@ _special = "-[]\\`^{}"
 nick_characters = string.ascii_letters + string.digits + _special
 _ircstring_translation = string.maketrans(string.ascii_uppercase + "[]\\^",
                                           string.ascii_lowercase + "{}|~")
+_casemappings = {
+    "rfc1459": _ircstring_translation,
+    "strict-rfc1459": string.maketrans(string.ascii_uppercase + "[]\\",
+                                       string.ascii_lowercase + "{}|"),
+    "ascii": string.maketrans(string.ascii_uppercase,
+                              string.ascii_lowercase),
+}
+
+# Formatting codes: colour with optional foreground and background,
+# and the bold, italic, underline, reverse and reset toggles.
+_format_code_regexp = re.compile("\x03(?:[0-9]{1,2}(?:,[0-9]{1,2})?)?"
+                                 "|[\x02\x1d\x1f\x16\x0f]")
+
+def split_message(text, width):
+    """Split a message into pieces of at most width bytes.
 
-def irc_lower(s):
+    Pieces are split at spaces where possible, and never inside a
+    UTF-8 character or a formatting code.  Bold, colour and the other
+    formatting in effect at the end of a piece is repeated at the
+    start of the next one.  Returns a list of strings.
+    """
+    if len(text) <= width:
+        return [text]
+    pieces = []
+    state = ""
+    start = 0
+    length = len(text)
+    while start < length:
+        room = width - len(state)
+        if room < 1:
+            # The codes to repeat leave no room for text; drop them
+            # rather than emit pieces that make no progress.
+            state = ""
+            room = max(width, 1)
+        if length - start <= room:
+            pieces.append(state + text[start:])
+            break
+        end = start + room
+        cut = text.rfind(" ", start + 1, end + 1)
+        if cut > start:
+            next_start = cut + 1
+        else:
+            cut = _safe_cut(text, start, end)
+            next_start = cut
+        piece = text[start:cut]
+        pieces.append(state + piece)
+        state = _format_state(piece, state)
+        start = next_start
+    return pieces
+
+def _safe_cut(text, start, end):
+    """[Internal] Move a cut at end back out of a character or code."""
+    # text[end] is the first byte of the next piece; it mustn't be a
+    # UTF-8 continuation byte.
+    while end > start + 1 and "\x80" <= text[end] < "\xc0":
+        end = end - 1
+    i = text.rfind("\x03", max(start, end - 5), end)
+    if i > start:
+        m = _format_code_regexp.match(text, i)
+        if m.end() > end:
+            end = i
+    return end
+
+def _format_state(piece, state):
+    """[Internal] Return the codes that restore the formatting in
+    effect after piece, given the codes for the state before it."""
+    if "\x03" not in piece and "\x02" not in piece and "\x1d" not in piece \
+       and "\x1f" not in piece and "\x16" not in piece and "\x0f" not in piece:
+        return state
+    colour = ""
+    toggles = []
+    for m in _format_code_regexp.finditer(state + piece):
+        code = m.group()
+        if code == "\x0f":
+            colour = ""
+            toggles = []
+        elif code[0] == "\x03":
+            colour = code
+            if code == "\x03":
+                colour = ""
+        elif code in toggles:
+            toggles.remove(code)
+        else:
+            toggles.append(code)
+    if colour:
+        # In two-digit form, so that a digit starting the next piece
+        # isn't read as part of the colour.
+        colour = "\x03" + ",".join(["%02d" % int(n)
+                                     for n in colour[1:].split(",")])
+    return colour + "".join(toggles)
+
+def irc_lower(s, casemapping="rfc1459"):
     """Returns a lowercased string.
 
     The definition of lowercased comes from the IRC specification (RFC
-    1459).
+    1459), or from the CASEMAPPING a server advertises: "rfc1459",
+    "strict-rfc1459" or "ascii".
     """
-    return s.translate(_ircstring_translation)
+    return s.translate(_casemappings[casemapping])
 
 def _ctcp_dequote(message):
     """[Internal] Dequote a message according to CTCP specifications.
@@ -1198,13 +2103,6 @@ def _ctcp_dequote(message):
         message -- The message to be decoded.
     """
 
-    def _low_level_replace(match_obj):
-        ch = match_obj.group(1)
-
-        # If low_level_mapping doesn't have the character as key, we
-        # should just return the character.
-        return _low_level_mapping.get(ch, ch)
-
     if _LOW_LEVEL_QUOTE in message:
         # Yup, there was a quote.  Release the dequoter, man!
         message = _low_level_regexp.sub(_low_level_replace, message)
@@ -1238,6 +2136,88 @@ def _ctcp_dequote(message):
 
         return messages
 
+_tag_value_escapes = {":": ";", "s": " ", "\\": "\\", "r": "\r", "n": "\n"}
+
+def _parse_tags(tag_string):
+    """[Internal] Parse an IRCv3 tag string into a dictionary."""
+    tags = {}
+    for tag in tag_string.split(";"):
+        if not tag:
+            continue
+        key, sep, value = tag.partition("=")
+        if "\\" in value:
+            unescaped = []
+            i = 0
+            while i < len(value):
+                ch = value[i]
+                if ch == "\\":
+                    i = i + 1
+                    if i < len(value):
+                        ch = _tag_value_escapes.get(value[i], value[i])
+                    else:
+                        ch = ""
+                unescaped.append(ch)
+                i = i + 1
+            value = "".join(unescaped)
+        tags[key] = value or None
+    return tags
+
+def _make_command_table():
+    """[Internal] Map raw command names to event types."""
+    table = {}
+    for numeric, name in numeric_events.items():
+        table[numeric] = name
+    for name in protocol_events + ["nick", "notice", "topic"]:
+        table[name.upper()] = name
+        table[name] = name
+    return table
+
+def _parse_message(line):
+    """[Internal] Split a line from the server into its parts.
+
+    Returns a tuple (tags, prefix, command, arguments).  tags is a
+    dictionary or None, prefix is None if the line has none, command
+    is the event type (lowercased, with numerics translated into
+    names) and arguments is a list of parameters, the trailing one
+    included.
+    """
+    tags = None
+    if line[0] == "@":
+        i = line.find(" ")
+        if i < 0:
+            return None, None, "", []
+        tags = _parse_tags(line[1:i])
+        line = line[i+1:].lstrip(" ")
+
+    prefix = None
+    if line[:1] == ":":
+        i = line.find(" ")
+        if i > 1:
+            prefix = line[1:i]
+            line = line[i+1:].lstrip(" ")
+
+    i = line.find(" ")
+    if i < 0:
+        raw_command = line
+        arguments = []
+    else:
+        raw_command = line[:i]
+        rest = line[i:]
+        i = rest.find(" :")
+        if i < 0:
+            arguments = rest.split()
+        else:
+            arguments = rest[:i].split()
+            arguments.append(rest[i+2:])
+
+    command = _command_table.get(raw_command)
+    if command is None:
+        command = raw_command.lower()
+        command = numeric_events.get(command, command)
+        if len(_command_table) < 1024:
+            _command_table[raw_command] = command
+    return tags, prefix, command, arguments
+
 def is_channel(string):
     """Check if a string is a channel name.
 
@@ -1308,22 +2288,31 @@ def parse_nick_modes(mode_string):
 
     return _parse_modes(mode_string, "")
 
-def parse_channel_modes(mode_string):
+def parse_channel_modes(mode_string, features=None):
     """Parse a channel mode string.
 
     The function returns a list of lists with three members: sign,
     mode and argument.  The sign is \"+\" or \"-\".  The argument is
     None if mode isn't one of \"b\", \"k\", \"l\", \"v\" or \"o\".
 
+    If features (a ServerFeatures) is given, the modes that take an
+    argument are instead the server's PREFIX modes and CHANMODES
+    groups A and B, plus group C when the mode is set.
+
     Example:
 
     >>> irclib.parse_channel_modes(\"+ab-c foo\")
     [['+', 'a', None], ['+', 'b', 'foo'], ['-', 'c', None]]
     """
 
-    return _parse_modes(mode_string, "bklvo")
+    if features is None:
+        return _parse_modes(mode_string, "bklvo")
+    chanmodes = features.chanmodes
+    return _parse_modes(mode_string,
+                        features.prefix[0] + chanmodes[0] + chanmodes[1],
+                        chanmodes[2])
 
-def _parse_modes(mode_string, unary_modes=""):
+def _parse_modes(mode_string, unary_modes="", set_only_modes=""):
     """[Internal]"""
     modes = []
     arg_count = 0
@@ -1344,7 +2333,7 @@ def _parse_modes(mode_string, unary_modes=""):
             sign = ch
         elif ch == " ":
             collecting_arguments = 1
-        elif ch in unary_modes:
+        elif ch in unary_modes or (ch in set_only_modes and sign == "+"):
             if len(args) >= arg_count + 1:
                 modes.append([sign, ch, args[arg_count]])
                 arg_count = arg_count + 1
@@ -1548,3 +2537,5 @@ protocol_events = [
 ]
 
 all_events = generated_events + protocol_events + numeric_events.values()
+
+_command_table = _make_command_table()
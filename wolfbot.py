@@ -32,10 +32,12 @@ The main commands are:
 """
 
 import sys, string, random, time
+from collections import OrderedDict
 from ircbot import SingleServerIRCBot
 import irclib
 from irclib import nm_to_n, nm_to_h, irc_lower, parse_channel_modes
-from botcommon import OutputManager
+from botcommon import OutputManager, TokenBucket, pack_segments
+from botcommon import PRIORITY_CRITICAL, PRIORITY_INFO, PRIORITY_CHATTER
 
 # Define colours and styles
 IRC_UNDERLINE = "\x1f"
@@ -75,6 +77,7 @@ GAME_STARTER_TIMEOUT = 70 # In seconds
 DAY_LENGTH = 120 # Voting period is half this
 NIGHT_LENGTH = 60
 #NIGHT_EXTRA = 30
+VOTES_TTL = 30 # Drop !votes output that hasn't gone out by then
 MIN_USERS = 5
 WOLF_THRESHOLD_MULTI = 8 # How many players per wolf (max three wolves)
 END_DISABLED = 1 # If the game starter has access to the !end command
@@ -105,29 +108,340 @@ WATCHMAN_CHANCE = 100"""
 # Rosdahl for the great framework!
 
 
+class PlayerList(object):
+  """An ordered set of players, kept by player id.
+
+  Iterating and indexing give the players' current nicks, so a rename
+  doesn't have to touch the list.  'in', append and remove take
+  constant time; indexing walks the list."""
+  __slots__ = ('game', 'members')
+
+  def __init__(self, game, players=()):
+    self.game = game
+    self.members = OrderedDict()
+    for player in players:
+      self.append(player)
+
+  def __len__(self):
+    return len(self.members)
+
+  def __contains__(self, player):
+    return self.game.ids.get(player) in self.members
+
+  def __iter__(self):
+    nicks = self.game.nicks
+    for pid in self.members:
+      yield nicks[pid]
+
+  def __getitem__(self, index):
+    return list(self)[index]
+
+  def __repr__(self):
+    return repr(list(self))
+
+  def append(self, player):
+    self.members[self.game.id_of(player)] = None
+
+  def remove(self, player):
+    pid = self.game.ids.get(player)
+    if pid not in self.members:
+      raise ValueError, "%s is not in the list" % player
+    del self.members[pid]
+
+  def clear(self):
+    self.members.clear()
+
+
+class PlayerMap(object):
+  """A dict keyed by player, kept by player id like PlayerList.  If
+  player_values is true, the values are players as well, and an index
+  from each value back to its keys lets remove_value drop them all
+  without looking at the other entries."""
+  __slots__ = ('game', 'entries', 'player_values', 'keys_by_value')
+
+  def __init__(self, game, player_values=False):
+    self.game = game
+    self.entries = {}
+    self.player_values = player_values
+    self.keys_by_value = {}
+
+  def __len__(self):
+    return len(self.entries)
+
+  def __contains__(self, player):
+    return self.game.ids.get(player) in self.entries
+
+  has_key = __contains__
+
+  def __getitem__(self, player):
+    try:
+      value = self.entries[self.game.ids[player]]
+    except KeyError:
+      raise KeyError, player
+    if self.player_values:
+      value = self.game.nicks[value]
+    return value
+
+  def __setitem__(self, player, value):
+    pid = self.game.id_of(player)
+    if self.player_values:
+      value = self.game.id_of(value)
+      if pid in self.entries:
+        self._unindex(pid)
+      self.keys_by_value.setdefault(value, {})[pid] = None
+    self.entries[pid] = value
+
+  def __delitem__(self, player):
+    try:
+      pid = self.game.ids[player]
+      if self.player_values:
+        self._unindex(pid)
+      del self.entries[pid]
+    except KeyError:
+      raise KeyError, player
+
+  def _unindex(self, pid):
+    value = self.entries[pid]
+    keys = self.keys_by_value[value]
+    del keys[pid]
+    if not keys:
+      del self.keys_by_value[value]
+
+  def remove_value(self, player):
+    "Remove the entries whose value is PLAYER."
+    keys = self.keys_by_value.pop(self.game.ids.get(player), None)
+    if keys:
+      for pid in keys:
+        del self.entries[pid]
+
+  def __iter__(self):
+    return iter(self.keys())
+
+  def __repr__(self):
+    return repr(dict(self.items()))
+
+  def keys(self):
+    nicks = self.game.nicks
+    return [nicks[pid] for pid in self.entries]
+
+  def values(self):
+    if self.player_values:
+      nicks = self.game.nicks
+      return [nicks[pid] for pid in self.entries.itervalues()]
+    return self.entries.values()
+
+  def items(self):
+    return zip(self.keys(), self.values())
+
+  def clear(self):
+    self.entries.clear()
+    self.keys_by_value.clear()
+
+
+def _player_attribute(slot):
+  "A Game attribute holding one player (or None), kept by player id."
+  def get(self):
+    pid = getattr(self, slot)
+    if pid is None:
+      return None
+    return self.nicks[pid]
+  def set(self, player):
+    if player is not None:
+      player = self.id_of(player)
+    setattr(self, slot, player)
+  return property(get, set)
+
+
+# Titles getRole gives the roles that are revealed when a player dies.
+# The seer passes for a villager.
+ROLE_TITLES = {
+  'mystic': (MYSTIC_COLOR, "Mystic"),
+  'angel': (ANGEL_COLOR, "Angel"),
+  'ninja': (NINJA_COLOR, "Ninja"),
+  'cupid': (CUPID_COLOR, "Cupid"),
+  'village_elder': (ELDER_COLOR, "Village Elder"),
+  'watchman': (WATCHMAN_COLOR, "Watchman"),
+}
+
+
+class Game(object):
+  """The state of one game of werewolf.
+
+  Players are known by an id, handed out the first time a nick turns
+  up: nicks maps ids to nicks and ids maps nicks back.  The player
+  lists and maps, the role holders and the night targets all keep ids
+  and give back nicks, so when a player changes nick only those two
+  maps need updating.
+
+  Once roles are handed out, roles maps every player's id to the name
+  of their role: "wolf", "villager", or the attribute holding the
+  special role ("seer", "village_elder", ...).  live_wolves and
+  live_villagers count the living players on either side, so that
+  checking whether the game is over doesn't need to look at the
+  player lists.
+  """
+  __slots__ = ('nicks', 'ids', 'live_players', 'dead_players', 'wolves',
+               'villagers', 'lovers', 'originalwolves', 'nonvoters',
+               'roles', 'live_wolves', 'live_villagers',
+               '_game_starter', '_seer', '_mystic', '_angel', '_ninja',
+               '_cupid', '_village_elder', '_watchman',
+               'elder_voted', 'first_night',
+               # Night round variables
+               '_seer_target', '_mystic_target', '_old_mystic_target',
+               '_ninja_target', '_wolf_target', 'wolf_votes', 'ninja_sleep',
+               'wolf_sleep', 'sleeping_wolves',
+               # Day round variables
+               'villager_votes', 'tally')
+
+  game_starter = _player_attribute('_game_starter')
+  seer = _player_attribute('_seer')
+  mystic = _player_attribute('_mystic')
+  angel = _player_attribute('_angel')
+  ninja = _player_attribute('_ninja')
+  cupid = _player_attribute('_cupid')
+  village_elder = _player_attribute('_village_elder')
+  watchman = _player_attribute('_watchman')
+  seer_target = _player_attribute('_seer_target')
+  mystic_target = _player_attribute('_mystic_target')
+  old_mystic_target = _player_attribute('_old_mystic_target')
+  ninja_target = _player_attribute('_ninja_target')
+  wolf_target = _player_attribute('_wolf_target')
+
+  def __init__(self):
+    self.nicks = []
+    self.ids = {}
+    self.live_players = PlayerList(self)
+    self.dead_players = PlayerList(self)
+    self.wolves = PlayerList(self)
+    self.villagers = PlayerList(self)
+    self.lovers = PlayerList(self)
+    self.originalwolves = PlayerList(self)
+    self.nonvoters = PlayerList(self)
+    self.roles = {}
+    self.live_wolves = 0
+    self.live_villagers = 0
+    self.game_starter = None
+    self.seer = None
+    self.mystic = None
+    self.angel = None
+    self.ninja = None
+    self.cupid = None
+    self.village_elder = None
+    self.watchman = None
+    self.elder_voted = False
+    self.first_night = False
+    self.seer_target = None
+    self.mystic_target = None
+    self.old_mystic_target = None
+    self.ninja_target = None
+    self.wolf_target = None
+    self.wolf_votes = PlayerMap(self, True)
+    self.ninja_sleep = False
+    self.wolf_sleep = False
+    self.sleeping_wolves = PlayerList(self)
+    self.villager_votes = PlayerMap(self, True)
+    self.tally = PlayerMap(self)
+
+  def id_of(self, nick):
+    "Return the player id of NICK, handing out a new one if need be."
+    pid = self.ids.get(nick)
+    if pid is None:
+      pid = len(self.nicks)
+      self.nicks.append(nick)
+      self.ids[nick] = pid
+    return pid
+
+  def role_of(self, player):
+    "Return the role of PLAYER, or None if roles aren't handed out."
+    return self.roles.get(self.ids.get(player))
+
+  def assign(self, player, role):
+    "Give the living PLAYER the role ROLE."
+    self.roles[self.id_of(player)] = role
+    if role == 'wolf':
+      self.wolves.append(player)
+      self.live_wolves += 1
+    else:
+      if role == 'villager':
+        self.villagers.append(player)
+      else:
+        setattr(self, role, player)
+      self.live_villagers += 1
+
+  def kill(self, player):
+    "Move PLAYER from the living to the dead."
+    self.live_players.remove(player)
+    self.dead_players.append(player)
+    role = self.role_of(player)
+    if role == 'wolf':
+      self.live_wolves -= 1
+    elif role is not None:
+      self.live_villagers -= 1
+
+  def night_done(self):
+    "Return whether everyone has acted for the night."
+    live = self.live_players.members
+    # Is the seer done seeing?
+    if self._seer in live and self._seer_target is None:
+      return False
+    # Is the mystic done guarding?
+    if self._mystic in live and self._mystic_target is None:
+      return False
+    # Is the ninja done assassinating (or sleeping)?
+    if (self._ninja in live and self._ninja_target is None
+        and not self.ninja_sleep):
+      return False
+    # Has the cupid picked the lovers on the first night?
+    if self._cupid in live and self.first_night and not self.lovers:
+      return False
+    return self._wolf_target is not None or self.wolf_sleep
+
+  def count_votes(self):
+    "Count the votes in villager_votes into tally."
+    tally = self.tally.entries
+    tally.clear()
+    for lynchee in self.villager_votes.entries.itervalues():
+      tally[lynchee] = tally.get(lynchee, 0) + 1
+
+  def rename(self, old, new):
+    "Carry everything known about nick OLD over to NEW."
+    pid = self.ids.pop(old, None)
+    if pid is not None:
+      stale = self.ids.get(new)
+      if stale is not None:
+        # NEW was the nick of a player who has left; nobody live can
+        # share it.  Mark their nick "NEW*", which no one can take,
+        # so it still leads back to them alone.
+        assert stale not in self.live_players.members
+        self.nicks[stale] = new + "*"
+        self.ids[new + "*"] = stale
+      self.ids[new] = pid
+      self.nicks[pid] = new
+
+
 class WolfBot(SingleServerIRCBot):
   GAMESTATE_NONE, GAMESTATE_STARTING, GAMESTATE_RUNNING, GAMESTATE_PAUSED  = range(4)
   def __init__(self, channel, nickname, nickpass, server, port=6667,
-      debug=False):
-    SingleServerIRCBot.__init__(self, [(server, port)], nickname, nickname)
+      debug=False, ircobj=None, flood_control=None, separator=' | '):
+    SingleServerIRCBot.__init__(self, [(server, port)], nickname, nickname,
+        ircobj=ircobj)
     self.channel = channel
     # self.nickname is the nickname we _want_. The nickname we actually
     # have at any particular time is c.get_nickname().
     self.nickname = nickname
     self.nickpass = nickpass
     self.debug = debug
+    if debug:
+      self.ircobj.add_global_handler("all_events", self._log_event, -20)
     self.moderation = True
+    self.phase_timers = []
+    # Voice/moderation reconciliation, see fix_modes.
+    self.modes_night = False
+    self.modes_in_flight = {}
+    self.modes_flush = irclib.DelayedCommand(self.ircobj, self.flush_modes)
     self._reset_gamedata()
-    self.queue = OutputManager(self.connection, 0.01)
-    self.queue.start()
-    try:
-      self.start()
-    except KeyboardInterrupt:
-      self.connection.quit("Ctrl-C at console")
-      print "Quit IRC."
-    except Exception, e:
-      self.connection.quit("%s: %s" % (e.__class__.__name__, e.args))
-      raise
+    self.queue = OutputManager(self.connection,
+        TokenBucket(**(flood_control or {})), separator)
 
 
   _uninteresting_events = {
@@ -150,23 +464,19 @@ class WolfBot(SingleServerIRCBot):
     'topicinfo': None,
     'ping': None,
     }
-  def _dispatcher(self, c, e):
-    if self.debug:
-      eventtype = e.eventtype()
-      if eventtype not in self._uninteresting_events:
-        source = e.source()
-        if source is not None:
-          source = nm_to_n(source)
-        else:
-          source = ''
-        print "E: %s (%s->%s) %s" % (eventtype, source, e.target(),
-            e.arguments())
-    SingleServerIRCBot._dispatcher(self, c, e)
+  def _log_event(self, c, e):
+    eventtype = e.eventtype()
+    if eventtype not in self._uninteresting_events:
+      source = e.nick()
+      if source is None:
+        source = ''
+      print "E: %s (%s->%s) %s" % (eventtype, source, e.target(),
+          e.arguments())
   
   def defineTexts(self):
     
     self.new_game_text = \
-    "You have rounded up " + IRC_BOLD + str(len(self.live_players)) + IRC_DEFAULT + " players for the hunt! Please stand by, assigning roles and starting the game..."
+    "You have rounded up " + IRC_BOLD + str(len(self.game.live_players)) + IRC_DEFAULT + " players for the hunt! Please stand by, assigning roles and starting the game..."
 
     # Printed when informing players of their initial roles:
 
@@ -251,19 +561,19 @@ class WolfBot(SingleServerIRCBot):
     text = ""
     
     if n == 0:
-        if player not in self.wolves:
+        if player not in self.game.wolves:
             text = "A decision is reached, and the mob surges over " + IRC_BOLD + player + IRC_DEFAULT + ", quickly dragging them to a sturdy tree. " + IRC_BOLD + player + IRC_DEFAULT + " is put into the noose, and the stool is quickly kicked out. A brutal snap resounds through the clearing; all too late, the villagers realize the moon had risen. The corpse of " + self.getRole(player) + " sway gently in the chilling breeze."
         else:
             text = "A decision is reached, and the mob surges over " + IRC_BOLD + player + IRC_DEFAULT + ", quickly dragging them to a sturdy tree. " + IRC_BOLD + player + IRC_DEFAULT + " is put into the noose, and the stool is quickly kicked out. A growl sounds from " + IRC_BOLD + player + IRC_DEFAULT + ", and a hunter quickly puts a silver bullet through the werewolf " + IRC_BOLD + player + IRC_DEFAULT + "’s head!"
     
     elif n == 1:
-        if player not in self.wolves:
+        if player not in self.game.wolves:
             text = "The villagers act quickly and bind the wrists of " + IRC_BOLD + player + IRC_DEFAULT + ", rapidly dragging them over to the hangin’ tree. Amidst bitter protests, they throw a noose on " + self.getRole(player) + ", and kick the hastily found log out from beneath his feet. With an utterly final crack, the village realizes they grabbed the wrong man."
         else:
             text = "The villagers act quickly and bind the wrists of " + IRC_BOLD + player + IRC_DEFAULT + ", rapidly dragging them over to the hangin’ tree. Amidst bitter protests, they throw a noose on " + IRC_BOLD + player + IRC_DEFAULT + ". Before they can act further, " + IRC_BOLD + player + IRC_DEFAULT + " growls and begins to struggle against the rope. A loud report from the rifle reverberates about the clearing: The wolf has been put down permanently with a silver bullet."
 
     else:
-        if player not in self.wolves:
+        if player not in self.game.wolves:
             text = "With utter finality the village cries out and seizes " + IRC_BOLD + player + IRC_DEFAULT + ". A noose is hastily assembled, and despite shrill protests from " + IRC_BOLD + player + IRC_DEFAULT + " the man is strung up. The village tenses up as a sole man approaches and kicks out the support; " + self.getRole(player) + " hangs listlessly, and in their excitement the village did not notice the already-high moon..."
         else:
             text = "With utter finality the village cries out and seizes " + IRC_BOLD + player + IRC_DEFAULT + ". A noose is hastily assembled, and despite shrill protests from " + IRC_BOLD + player + IRC_DEFAULT + " the man is strung up. The village tenses up as a sole man approaches and kicks out the support; A loud yelp sounds from the ‘man’ and a swordsman deftly silences the wolf with his freshly forged silver sword."
@@ -283,38 +593,38 @@ class WolfBot(SingleServerIRCBot):
     else:
         texts.append("Upon finding " + IRC_BOLD + player + IRC_DEFAULT + " missing from the gathering of villagers come morning, they rush over to " + IRC_BOLD + player + IRC_DEFAULT + "’s cottage.")
         
-    if player == self.seer:
+    if player == self.game.seer:
         rand_texts = \
         ["Upon arriving, they find blood splattered everywhere, and " + IRC_BOLD + SEER_COLOR + player + " the Seer " + IRC_DEFAULT + "is discovered slumped over his crystal ball! Unfortunately, he didn’t see the werewolf until it was too late.",
          "As the villagers arrive, the grisly sight before them turns several villagers away. Half of " + IRC_BOLD + SEER_COLOR + player + " the Seer " + IRC_DEFAULT + "is spread around the yard, and inside the cottage is no better, the werewolf saw to that."]
     
-    elif player == self.watchman:
+    elif player == self.game.watchman:
         rand_texts = \
         ["Upon arrival at the scene of the crime, the remains of " + IRC_BOLD + WATCHMAN_COLOR + player + " the Watchman " + IRC_DEFAULT + "are found partially eaten on his front porch!",
          "As the villagers arrive, it is clear they rushed in vain. " + IRC_BOLD + WATCHMAN_COLOR + player + IRC_DEFAULT + " the Watchman was too busy watching the village to see his own death coming."]
     
-    elif player == self.mystic:
+    elif player == self.game.mystic:
         rand_texts = \
         ["The first man to make it to the house finds the grisly remains of " + IRC_BOLD + MYSTIC_COLOR + player + " the Mystic" + IRC_DEFAULT + "! Perhaps " + IRC_BOLD + player + IRC_DEFAULT + " should have expended some holy water to protect himself from the werewolf!",
          "Upon reaching the house of " + IRC_BOLD + MYSTIC_COLOR + player + " the Mystic" + IRC_DEFAULT + ", the villagers find blood all over the clearing. Clearly " + IRC_BOLD + player + IRC_DEFAULT + " failed his saving throw against becoming dinner."]
     
-    elif player == self.ninja:
+    elif player == self.game.ninja:
         rand_texts = \
         ["As the villagers assemble in front of " + IRC_BOLD + NINJA_COLOR + player + " the Ninja’s " + IRC_DEFALULT + "house, it is abundantly clear that all of the stealth in the world won’t save you from a hungry werewolf knocking at your door.",
          "Despite their quick response, the villagers find " + IRC_BOLD + NINJA_COLOR + player + " the Ninja already quite dead. Perhaps if he wasn’t so busy with night one blind kills he’d have time to defend himself.",
          "After rushing over there, a few villagers rush away; The grisly sight of " + IRC_BOLD + NINJA_COLOR + player + " the Ninja " + IRC_DEFAULT + "is difficult to stomach, although certainly leaves no doubt as to the vitality of " + IRC_BOLD + player + IRC_DEFAULT + "."]
     
-    elif player == self.cupid:
+    elif player == self.game.cupid:
         rand_texts = \
         ["Upon arrival at the house of " + IRC_BOLD + CUPID_COLOR + player + " the Cupid" + IRC_DEFAULT + ", all that remains is a single, broken arrow. It appears that he would have been better off if armed with a real weapon.",
          "Once the villagers have assembled before the house of " + IRC_BOLD + CUPID_COLOR + player + " the Cupid" + IRC_DEFAULT + ", they quickly storm inside, only to find the grisly remains of " + IRC_BOLD + player + IRC_DEFAULT + " scattered about the room."]
     
-    elif player == self.village_elder:
+    elif player == self.game.village_elder:
         rand_texts = \
         ["As the village arrives at the house of the venerable " + IRC_BOLD + CUPID_COLOR + "village elder " + player + IRC_DEFAULT + ", they find his grisly corpse scattered rudely about the clearing. Apparently, wisdom doesn’t grant protection!",
          "Upon arrival at the abode of " + IRC_BOLD + SEER_COLOR + player + " the Village Elder" + IRC_DEFAULT + ", they cautiously enter his house. The sight inside is not one meant for mortal eyes, as %%victim%% lays inanimate on the floor, entrails spilling out."]
     
-    elif player in self.wolves:
+    elif player in self.game.wolves:
         rand_texts = \
         ["",
          ""]
@@ -329,181 +639,146 @@ class WolfBot(SingleServerIRCBot):
   def getRole(self, player):
       "Returns the role of the player"
       
-      role = ""
-      if player == self.mystic:
-        role = MYSTIC_COLOR + player + " the Mystic" + IRC_DEFAULT
-      elif player == self.angel:
-        role = ANGEL_COLOR + player + " the Angel" + IRC_DEFAULT
-      elif player == self.ninja:
-        role = NINJA_COLOR + player + " the Ninja" + IRC_DEFAULT
-      elif player == self.cupid:
-        role = CUPID_COLOR + player + " the Cupid" + IRC_DEFAULT
-      elif player == self.village_elder:
-        role = ELDER_COLOR + player + " the Village Elder" + IRC_DEFAULT
-      elif player == self.watchman:
-        role = WATCHMAN_COLOR + player + " the Watchman" + IRC_DEFAULT
-      elif player in self.wolves:
-        role = WOLF_COLOR + "the Werewolf" + IRC_DEFAULT
-      else:
-        role = player + " the Villager" + IRC_DEFAULT
-      
-      return role
-    
-  def process_timers(self):
-    #Process all existing timers and check if their functions need to executed
-    
-    curTime = time.time()
+      role = self.game.role_of(player)
+      if role == 'wolf':
+        return WOLF_COLOR + "the Werewolf" + IRC_DEFAULT
+      if role in ROLE_TITLES:
+        color, title = ROLE_TITLES[role]
+        return color + player + " the " + title + IRC_DEFAULT
+      return player + " the Villager" + IRC_DEFAULT
     
-    if self.gamestate == self.GAMESTATE_STARTING:
-      elapsed = int(curTime - self.game_start_timer)
-      if self.old_elapsed != elapsed:
-        if self.game_start_timer != -1:
-          if elapsed == GAME_STARTER_TIMEOUT:
-            self.say_public("The required startup time has now passed.")
-            self.say_public("Anyone can now start the game with !start")
-            
-          #print "elapsed: " + str(elapsed) + ", elapsed mod 10: " + str(elapsed % 10)
-          if elapsed % 20 == 0:
-            players = self.game_starter
-            for player in self.live_players:
-              if player is not self.game_starter:
-                players += ", " + player
-            self.say_public("Players who have currently joined: %s" % players)
-      self.old_elapsed = elapsed
-                  
-    if self.gamestate == self.GAMESTATE_RUNNING:
-      if self.time == "night":
-        elapsed = int(curTime - self.night_timer)
-        if self.old_elapsed != elapsed:
-          if self.check_night_done(elapsed):
-            self.day()
-        self.old_elapsed = elapsed
-      elif self.time == "day":
-        elapsed = int(curTime - self.day_timer)
-        if self.old_elapsed != elapsed:
-          if self.check_day_done(elapsed):
-            victims = self.check_for_votes()
-            if not victims:
-              self.print_tally()
-              self.night()
-              return
-            elif len(victims) == 1:
-              victim = victims[0]
-            else:
-              victim = victims[random.randrange(len(victims))]
-        
-            self.say_public(self.getLynchText(victim))
-            if not self.kill_player(victim):
-            # Day is done;  flip bot back into night-mode.
-              self.night()
-          elif elapsed == DAY_LENGTH / 2:
-            for text in self.day_game_texts:
-              self.say_public(text)
-          self.old_elapsed = elapsed
-            
-      
-                          
-          
-  def process_forever(self):
-    """Run an infinite loop, processing data from connections.
-
-    This method repeatedly calls process_once.
+  def schedule_at(self, at, function, arguments=()):
+    """Call FUNCTION at time AT, unless the game moves on to another
+    phase first."""
+    timer = self.connection.execute_at(at, function, arguments)
+    self.phase_timers.append(timer)
+    return timer
+
+  def schedule_delayed(self, delay, function, arguments=()):
+    """Call FUNCTION after DELAY seconds, unless the game moves on to
+    another phase first."""
+    return self.schedule_at(time.time() + delay, function, arguments)
+
+  def schedule_every(self, period, function, arguments=()):
+    "Call FUNCTION every PERIOD seconds until the game changes phase."
+    timer = self.connection.execute_every(period, function, arguments)
+    self.phase_timers.append(timer)
+    return timer
+
+  def cancel_timers(self):
+    "Cancel everything scheduled for the current game phase."
+    for timer in self.phase_timers:
+      timer.cancel()
+    del self.phase_timers[:]
+
+  def starter_timeout(self):
+    "Called when the game starter's exclusive right to !start runs out."
+    self.say_public("The required startup time has now passed.")
+    self.say_public("Anyone can now start the game with !start")
+
+  def announce_players(self):
+    "Periodically list the players who have joined a starting game."
+    players = [player for player in self.game.live_players
+               if player != self.game.game_starter]
+    if self.game.game_starter in self.game.live_players:
+      players.insert(0, self.game.game_starter)
+    self.say_public("Players who have currently joined: %s" % ", ".join(players), PRIORITY_CHATTER,
+        "lobby-roster", 20)
+
+  def open_voting(self):
+    "Called halfway through the day, when the voting period begins."
+    self.voting = True
+    for text in self.day_game_texts:
+      self.say_public(text, PRIORITY_CRITICAL)
+
+  def end_day(self):
+    "Called when the day runs out: lynch whoever got the most votes."
+    victims = self.check_for_votes()
+    if not victims:
+      self.print_tally()
+      self.night()
+      return
+    elif len(victims) == 1:
+      victim = victims[0]
+    else:
+      victim = victims[random.randrange(len(victims))]
 
-    Arguments:
+    self.say_public(self.getLynchText(victim), PRIORITY_CRITICAL)
+    if not self.kill_player(victim):
+      # Day is done;  flip bot back into night-mode.
+      self.night()
 
-        timeout -- Parameter to pass to process_once.
-    """
-    while 1:
-        self.process_timers()
-        self.ircobj.process_once(0.1)
-    
-  def start(self):
-    """Start the bot."""
-    self._connect()
-    self.process_forever()
-  
   def on_nicknameinuse(self, c, e):
     c.nick(c.get_nickname() + "_")
 
   def _renameUser(self, old, new):
-    for list in (self.live_players, self.dead_players, self.wolves,
-        self.villagers, self.originalwolves):
-      if old in list:
-        list.append(new)
-        list.remove(old)
-    for map in (self.wolf_votes, self.villager_votes, self.tally):
-      if map.has_key(new):
-        map[new] = map[old]
-        del map[old]
-    for map in (self.wolf_votes, self.villager_votes):
-      for k, v in map.items():
-        if v == old:
-          map[k] = new
-    for var in ('game_starter', 'seer', 'mystic', 'angel', 'ninja', 'cupid', 'village_elder', 'watchman', 'seer_target', 'mystic_target', 'old_mystic_target', 'ninja_target', 'wolf_target'):
-      if getattr(self, var) == old:
-        setattr(self, var, new)
+    self._forget_modes(old)
+    self.game.rename(old, new)
 
   def _removeUser(self, nick):
-    if nick == self.game_starter:
-      self.game_starter = None
-    if nick in self.live_players:
-      self.say_public("%s fled the village, but the Reaper always gets his man." % nick)
-      self.live_players.remove(nick)
+    self._forget_modes(nick)
+    if nick == self.game.game_starter:
+      self.game.game_starter = None
+    if nick in self.game.live_players:
+      self.say_public("%s fled the village, but the Reaper always gets his man." % nick, PRIORITY_CRITICAL)
       if self.gamestate == self.GAMESTATE_STARTING:
+        self.game.live_players.remove(nick)
         # No more to do
         return
-      self.dead_players.append(nick)
-      if nick in self.wolves:
-        self.wolves.remove(nick)
-        self.say_public("The only thing left of %s the " + IRC_BOLD + "werewolf" + IRC_DEFAULT + " was a few tufts of fur." % (nick,nick))
-      if nick in self.villagers:
-        self.villagers.remove(nick)
-        self.say_public("%s was a villager." % nick)
-      if self.seer is not None and nick == self.seer:
-        self.say_public("Not seeing a lot of %s the " + IRC_BOLD + "seer" + IRC_DEFAULT + ", didn't even say \"See ya!\"" % nick)
-      if self.seer is not None and nick == self.seer_target:
-        self.say_private(self.seer, "Due to %s's unexpected erasure from reality, "
-            "you may pick someone else to reveal." % nick)
-        self.seer_target = None
-      if self.mystic is not None and nick == self.mystic:
-        self.say_public("%s was a mystic, and appears to have lost the roll to save vs reality warping." % nick)
-      if self.mystic is not None and nick == self.mystic_target:
-        self.say_private(self.mystic, "Due to %s's unexpected erasure from reality, "
-                         "you may pick a new protection target now." % nick)
-        self.mystic_target = None
-      if self.angel is not None and nick == self.angel:
+      self.game.kill(nick)
+      if nick in self.game.wolves:
+        self.game.wolves.remove(nick)
+        self.say_public(("The only thing left of %s the " + IRC_BOLD + "werewolf" + IRC_DEFAULT + " was a few tufts of fur.") % nick, PRIORITY_CRITICAL)
+      if nick in self.game.villagers:
+        self.game.villagers.remove(nick)
+        self.say_public("%s was a villager." % nick, PRIORITY_CRITICAL)
+      if self.game.seer is not None and nick == self.game.seer:
+        self.say_public(("Not seeing a lot of %s the " + IRC_BOLD + "seer" + IRC_DEFAULT + ", didn't even say \"See ya!\"") % nick, PRIORITY_CRITICAL)
+      if self.game.seer is not None and nick == self.game.seer_target:
+        self.say_private(self.game.seer, "Due to %s's unexpected erasure from reality, "
+            "you may pick someone else to reveal." % nick, PRIORITY_CRITICAL)
+        self.game.seer_target = None
+      if self.game.mystic is not None and nick == self.game.mystic:
+        self.say_public("%s was a mystic, and appears to have lost the roll to save vs reality warping." % nick, PRIORITY_CRITICAL)
+      if self.game.mystic is not None and nick == self.game.mystic_target:
+        self.say_private(self.game.mystic, "Due to %s's unexpected erasure from reality, "
+                         "you may pick a new protection target now." % nick, PRIORITY_CRITICAL)
+        self.game.mystic_target = None
+      if self.game.angel is not None and nick == self.game.angel:
         self.say_public("%s was an angel, and it appears not even divine intervention"
-                        "can save you from.. divine intervention." % nick)
-      if self.ninja is not None and nick == self.ninja:
-        self.say_public("%s was a ninja, cleverly hiding behind a disconnection." % nick)
+                        "can save you from.. divine intervention." % nick, PRIORITY_CRITICAL)
+      if self.game.ninja is not None and nick == self.game.ninja:
+        self.say_public("%s was a ninja, cleverly hiding behind a disconnection." % nick, PRIORITY_CRITICAL)
         ninja_target = None
-      if self.ninja is not None and nick == self.ninja_target and self.time == "night":
-        self.say_private(self.ninja, "Due to %s's unexpected erasure from reality, "
-                         "you may pick a new assassination target now." % nick)
-      if self.cupid is not None and nick == self.cupid:
-        self.say_public("%s was a cupid, clearly not enough love for the town." % nick)
-      if self.lovers and (nick == self.lovers[0] or nick == self.lovers[1]):
+      if self.game.ninja is not None and nick == self.game.ninja_target and self.time == "night":
+        self.say_private(self.game.ninja, "Due to %s's unexpected erasure from reality, "
+                         "you may pick a new assassination target now." % nick, PRIORITY_CRITICAL)
+      if self.game.cupid is not None and nick == self.game.cupid:
+        self.say_public("%s was a cupid, clearly not enough love for the town." % nick, PRIORITY_CRITICAL)
+      if self.game.lovers and (nick == self.game.lovers[0] or nick == self.game.lovers[1]):
         self.check_lovers(nick)
-      if self.village_elder is not None and nick == self.village_elder:
-        self.say_public("%s was the village elder! Some leader of the community!" % nick)
-      if self.watchman is not None and nick == self.watchman:
-        self.say_public("%s was a watchman. Perhaps he should have been more watchful!" % nick)
-      if nick == self.wolf_target:
-        for wolf in self.wolves:
-          self.say_private("Due to %s's unexpected erasure from reality, "
-              "you can choose someone else to kill tonight." % nick, wolf)
-        self.wolf_target = None
-      for map in (self.wolf_votes, self.villager_votes, self.tally):
+      if self.game.village_elder is not None and nick == self.game.village_elder:
+        self.say_public("%s was the village elder! Some leader of the community!" % nick, PRIORITY_CRITICAL)
+      if self.game.watchman is not None and nick == self.game.watchman:
+        self.say_public("%s was a watchman. Perhaps he should have been more watchful!" % nick, PRIORITY_CRITICAL)
+      if nick == self.game.wolf_target:
+        for wolf in self.game.wolves:
+          self.say_private(wolf, "Due to %s's unexpected erasure from reality, "
+              "you can choose someone else to kill tonight." % nick, PRIORITY_CRITICAL)
+        self.game.wolf_target = None
+      for map in (self.game.wolf_votes, self.game.villager_votes, self.game.tally):
         if map.has_key(nick):
           del map[nick]
-      for map in (self.wolf_votes, self.villager_votes):
-        for k, v in map.items():
-          if v == nick:
-            del map[k]
-      self.check_game_over()
+      # Votes cast for the leaver are void too.
+      self.game.wolf_votes.remove_value(nick)
+      self.game.villager_votes.remove_value(nick)
+      if not self.check_game_over() and self.time == "night":
+        # The leaver may have been the last one the night waited on.
+        if self.check_night_done():
+          self.day()
 
   def on_join(self, c, e):
-    nick = nm_to_n(e.source())
+    nick = e.nick()
     if nick == c.get_nickname():
       chan = e.target()
       self.connection.mode(self.channel, '')
@@ -523,14 +798,14 @@ class WolfBot(SingleServerIRCBot):
       
 
   def on_quit(self, c, e):
-    source = nm_to_n(e.source())
+    source = e.nick()
     self._removeUser(source)
     if source == self.nickname:
       # Our desired nick just quit - take the nick back
       c.nick(self.nickname)
 
   def on_nick(self, c, e):
-    self._renameUser(nm_to_n(e.source()), e.target())
+    self._renameUser(e.nick(), e.target())
 
 
   def on_welcome(self, c, e):
@@ -538,66 +813,128 @@ class WolfBot(SingleServerIRCBot):
     if c.get_nickname() != self.nickname:
       # Reclaim our desired nickname
       c.privmsg('nickserv', 'ghost %s %s' % (self.nickname, self.nickpass))
-    self.queue.send('identify %s' % self.nickpass, 'nickserv')
+    self.queue.send('identify %s' % self.nickpass, 'nickserv',
+        priority=PRIORITY_CRITICAL)
 
 
   def fix_modes(self, night = False):
+    """Bring the channel modes in line with the game.
+
+    Live players are voiced and dead ones devoiced, except at NIGHT,
+    when live players are devoiced and the dead are left alone.  The
+    modes are compared and sent at the end of the current event loop
+    iteration, so calling this repeatedly costs nothing extra; the
+    last call decides between day and night.
+    """
+    self.modes_night = night
+    if not self.modes_flush.is_pending():
+      self.modes_flush.reschedule(0)
+
+  # Seconds to trust modes we sent but haven't seen the server echo.
+  MODES_IN_FLIGHT_TIMEOUT = 10
+
+  def _mode_state(self, mode, nick, actual):
+    """Return a mode's state, counting the changes we're waiting for."""
+    if nick is not None:
+      nick = irc_lower(nick)
+    entry = self.modes_in_flight.get((mode, nick))
+    if entry is None:
+      return actual
+    value, sent = entry
+    if value == actual or \
+        irclib.monotonic() - sent > self.MODES_IN_FLIGHT_TIMEOUT:
+      # Confirmed, or the server refused.
+      del self.modes_in_flight[(mode, nick)]
+      return actual
+    return value
+
+  def _forget_modes(self, nick):
+    "Stop waiting for mode changes sent for NICK, who is gone."
+    # Voice is the only mode flush_modes sets on users.
+    self.modes_in_flight.pop(('v', irc_lower(nick)), None)
+
+  def flush_modes(self):
+    if self.channel not in self.channels:
+      return
     chobj = self.channels[self.channel]
-    is_moderated = chobj.is_moderated()
+    changes = []
     should_be_moderated = (self.gamestate == self.GAMESTATE_RUNNING
         and self.moderation)
-    if is_moderated and not should_be_moderated:
-      self.connection.mode(self.channel, '-m')
-    elif not is_moderated and should_be_moderated:
-      self.connection.mode(self.channel, '+m')
-
-    voice = []
-    devoice = []
-    for user in chobj.users():
-      is_live = user in self.live_players
-      is_voiced = chobj.is_voiced(user)
-      if night:
-        if is_live:
-          devoice.append(user)
+    if self._mode_state('m', None, chobj.is_moderated()) != should_be_moderated:
+      changes.append((should_be_moderated, 'm', None))
+
+    for user in chobj:
+      is_live = user in self.game.live_players
+      if self.modes_night:
+        if not is_live:
+          continue
+        should_be_voiced = False
       else:
-        if is_live and not is_voiced:
-          voice.append(user)
-        elif not is_live and is_voiced:
-          devoice.append(user)
-    if not night: 
-      self.multimode('+v', voice)
-    self.multimode('-v', devoice)
-
-
-  def multimode(self, mode, nicks):
-    max_batch = 4 # FIXME: Get this from features message
-    assert len(mode) == 2
-    assert mode[0] in ('-', '+')
-    while nicks:
-      batch_len = len(nicks)
-      if batch_len > max_batch:
-        batch_len = max_batch
-      tokens = [mode[0] + (mode[1]*batch_len)]
-      while batch_len:
-        tokens.append(nicks.pop(0))
-        batch_len -= 1
-      self.connection.mode(self.channel, ' '.join(tokens))
+        should_be_voiced = is_live
+      if self._mode_state('v', user, chobj.is_voiced(user)) != should_be_voiced:
+        changes.append((should_be_voiced, 'v', user))
+    self.send_modes(changes)
+
+  def send_modes(self, changes):
+    """Send (set, mode, argument) changes in as few MODE lines as possible.
+
+    SET is true to set the mode and false to clear it; ARGUMENT is None
+    for modes without one.
+    """
+    if not changes:
+      return
+    now = irclib.monotonic()
+    flags = []
+    params = []
+    for change in changes:
+      value, mode, argument = change
+      if argument is None:
+        flags.append(change)
+        self.modes_in_flight[(mode, None)] = (value, now)
+      else:
+        params.append(change)
+        self.modes_in_flight[(mode, irc_lower(argument))] = (value, now)
+    # Grouping by sign saves a few bytes.
+    params.sort(key=lambda change: not change[0])
+
+    features = self.connection.features
+    # As many modes as the server allows and the line has room for.
+    room = features.linelen - len('MODE %s ' % self.channel) - 2
+    max_batch = room / (features.nicklen + 3)
+    if features.modes is not None:
+      max_batch = min(max_batch, features.modes)
+    while flags or params:
+      batch = flags + params[:max_batch]
+      flags = []
+      params = params[max_batch:]
+      modes = ''
+      sign = None
+      arguments = []
+      for value, mode, argument in batch:
+        if value != sign:
+          sign = value
+          modes += value and '+' or '-'
+        modes += mode
+        if argument is not None:
+          arguments.append(argument)
+      self.connection.mode(self.channel, ' '.join([modes] + arguments))
 
 
   def on_privnotice(self, c, e):
-    source = e.source()
-    if source and irc_lower(nm_to_n(source)) == 'nickserv':
+    source = e.nick()
+    if source and irc_lower(source) == 'nickserv':
       if e.arguments()[0].find('IDENTIFY') >= 0:
         # Received request to identify
         if self.nickpass and self.nickname == c.get_nickname():
-          self.queue.send('identify %s' % self.nickpass, 'nickserv')
+          self.queue.send('identify %s' % self.nickpass, 'nickserv',
+              priority=PRIORITY_CRITICAL)
 
   def on_privmsg(self, c, e):
     self.do_command(e, e.arguments()[0])
 
 
   def on_part(self, c, e):
-    self._removeUser(nm_to_n(e.source()))
+    self._removeUser(e.nick())
 
   def on_kick(self, c, e):
     self._removeUser(nm_to_n(e.arguments()[0]))
@@ -611,60 +948,46 @@ class WolfBot(SingleServerIRCBot):
       self.do_command(e, string.strip(s[1:]))
 
   def _reset_gamedata(self):
-    self.old_elapsed = 0
+    self.cancel_timers()
     self.game_start_timer = -1
     self.night_timer = -1
     self.day_timer = -1
+    self.voting = False
     self.gamestate = self.GAMESTATE_NONE
     self.time = None
-    self.game_starter = None
-    self.live_players = []
-    self.dead_players = []
-    self.wolves = []
-    self.villagers = []
-    self.lovers = []
-    self.seer = None
-    self.mystic = None
-    self.angel = None
-    self.ninja = None
-    self.cupid = None
-    self.village_elder = None
-    self.elder_voted = False
-    self.watchman = None
-    self.originalwolves = []
-    self.nonvoters = []
-    # Night round variables
-    self.seer_target = None
-    self.mystic_target = None
-    self.old_mystic_target = None
-    self.ninja_target = None
-    self.wolf_target = None
-    self.wolf_votes = {}
-    self.ninja_sleep = False
-    self.wolf_sleep = False
-    self.sleeping_wolves = []
-    # Day round variables
-    self.villager_votes = {}
-    self.tally = {}
+    self.game = Game()
 
 
 
-  def say_public(self, text):
-    "Print TEXT into public channel, for all to see."
-    
-    self.queue.send(IRC_DEFAULT + text, self.channel, False)
+  def say_public(self, text, priority=PRIORITY_INFO, key=None, ttl=None):
+    """Print TEXT into public channel, for all to see.
+
+    A queued message with the same KEY is replaced; see
+    botcommon.OutputManager.send."""
+    if key is not None:
+      key = "%s:%s" % (key, self.channel)
+    self.queue.send(IRC_DEFAULT + text, self.channel, False, priority,
+        key, ttl)
 
-  def say_private(self, nick, text):
+  def say_private(self, nick, text, priority=PRIORITY_INFO):
     "Send private message of TEXT to NICK."
     
-    self.queue.send(IRC_DEFAULT + text,nick, True)
+    self.queue.send(IRC_DEFAULT + text,nick, True, priority)
 
-  def reply(self, e, text):
+  def say_public_segments(self, segments, priority=PRIORITY_INFO):
+    "Print SEGMENTS into public channel, packed into as few lines as fit."
+    # say_public puts IRC_DEFAULT in front of each line.
+    width = self.connection.message_budget('PRIVMSG', self.channel) \
+        - len(IRC_DEFAULT)
+    for line in pack_segments(segments, width, IRC_DEFAULT + " "):
+      self.say_public(line, priority)
+
+  def reply(self, e, text, priority=PRIORITY_CHATTER):
     "Send TEXT to public channel or as private msg, in reply to event E."
     if e.eventtype() == "pubmsg":
-      self.say_public("%s: %s" % (nm_to_n(e.source()), text))
+      self.say_public("%s: %s" % (e.nick(), text), priority)
     else:
-      self.say_private(nm_to_n(e.source()), text)
+      self.say_private(e.nick(), text, priority)
 
 
   def start_game(self, game_starter):
@@ -673,40 +996,44 @@ class WolfBot(SingleServerIRCBot):
 
     if self.gamestate == self.GAMESTATE_RUNNING:
       self.say_public("A game started by %s is in progress; "
-          "that person must end it." % self.game_starter)
+          "that person must end it." % self.game.game_starter)
       return
 
     if self.gamestate == self.GAMESTATE_NONE:
       self._reset_gamedata()
       self.gamestate = self.GAMESTATE_STARTING
-      self.game_starter = game_starter
-      self.live_players.append(game_starter)
-      self.say_public("A new game has been started by " + self.game_starter + "; say '" + IRC_BOLD + "!join" + IRC_BOLD + "' to join the game.")
-      self.say_public(self.game_starter + ": Say '" + IRC_BOLD + "!start" + IRC_BOLD + "' when everyone has joined.")
+      self.game.game_starter = game_starter
+      self.game.live_players.append(game_starter)
+      self.say_public("A new game has been started by " + self.game.game_starter + "; say '" + IRC_BOLD + "!join" + IRC_BOLD + "' to join the game.")
+      self.say_public(self.game.game_starter + ": Say '" + IRC_BOLD + "!start" + IRC_BOLD + "' when everyone has joined.")
       self.fix_modes()
       self.game_start_timer = time.time()
+      self.schedule_at(self.game_start_timer + GAME_STARTER_TIMEOUT,
+                       self.starter_timeout)
+      self.schedule_every(20, self.announce_players)
       return
 
     if self.gamestate == self.GAMESTATE_STARTING:
-      if ((time.time() - self.game_start_timer) < GAME_STARTER_TIMEOUT) and self.game_starter and game_starter != self.game_starter:
+      if ((time.time() - self.game_start_timer) < GAME_STARTER_TIMEOUT) and self.game.game_starter and game_starter != self.game.game_starter:
         self.say_public("Game startup was begun by %s; "
-            "that person must finish starting it." % self.game_starter)
+            "that person must finish starting it." % self.game.game_starter)
         return
-      elif self.game_starter is None:
-        self.game_starter = game_starter
+      elif self.game.game_starter is None:
+        self.game.game_starter = game_starter
 
-      if len(self.live_players) < MIN_USERS:
+      if len(self.game.live_players) < MIN_USERS:
         self.say_public("Sorry, to start a game, there must be " + \
                         "at least active %d players."%(MIN_USERS))
         self.say_public(("I count only %d active players right now: %s."
-          % (len(self.live_players), self.live_players)))
+          % (len(self.game.live_players), self.game.live_players)))
 
       else:
+        self.cancel_timers()
         self.gamestate = self.GAMESTATE_RUNNING
-        users = self.live_players[:]
+        users = self.game.live_players[:]
         
         self.defineTexts()
-        self.say_public(self.new_game_text)
+        self.say_public(self.new_game_text, PRIORITY_CRITICAL)
         self.fix_modes(True)
         # Set number of village roles based on amount of players
         if len(users) < 6: 
@@ -725,20 +1052,20 @@ class WolfBot(SingleServerIRCBot):
           roles = 7
           
         # Randomly select an appropriate amount of wolves and special roles.  Everyone else is a villager.
-        self.wolves.append(users.pop(random.randrange(len(users))))
+        self.game.assign(users.pop(random.randrange(len(users))), 'wolf')
 		
-        if len(self.live_players) > WOLF_THRESHOLD_MULTI:
-          self.wolves.append(users.pop(random.randrange(len(users))))
+        if len(self.game.live_players) > WOLF_THRESHOLD_MULTI:
+          self.game.assign(users.pop(random.randrange(len(users))), 'wolf')
 		  
-          if len(self.live_players) > (WOLF_THRESHOLD_MULTI * 2):
-            self.wolves.append(users.pop(random.randrange(len(users))))
-            self.say_public("There are %s or more players, so there are three werewolves." %((WOLF_THRESHOLD_MULTI * 2) + 1))
+          if len(self.game.live_players) > (WOLF_THRESHOLD_MULTI * 2):
+            self.game.assign(users.pop(random.randrange(len(users))), 'wolf')
+            self.say_public("There are %s or more players, so there are three werewolves." %((WOLF_THRESHOLD_MULTI * 2) + 1), PRIORITY_CRITICAL)
           else:
-            self.say_public("There are %s or more players, so there are two werewolves." %(WOLF_THRESHOLD_MULTI + 1))
+            self.say_public("There are %s or more players, so there are two werewolves." %(WOLF_THRESHOLD_MULTI + 1), PRIORITY_CRITICAL)
         else:
-          self.say_public("There are less than %s players, so there is only one werewolf." %(WOLF_THRESHOLD_MULTI + 1))
+          self.say_public("There are less than %s players, so there is only one werewolf." %(WOLF_THRESHOLD_MULTI + 1), PRIORITY_CRITICAL)
 			
-        self.originalwolves = self.wolves[:]
+        self.game.originalwolves = PlayerList(self.game, self.game.wolves)
         
         #Generate roles
         for i in range(roles):
@@ -746,72 +1073,71 @@ class WolfBot(SingleServerIRCBot):
           while role == 0:
             role = random.randint(1, 100)
             if role > (100 - WATCHMAN_CHANCE):
-              if self.watchman != None:
+              if self.game.watchman != None:
                 role = 0
               else:
-                self.watchman = users.pop(random.randrange(len(users)))
+                self.game.assign(users.pop(random.randrange(len(users))), 'watchman')
             elif role > (CUPID_CHANCE + ANGEL_CHANCE + NINJA_CHANCE + MYSTIC_CHANCE + SEER_CHANCE):
-              if self.village_elder != None:
+              if self.game.village_elder != None:
                 role = 0
               else:
-                self.village_elder = users.pop(random.randrange(len(users)))
+                self.game.assign(users.pop(random.randrange(len(users))), 'village_elder')
             elif role > (ANGEL_CHANCE + NINJA_CHANCE + MYSTIC_CHANCE + SEER_CHANCE):
-              if self.cupid != None:
+              if self.game.cupid != None:
                 role = 0
               else:
-                self.cupid = users.pop(random.randrange(len(users)))
+                self.game.assign(users.pop(random.randrange(len(users))), 'cupid')
             elif role > (ANGEL_CHANCE + MYSTIC_CHANCE + SEER_CHANCE):
-              if self.ninja != None:
+              if self.game.ninja != None:
                 role = 0
               else:
-                self.ninja = users.pop(random.randrange(len(users)))
+                self.game.assign(users.pop(random.randrange(len(users))), 'ninja')
             elif role > (MYSTIC_CHANCE + SEER_CHANCE):
-              if self.angel != None:
+              if self.game.angel != None:
                 role = 0
               else:
-                self.angel = users.pop(random.randrange(len(users)))
+                self.game.assign(users.pop(random.randrange(len(users))), 'angel')
             elif role > SEER_CHANCE:
-              if self.mystic != None:
+              if self.game.mystic != None:
                 role = 0
               else:
-                self.mystic = users.pop(random.randrange(len(users)))
+                self.game.assign(users.pop(random.randrange(len(users))), 'mystic')
             else:
-              if self.seer != None:
+              if self.game.seer != None:
                 role = 0
               else:
-                self.seer = users.pop(random.randrange(len(users)))
+                self.game.assign(users.pop(random.randrange(len(users))), 'seer')
               
         for user in users:
-          self.villagers.append(user)
+          self.game.assign(user, 'villager')
 
         # Private message each user, tell them their role.
-        if self.seer != None:
-          self.say_private(self.seer, self.seer_intro_text)
-        if self.mystic != None:
-          self.say_private(self.mystic, self.mystic_intro_text)
-        if self.angel != None:
-          self.say_private(self.angel, self.angel_intro_text)
-        if self.ninja != None:
-          self.say_private(self.ninja, self.ninja_intro_text)
-        if self.cupid != None:
-          self.say_private(self.cupid, self.cupid_intro_text)
-        if self.village_elder != None:
-          self.say_private(self.village_elder, self.elder_intro_text)
-        if self.watchman != None:
-          self.say_private(self.watchman, self.watchman_intro_text)
+        if self.game.seer != None:
+          self.say_private(self.game.seer, self.seer_intro_text, PRIORITY_CRITICAL)
+        if self.game.mystic != None:
+          self.say_private(self.game.mystic, self.mystic_intro_text, PRIORITY_CRITICAL)
+        if self.game.angel != None:
+          self.say_private(self.game.angel, self.angel_intro_text, PRIORITY_CRITICAL)
+        if self.game.ninja != None:
+          self.say_private(self.game.ninja, self.ninja_intro_text, PRIORITY_CRITICAL)
+        if self.game.cupid != None:
+          self.say_private(self.game.cupid, self.cupid_intro_text, PRIORITY_CRITICAL)
+        if self.game.village_elder != None:
+          self.say_private(self.game.village_elder, self.elder_intro_text, PRIORITY_CRITICAL)
+        if self.game.watchman != None:
+          self.say_private(self.game.watchman, self.watchman_intro_text, PRIORITY_CRITICAL)
           
-        for wolf in self.wolves:
-          self.say_private(wolf, self.wolf_intro_text)
-        for villager in self.villagers:
-          self.say_private(villager, self.villager_intro_text)
+        for wolf in self.game.wolves:
+          self.say_private(wolf, self.wolf_intro_text, PRIORITY_CRITICAL)
+        for villager in self.game.villagers:
+          self.say_private(villager, self.villager_intro_text, PRIORITY_CRITICAL)
 
         if self.debug:
-          print "SEER: %s, WOLVES: %s" % (self.seer, self.wolves)
+          print "SEER: %s, WOLVES: %s" % (self.game.seer, self.game.wolves)
         
-        self.first_night = True
+        self.game.first_night = True
         # Start game by putting bot into "night" mode.
-        time.sleep(5)
-        self.night()
+        self.schedule_delayed(5, self.night)
 
 
   def end_game(self, game_ender):
@@ -820,10 +1146,10 @@ class WolfBot(SingleServerIRCBot):
     if self.gamestate == self.GAMESTATE_NONE:
       self.say_public(\
                "No game is in progress.  Use 'start' to begin a game.")
-    elif self.game_starter and game_ender != self.game_starter:
+    elif self.game.game_starter and game_ender != self.game.game_starter:
       self.say_public(\
         ("Sorry, only the starter of the game (%s) may end it." %\
-         self.game_starter))
+         self.game.game_starter))
     else:
       self.say_public("The game has ended.")
       if self.gamestate == self.GAMESTATE_RUNNING:
@@ -835,132 +1161,83 @@ class WolfBot(SingleServerIRCBot):
 
   def reveal_all_identities(self):
     "Print everyone's identities."
-    
-    self.say_public("*** Player roles:")
-    
-    wolf_msg = []
-    for i in range(len(self.originalwolves)):
-      if self.originalwolves[i] in self.live_players:
-        wolf_msg.append(IRC_UNDERLINE + self.originalwolves[i])
-      else:
-        wolf_msg.append(self.originalwolves[i])
-    if len(self.originalwolves) == 3:
-      self.say_public("*** " + IRC_BOLD + WOLF_COLOR + "Wolves: " + IRC_DEFAULT + IRC_BOLD + wolf_msg[0] + IRC_DEFAULT + ", " + IRC_BOLD + wolf_msg[1] + IRC_DEFAULT + " and " + IRC_BOLD + wolf_msg[2])
-    if len(self.originalwolves) == 2:
-      self.say_public("*** " + IRC_BOLD + WOLF_COLOR + "Wolves: " + IRC_DEFAULT + IRC_BOLD + wolf_msg[0] + IRC_DEFAULT + " and " + IRC_BOLD + wolf_msg[1])
+
+    def mark(player):
+      # Survivors are underlined.
+      if player in self.game.live_players:
+        return IRC_UNDERLINE + player + IRC_DEFAULT
+      return player
+
+    segments = ["*** Player roles:"]
+    wolf_msg = [IRC_BOLD + mark(wolf) for wolf in self.game.originalwolves]
+    if len(wolf_msg) > 1:
+      segments.append("*** " + IRC_BOLD + WOLF_COLOR + "Wolves: " + IRC_DEFAULT + (IRC_DEFAULT + ", ").join(wolf_msg[:-1]) + IRC_DEFAULT + " and " + wolf_msg[-1])
     else:
-      self.say_public("*** " + IRC_BOLD + WOLF_COLOR + "Wolf: " + IRC_DEFAULT + IRC_BOLD + wolf_msg[0])
-    
-    if self.seer != None:
-      if self.seer in self.live_players:
-        seer_msg = IRC_UNDERLINE + self.seer
-      else:
-        seer_msg = self.seer
-      self.say_public("*** " + IRC_BOLD + SEER_COLOR + "Seer: " + IRC_BOLD + seer_msg)
-    if self.mystic != None:
-      if self.mystic in self.live_players:
-        mystic_msg = IRC_UNDERLINE + self.mystic
-      else:
-        mystic_msg = self.mystic
-      self.say_public("*** " + IRC_BOLD + MYSTIC_COLOR + "Mystic: " + IRC_BOLD + mystic_msg)
-    if self.angel != None:
-      if self.angel in self.live_players:
-        angel_msg = IRC_UNDERLINE + self.angel
-      else:
-        angel_msg = self.angel
-      self.say_public("*** " + IRC_BOLD + ANGEL_COLOR + "Angel: " + IRC_BOLD + angel_msg)
-    if self.ninja != None:
-      if self.ninja in self.live_players:
-        ninja_msg = IRC_UNDERLINE + self.ninja
-      else:
-        ninja_msg = self.ninja
-      self.say_public("*** " + IRC_BOLD + NINJA_COLOR + "Ninja: " + IRC_BOLD + ninja_msg)
-    if self.cupid != None:
-      if self.cupid in self.live_players:
-        cupid_msg = IRC_UNDERLINE + self.cupid
-      else:
-        cupid_msg = self.cupid
-      self.say_public("*** " + IRC_BOLD + CUPID_COLOR + "Cupid: " + IRC_BOLD + cupid_msg)
-    if self.village_elder != None:
-      if self.village_elder in self.live_players:
-        village_elder_msg = IRC_UNDERLINE + self.village_elder
-      else:
-        village_elder_msg = self.village_elder
-      self.say_public("*** " + IRC_BOLD + ELDER_COLOR + "Village elder: " + IRC_BOLD + village_elder_msg)
-    if self.watchman != None:
-      if self.watchman in self.live_players:
-        watchman_msg = IRC_UNDERLINE + self.watchman
-      else:
-        watchman_msg = self.watchman
-      self.say_public("*** " + IRC_BOLD + WATCHMAN_COLOR + "Watchman: " + IRC_BOLD + watchman_msg)
-    if self.lovers:
-      lover_msg = []
-      for i in range(self.lovers):
-        if self.lovers[i] in self.live_players:
-          lover_msg.append(IRC_UNDERLINE + self.lovers[i])
-        else:
-          lover_msg.append(self.lovers[i])
-      self.say_public("*** " + IRC_BOLD + LOVERS_COLOR + "Lovers: " + IRC_BOLD + lover_msg[0] + IRC_DEFAULT + " and " + IRC_BOLD + LOVERS_COLOR + lover_msg[0])
-    if self.villagers:
-      if self.villagers[0] in self.live_players:
-        msg = "*** " + IRC_BOLD + "Villagers: " + IRC_UNDERLINE + self.villagers[0] + IRC_DEFAULT
-      else:
-        msg = "*** " + IRC_BOLD + "Villagers: " + self.villagers[0] + IRC_DEFAULT
-      for i in range(1, len(self.villagers)):
-        if self.villagers[i] in self.live_players:
-          msg += ", " + IRC_UNDERLINE + self.villagers[i] + IRC_DEFAULT
-        else:
-          msg += ", " + self.villagers[i]
-      self.say_public(msg)
-    
+      segments.append("*** " + IRC_BOLD + WOLF_COLOR + "Wolf: " + IRC_DEFAULT + wolf_msg[0])
+
+    for player, color, title in (
+        (self.game.seer, SEER_COLOR, "Seer"),
+        (self.game.mystic, MYSTIC_COLOR, "Mystic"),
+        (self.game.angel, ANGEL_COLOR, "Angel"),
+        (self.game.ninja, NINJA_COLOR, "Ninja"),
+        (self.game.cupid, CUPID_COLOR, "Cupid"),
+        (self.game.village_elder, ELDER_COLOR, "Village elder"),
+        (self.game.watchman, WATCHMAN_COLOR, "Watchman")):
+      if player != None:
+        segments.append("*** " + IRC_BOLD + color + title + ": " + IRC_BOLD + mark(player))
+    if self.game.lovers:
+      segments.append("*** " + IRC_BOLD + LOVERS_COLOR + "Lovers: " + IRC_BOLD + mark(self.game.lovers[0]) + IRC_DEFAULT + " and " + IRC_BOLD + LOVERS_COLOR + mark(self.game.lovers[1]))
+    if self.game.villagers:
+      segments.append("*** " + IRC_BOLD + "Villagers: " + ", ".join([mark(villager) for villager in self.game.villagers]))
+    self.say_public_segments(segments, PRIORITY_CRITICAL)
+
   def check_game_over(self):
     """End the game if either villagers or werewolves have won.
     Return 1 if game is over, 0 otherwise."""
     
     # If everyone is dead, everyone loses.
-    if not self.live_players:
-      self.say_public("Everyone is dead! " + IRC_BOLD + "Nobody wins.")
-      self.end_game(self.game_starter)
+    if not self.game.live_players:
+      self.say_public("Everyone is dead! " + IRC_BOLD + "Nobody wins.", PRIORITY_CRITICAL)
+      self.end_game(self.game.game_starter)
       return 1
     # If all wolves are dead, the villagers win.
-    if not self.wolves:
-      self.say_public("The wolves are dead!  The " + IRC_BOLD + IRC_RED + "villagers" + IRC_DEFAULT + " have " + IRC_BOLD + IRC_RED + "won" + IRC_DEFAULT + ".")
-      self.end_game(self.game_starter)
+    if not self.game.live_wolves:
+      self.say_public("The wolves are dead!  The " + IRC_BOLD + IRC_RED + "villagers" + IRC_DEFAULT + " have " + IRC_BOLD + IRC_RED + "won" + IRC_DEFAULT + ".", PRIORITY_CRITICAL)
+      self.end_game(self.game.game_starter)
       return 1
 
     # If the number of non-wolves is the same as the number of wolves,
     # then the wolves win.
-    if (len(self.live_players) - len(self.wolves)) <= len(self.wolves):
+    if self.game.live_villagers <= self.game.live_wolves:
       lover_pos = self.check_wolf_lovers()
       if lover_pos:
-        if len(self.wolves) == 1:
-          self.say_public("Everyone except the lovers are dead! The " + IRC_BOLD + IRC_RED + "lovers" + IRC_DEFAULT + " have " + IRC_BOLD + IRC_RED + "won" + IRC_DEFAULT + ".")
-          self.end_game(self.game_starter)
+        if self.game.live_wolves == 1:
+          self.say_public("Everyone except the lovers are dead! The " + IRC_BOLD + IRC_RED + "lovers" + IRC_DEFAULT + " have " + IRC_BOLD + IRC_RED + "won" + IRC_DEFAULT + ".", PRIORITY_CRITICAL)
+          self.end_game(self.game.game_starter)
         else:
-          self.say_public("There are now an equal number of villagers and werewolves.")
+          self.say_public("There are now an equal number of villagers and werewolves.", PRIORITY_CRITICAL)
           msg = "The werewolves have no need to hide anymore; "
           msg = msg + "They attack the remaining villagers. "
-          msg = msg + "Amongst the villagers who were killed, " + self.lovers[lover_pos[0]] + " finds their dead lover " + self.lovers[lover_pos[1]] + "."
-          msg = msg + "In shock and grief, " + self.lovers[lover_pos[0]] + " commits suicide."
+          msg = msg + "Amongst the villagers who were killed, " + self.game.lovers[lover_pos[0]] + " finds their dead lover " + self.game.lovers[lover_pos[1]] + "."
+          msg = msg + "In shock and grief, " + self.game.lovers[lover_pos[0]] + " commits suicide."
           msg = msg + "The " + IRC_BOLD + IRC_RED + "werewolves" + IRC_DEFAULT + " have " + IRC_BOLD + IRC_RED + "won" + IRC_DEFAULT + "."
-          self.say_public(msg)
-          self.live_players.remove(self.lovers[lover_pos[0]])
-          self.dead_players.append(self.lovers[lover_pos[0]])
-          for player in self.live_players:
-            if player not in self.wolves:
-              self.live_players.remove(player)
+          self.say_public(msg, PRIORITY_CRITICAL)
+          self.game.kill(self.game.lovers[lover_pos[0]])
+          for player in self.game.live_players[:]:
+            if player not in self.game.wolves:
+              self.game.live_players.remove(player)
       else:
         self.say_public(\
-          "There are now an equal number of villagers and werewolves.")
+          "There are now an equal number of villagers and werewolves.", PRIORITY_CRITICAL)
         msg = "The werewolves have no need to hide anymore; "
         msg = msg + "They attack the remaining villagers. "
         msg = msg + "The " + IRC_BOLD + IRC_RED + "werewolves" + IRC_DEFAULT + " have " + IRC_BOLD + IRC_RED + "won" + IRC_DEFAULT + "."
-        self.say_public(msg)
-        for player in self.live_players:
-          if player not in self.wolves:
-            self.live_players.remove(player)
+        self.say_public(msg, PRIORITY_CRITICAL)
+        for player in self.game.live_players[:]:
+          if player not in self.game.wolves:
+            self.game.live_players.remove(player)
         
-      self.end_game(self.game_starter)
+      self.end_game(self.game.game_starter)
       return 1
       
     return 0
@@ -969,225 +1246,193 @@ class WolfBot(SingleServerIRCBot):
     """Check if the lovers are a wolf and a villager.
     Returns the positions of the lovers or an empty list if not """
     lover_pos = []
-    if self.lovers and (self.lovers[0] in self.live_players and self.lovers[1] in self.live_players):
-      if (self.lovers[0] in self.wolves) and not (self.lovers[1] in self.wolves):
+    if self.game.lovers and (self.game.lovers[0] in self.game.live_players and self.game.lovers[1] in self.game.live_players):
+      if (self.game.lovers[0] in self.game.wolves) and not (self.game.lovers[1] in self.game.wolves):
         lover_pos.append(0)
         lover_pos.append(1)
         return lover_pos
-      elif (not self.lovers[0] in self.wolves) and (self.lovers[1] in self.wolves):
+      elif (not self.game.lovers[0] in self.game.wolves) and (self.game.lovers[1] in self.game.wolves):
         lover_pos.append(1)
         lover_pos.append(0)
         return lover_pos
     return lover_pos
 
 
-  def check_night_done(self, elapsed = 0):
-    "Check if nighttime is over.  Return 1 if night is done, 0 otherwise."
-
-    #if self.first_night:
-      #if elapsed > NIGHT_LENGTH:
-        #return 1
-    if elapsed > NIGHT_LENGTH:
-      return 1
-    # Is the seer done seeing?
-    if self.seer is None or self.seer not in self.live_players:
-      seer_done = 1
-    else:
-      if self.seer_target is None:
-        seer_done = 0
-      else:
-        seer_done = 1
-    
-    # Is the mystic done guarding
-    if self.mystic is None or self.mystic not in self.live_players:
-      mystic_done = 1
-    else:
-      if self.mystic_target is None:
-        mystic_done = 0
-      else:
-        mystic_done = 1
-    
-    # If ninja hasn't acted yet is ninja done assassinating
-    if self.ninja is None or self.ninja not in self.live_players or (self.ninja_target is not None and self.ninja_target not in self.live_players) or self.ninja_sleep:
-      ninja_done = 1
-    else:
-      if self.ninja_target is None:
-        ninja_done = 0
-      else:
-        ninja_done = 1
-    
-    # If the cupid has acted yet on the first night
-    if self.cupid is None or self.cupid not in self.live_players or not self.first_night:
-      cupid_done = 1
-    else:
-      if self.lovers:
-        cupid_done = 1
-      else:
-        cupid_done = 0
-    
-
-    if (self.wolf_target is not None or self.wolf_sleep) and seer_done and mystic_done and ninja_done and cupid_done:
+  def check_night_done(self):
+    """Check if everyone has acted for the night.  Return 1 if night
+    is done, 0 otherwise."""
+    if self.game.night_done():
       return 1
     else:
       return 0
   
-  def check_day_done(self, elapsed):
-    "Check if daytime is over. Return 1 if day is done, 0 otherwise."
-    
-    if elapsed > DAY_LENGTH:
-      return 1
-
   def night(self):
     "Declare a NIGHT episode of gameplay."
     
-    self.time = "night"
-    if not self.first_night:
+    self.cancel_timers()
+    self.voting = False
+    # The day is over, but night only falls in nightfall(); neither
+    # votes nor night actions are taken in between.
+    self.time = "dusk"
+    if not self.game.first_night and self.game.nonvoters:
       #Check if someone hasn't voted two days in a row
-      if self.nonvoters:
-        for voter in self.nonvoters:
-          if voter not in self.villager_votes:
-            self.say_public(self.getRole(voter) + " failed to vote two nights in a row, and has been struck down by the forces of good.")
-            self.kill_player(voter, False, False)
-        time.sleep(3)
-      
+      for voter in self.game.nonvoters:
+        if voter not in self.game.villager_votes:
+          self.say_public(self.getRole(voter) + " failed to vote two nights in a row, and has been struck down by the forces of good.", PRIORITY_CRITICAL)
+          self.kill_player(voter, False, False)
+      self.schedule_delayed(3, self.nightfall)
+    else:
+      self.nightfall()
+
+  def nightfall(self):
+    "Second half of night(), after any non-voters have been dealt with."
+
+    self.time = "night"
+    if not self.game.first_night:
       if self.check_game_over():
         return
-      del self.nonvoters[:]    
-      for voter in self.live_players:
-        if voter not in self.villager_votes:
-          self.nonvoters.append(voter)
+      self.game.nonvoters.clear()
+      for voter in self.game.live_players:
+        if voter not in self.game.villager_votes:
+          self.game.nonvoters.append(voter)
       
     # Clear any daytime variables
-    self.villager_votes = {}
-    self.tally = {}
+    self.game.villager_votes.clear()
+    self.game.tally.clear()
 
     # Declare nighttime.
     self.fix_modes(True)
-    self.print_alive()
+    self.print_alive(PRIORITY_CRITICAL)
     for text in self.night_game_texts:
-      self.say_public(text)
+      self.say_public(text, PRIORITY_CRITICAL)
 
     # Give private instructions to wolves and other roles.
-    if self.seer is not None and self.seer in self.live_players:
-        self.say_private(self.seer, self.night_seer_text)
-    if self.mystic is not None and self.mystic in self.live_players:
-        self.say_private(self.mystic, self.night_mystic_text)
-    if self.angel is not None and self.angel in self.live_players:
-        self.say_private(self.angel, self.night_angel_text)
-    if self.ninja is not None and self.ninja in self.live_players and self.ninja_target is None:
-        self.say_private(self.ninja, self.night_ninja_text)
-    if self.cupid is not None and self.cupid in self.live_players and self.first_night:
-        self.say_private(self.cupid, self.night_cupid_text)
-    if self.watchman is not None and self.watchman in self.live_players:
-        self.say_private(self.watchman, self.night_watchman_text)
-    for wolf in self.wolves:
-        self.say_private(wolf, self.night_werewolf_text)
-    if len(self.wolves) == 3:
-      self.say_private(self.wolves[0],\
+    if self.game.seer is not None and self.game.seer in self.game.live_players:
+        self.say_private(self.game.seer, self.night_seer_text, PRIORITY_CRITICAL)
+    if self.game.mystic is not None and self.game.mystic in self.game.live_players:
+        self.say_private(self.game.mystic, self.night_mystic_text, PRIORITY_CRITICAL)
+    if self.game.angel is not None and self.game.angel in self.game.live_players:
+        self.say_private(self.game.angel, self.night_angel_text, PRIORITY_CRITICAL)
+    if self.game.ninja is not None and self.game.ninja in self.game.live_players and self.game.ninja_target is None:
+        self.say_private(self.game.ninja, self.night_ninja_text, PRIORITY_CRITICAL)
+    if self.game.cupid is not None and self.game.cupid in self.game.live_players and self.game.first_night:
+        self.say_private(self.game.cupid, self.night_cupid_text, PRIORITY_CRITICAL)
+    if self.game.watchman is not None and self.game.watchman in self.game.live_players:
+        self.say_private(self.game.watchman, self.night_watchman_text, PRIORITY_CRITICAL)
+    for wolf in self.game.wolves:
+        self.say_private(wolf, self.night_werewolf_text, PRIORITY_CRITICAL)
+    if len(self.game.wolves) == 3:
+      self.say_private(self.game.wolves[0],\
                        ("The other werewolves are %s and %s.  Confer privately."\
-                        % (self.wolves[1], self.wolves[2])))
-      self.say_private(self.wolves[1],\
+                        % (self.game.wolves[1], self.game.wolves[2])), PRIORITY_CRITICAL)
+      self.say_private(self.game.wolves[1],\
                        ("The other werewolves are %s and %s.  Confer privately."\
-                        % (self.wolves[0], self.wolves[2])))
-      self.say_private(self.wolves[2],\
+                        % (self.game.wolves[0], self.game.wolves[2])), PRIORITY_CRITICAL)
+      self.say_private(self.game.wolves[2],\
                        ("The other werewolves are %s and %s.  Confer privately."\
-                        % (self.wolves[0], self.wolves[1])))
-    elif len(self.wolves) == 2:
-      self.say_private(self.wolves[0],\
+                        % (self.game.wolves[0], self.game.wolves[1])), PRIORITY_CRITICAL)
+    elif len(self.game.wolves) == 2:
+      self.say_private(self.game.wolves[0],\
                        ("The other werewolf is %s.  Confer privately."\
-                        % self.wolves[1]))
-      self.say_private(self.wolves[1],\
+                        % self.game.wolves[1]), PRIORITY_CRITICAL)
+      self.say_private(self.game.wolves[1],\
                        ("The other werewolf is %s.  Confer privately."\
-                        % self.wolves[0]))
-    
-    time.sleep(5)
-    
-    self.night_timer = time.time()
+                        % self.game.wolves[0]), PRIORITY_CRITICAL)
+
+    self.schedule_delayed(5, self.start_night_timer)
     # ... bot is now in 'night' mode;  goes back to doing nothing but
     # waiting for commands.
 
+  def start_night_timer(self):
+    "Start counting down the night, once the instructions are out."
+    self.night_timer = time.time()
+    self.schedule_at(self.night_timer + NIGHT_LENGTH, self.day)
+
 
   def day(self):
     "Declare a DAY episode of gameplay."
     
-    if self.first_night:
-      self.first_night = False
+    self.cancel_timers()
+    if self.game.first_night:
+      self.game.first_night = False
     
     self.day_extra_time = 0
     self.time = "day"
     
     # Discover dead bodies if someone has been killed during the night, depending on the actions of each player role
     
-    if self.seer_target is not None:
+    if self.game.seer_target is not None:
       role = ""
-      if self.seer_target == self.mystic:
+      if self.game.seer_target == self.game.mystic:
         role = MYSTIC_COLOR + "the mystic." + IRC_DEFAULT
-      elif self.seer_target == self.angel:
+      elif self.game.seer_target == self.game.angel:
         role = ANGEL_COLOR + "the angel." + IRC_DEFAULT
-      elif self.seer_target == self.ninja:
+      elif self.game.seer_target == self.game.ninja:
         role = NINJA_COLOR + "the ninja." + IRC_DEFAULT
-      elif self.seer_target == self.cupid:
+      elif self.game.seer_target == self.game.cupid:
         role = CUPID_COLOR + "the cupid." + IRC_DEFAULT
-      elif self.seer_target == self.village_elder:
+      elif self.game.seer_target == self.game.village_elder:
         role = ELDER_COLOR + "the village elder." + IRC_DEFAULT
-      elif self.seer_target == self.watchman:
+      elif self.game.seer_target == self.game.watchman:
         role = WATCHMAN_COLOR + "the watchman." + IRC_DEFAULT
-      elif self.seer_target in self.wolves:
+      elif self.game.seer_target in self.game.wolves:
         role = WOLF_COLOR + "a werewolf!" + IRC_DEFAULT
       else:
         role = "a villager."
-      self.say_private(self.seer, "You saw into the mind of " + IRC_BOLD + self.seer_target + IRC_DEFAULT + ", and discovered they are " + IRC_BOLD + role + IRC_DEFAULT)
+      self.say_private(self.game.seer, "You saw into the mind of " + IRC_BOLD + self.game.seer_target + IRC_DEFAULT + ", and discovered they are " + IRC_BOLD + role + IRC_DEFAULT, PRIORITY_CRITICAL)
       
     assassinated = False
-    if self.ninja_target in self.live_players:
+    if self.game.ninja_target in self.game.live_players:
       assassinated = True
     
-    if (self.wolf_target == self.mystic_target) or (self.wolf_target == self.angel) or (self.wolf_target == None) or (self.wolf_target == self.ninja_target):
+    if (self.game.wolf_target == self.game.mystic_target) or (self.game.wolf_target == self.game.angel) or (self.game.wolf_target == None) or (self.game.wolf_target == self.game.ninja_target):
       if not assassinated:
-        self.say_public("The night seems to have transpired peacefully.")
+        self.say_public("The night seems to have transpired peacefully.", PRIORITY_CRITICAL)
       else:
-        self.say_public("The ninja strikes!")
-        self.say_public("The village awakes to find the body of " + IRC_BOLD + self.getRole(self.ninja_target) + "! Now with 100% less head!")
+        self.say_public("The ninja strikes!", PRIORITY_CRITICAL)
+        self.say_public("The village awakes to find the body of " + IRC_BOLD + self.getRole(self.game.ninja_target) + "! Now with 100% less head!", PRIORITY_CRITICAL)
         
-      if self.watchman is not None:
-        if self.wolf_target is None:
-          self.say_private(self.watchman, "The night transpired with no unusual attacks.")
-        elif self.wolf_target is not None or (self.wolf_target == self.ninja_target):
-          self.say_private(self.watchman, "The werewolves attacked %s last night, but failed!" % self.wolf_target)
+      if self.game.watchman is not None:
+        if self.game.wolf_target is None:
+          self.say_private(self.game.watchman, "The night transpired with no unusual attacks.", PRIORITY_CRITICAL)
+        elif self.game.wolf_target is not None or (self.game.wolf_target == self.game.ninja_target):
+          self.say_private(self.game.watchman, "The werewolves attacked %s last night, but failed!" % self.game.wolf_target, PRIORITY_CRITICAL)
       
       if assassinated:
-        self.kill_player(self.ninja_target, False)
+        self.kill_player(self.game.ninja_target, False)
     else:
-      for text in self.getKillTexts(self.wolf_target):
-        self.say_public(text)
-      self.kill_player(self.wolf_target, False)
+      for text in self.getKillTexts(self.game.wolf_target):
+        self.say_public(text, PRIORITY_CRITICAL)
+      self.kill_player(self.game.wolf_target, False)
       if assassinated:
-        self.say_public("The ninja strikes!")
-        self.say_public("The village awakes to find the body of " + IRC_BOLD + self.getRole(self.ninja_target) + "! Now with 100% less head!")
+        self.say_public("The ninja strikes!", PRIORITY_CRITICAL)
+        self.say_public("The village awakes to find the body of " + IRC_BOLD + self.getRole(self.game.ninja_target) + "! Now with 100% less head!", PRIORITY_CRITICAL)
         
       if assassinated:
-        self.kill_player(self.ninja_target, False)
+        self.kill_player(self.game.ninja_target, False)
     
     if self.check_game_over():
       return
         
     # Clear all the nighttime variables:
-    self.seer_target = None
-    self.old_mystic_target = self.mystic_target
-    self.mystic_target = None
-    self.wolf_target = None
-    self.wolf_votes = {}
-    self.ninja_sleep = False
-    self.wolf_sleep = False
-    self.sleeping_wolves = []
+    self.game.seer_target = None
+    self.game.old_mystic_target = self.game.mystic_target
+    self.game.mystic_target = None
+    self.game.wolf_target = None
+    self.game.wolf_votes.clear()
+    self.game.ninja_sleep = False
+    self.game.wolf_sleep = False
+    self.game.sleeping_wolves.clear()
 
     # Give daytime instructions.
-    self.print_alive()
+    self.print_alive(PRIORITY_CRITICAL)
     for text in self.morning_game_texts:
-      self.say_public(text)
+      self.say_public(text, PRIORITY_CRITICAL)
     
     self.fix_modes()
     self.day_timer = time.time()
+    self.schedule_at(self.day_timer + DAY_LENGTH / 2, self.open_voting)
+    self.schedule_at(self.day_timer + DAY_LENGTH, self.end_day)
     # ... bot is now in 'day' mode;  goes back to doing nothing but
     # waiting for commands.
 
@@ -1201,42 +1446,42 @@ class WolfBot(SingleServerIRCBot):
     if self.time != "night":
       self.reply(e, "You can only sleep during the night.")
     
-    who = nm_to_n(e.source()).strip("&")
+    who = e.nick().strip("&")
     
-    if who != self.ninja or who not in self.wolves:
+    if who != self.game.ninja or who not in self.game.wolves:
       "Don't fall asleep."
     
-    if who == self.ninja:
-      if self.ninja_sleep or self.ninja_target is not None:
+    if who == self.game.ninja:
+      if self.game.ninja_sleep or self.game.ninja_target is not None:
         self.reply(e, "You're already fast asleep. What else would you be doing in the middle of the night?")
       else:
-        self.ninja_sleep = True
+        self.game.ninja_sleep = True
         self.reply(e, "You decide to save your skills for another night.")
         
         if self.check_night_done():
           self.day()
-    elif who in self.wolves:
-      if who in self.wolf_votes:
+    elif who in self.game.wolves:
+      if who in self.game.wolf_votes:
         self.reply(e, "You've already acted tonight.")
-      elif self.wolf_sleep or who in self.sleeping_wolves:
+      elif self.game.wolf_sleep or who in self.game.sleeping_wolves:
         self.reply(e, "You're already fast asleep. You're not some kind of freak who stays up all night.")
       else:
-        self.sleeping_wolves.append(who)
+        self.game.sleeping_wolves.append(who)
         
         self.reply(e, "You decide to not give in to your hunger, for tonight at least.")
         
-        if len(self.sleeping_wolves) == len(self.wolves):
-          self.wolf_sleep = True
+        if len(self.game.sleeping_wolves) == len(self.game.wolves):
+          self.game.wolf_sleep = True
           if self.check_night_done():
             self.day()
-        elif len(self.wolf_votes) == (len(self.wolves) - len(self.sleeping_wolves)):
-          target = self.wolf_votes[self.wolf_votes.keys()[0]]
-          for killee in self.wolf_votes.values():
+        elif len(self.game.wolf_votes) == (len(self.game.wolves) - len(self.game.sleeping_wolves)):
+          target = self.game.wolf_votes[self.game.wolf_votes.keys()[0]]
+          for killee in self.game.wolf_votes.values():
             if target != killee:
-              target = self.wolf_votes[self.wolf_votes.keys()[random.randrange(len(self.wolf_votes))]]
+              target = self.game.wolf_votes[self.game.wolf_votes.keys()[random.randrange(len(self.game.wolf_votes))]]
               break
               
-            self.wolf_target = target
+            self.game.wolf_target = target
             if self.check_night_done():
               self.day()
 
@@ -1247,25 +1492,25 @@ class WolfBot(SingleServerIRCBot):
       self.reply(e, "No game is in progress.")
       return
       
-    if who == nm_to_n(e.source()).strip("&"):
+    if who == e.nick().strip("&"):
       self.reply(e, "You cannot see yourself.")
       return
     
     if self.time != "night":
       self.reply(e, "Are you a seer?  In any case, it's not nighttime.")
     else:
-      if self.seer is None or nm_to_n(e.source()) != self.seer:
+      if self.game.seer is None or e.nick() != self.game.seer:
         self.reply(e, "Huh?")
       else:
-        if who not in self.live_players:
+        if who not in self.game.live_players:
           self.reply(e, "That player either doesn't exist, or is dead.")
         else:
-          if self.seer_target is not None:
+          if self.game.seer_target is not None:
             self.reply(e, "You've already exhausted your powers for tonight.")
           else:
-            self.seer_target = who
+            self.game.seer_target = who
             
-            self.reply(e, "Come the morning, you will see %s's true identity." % self.seer_target)
+            self.reply(e, "Come the morning, you will see %s's true identity." % self.game.seer_target)
             if self.check_night_done():
               self.day()
     
@@ -1279,18 +1524,18 @@ class WolfBot(SingleServerIRCBot):
     if self.time != "night":
       self.reply(e, "Are you a mystic? In any case, it's not nighttime.")
     else:
-      if self.mystic is None or nm_to_n(e.source()).strip("&") != self.mystic:
+      if self.game.mystic is None or e.nick().strip("&") != self.game.mystic:
         self.reply(e, "Huh?")
       else:
-        if who not in self.live_players:
+        if who not in self.game.live_players:
           self.reply(e, "That player either doesn't exist, or is dead.")
         else:
-          if self.mystic_target is not None:
+          if self.game.mystic_target is not None:
             self.reply(e, "You can only protect one person each night! Pick another target.")
-          elif self.old_mystic_target == who:
+          elif self.game.old_mystic_target == who:
             self.reply(e, "You must choose someone else residual magic prevents you from continuously protecting the same person!")
           else:
-            self.mystic_target = who
+            self.game.mystic_target = who
             
             self.reply(e, "You charge up your spirit mojo, %s should be safe tonight!" % who)
             if self.check_night_done():
@@ -1303,23 +1548,23 @@ class WolfBot(SingleServerIRCBot):
       self.reply(e, "No game is in progress.")
       return
       
-    if who == nm_to_n(e.source()).strip("&"):
+    if who == e.nick().strip("&"):
       self.reply(e, "You cannot assassinate yourself.")
       return
 	  
     if self.time != "night":
       self.reply(e, "Are you a ninja?  In any case, it's not nighttime.")
     else:
-      if self.ninja is None or nm_to_n(e.source()).strip("&") != self.ninja:
+      if self.game.ninja is None or e.nick().strip("&") != self.game.ninja:
         self.reply(e, "Huh?")
       else:
-        if who not in self.live_players:
+        if who not in self.game.live_players:
           self.reply(e, "That player either doesn't exist, or is dead.")
         else:
-          if self.ninja_target is not None:
+          if self.game.ninja_target is not None:
             self.reply(e, "Not a chance, you're all ninja'd out.")
           else:
-            self.ninja_target = who
+            self.game.ninja_target = who
             
             self.reply(e, "You carry out the assassination silently; No one else noticed anything.")
             
@@ -1336,22 +1581,22 @@ class WolfBot(SingleServerIRCBot):
     if self.time != "night":
       self.reply(e, "Are you a cupid? In any case, it's not nighttime.")
     else:
-      if self.cupid is None or nm_to_n(e.source()).strip("&") != self.cupid:
+      if self.game.cupid is None or e.nick().strip("&") != self.game.cupid:
         self.reply(e, "Huh?")
       else:
-        if who1 not in self.live_players or who2 not in self.live_players:
+        if who1 not in self.game.live_players or who2 not in self.game.live_players:
           self.reply(e, "One or both of the players you are trying to bind are either nonexistant or dead.")
         else:
-          if self.lovers:
+          if self.game.lovers:
             self.reply(e, "You're out of arrows for this game.")
           else:
-            self.lovers.append(who1)
-            self.lovers.append(who2)
+            self.game.lovers.append(who1)
+            self.game.lovers.append(who2)
             
             self.reply(e, "Your arrows strike! " + IRC_BOLD + who1 + IRC_DEFAULT + " and " + IRC_BOLD + who2 + IRC_DEFAULT + " are now lovers.")
             
-            self.say_private(who1, "Cupid's arrow has struck you! Your lover is " + IRC_BOLD + who2 + IRC_DEFAULT + ".")
-            self.say_private(who2, "Cupid's arrow has struck you! Your lover is " + IRC_BOLD + who1 + IRC_DEFAULT + ".")
+            self.say_private(who1, "Cupid's arrow has struck you! Your lover is " + IRC_BOLD + who2 + IRC_DEFAULT + ".", PRIORITY_CRITICAL)
+            self.say_private(who2, "Cupid's arrow has struck you! Your lover is " + IRC_BOLD + who1 + IRC_DEFAULT + ".", PRIORITY_CRITICAL)
             
             #self.say_public("Cupid's arrows have struck! %s and %s are now lovers." % (who1, who2))
             
@@ -1365,40 +1610,40 @@ class WolfBot(SingleServerIRCBot):
       self.reply(e, "No game is in progress.")
       return
     
-    if who == nm_to_n(e.source()).strip("&"):
+    if who == e.nick().strip("&"):
       self.reply(e, "You cannot kill yourself.")
       return
     
     if self.time != "night":
       self.reply(e, "Are you a werewolf?  In any case, it's not nighttime.")
       return
-    if nm_to_n(e.source()) not in self.wolves:
+    if e.nick() not in self.game.wolves:
       self.reply(e, "Huh?")
       return
-    if who not in self.live_players:
+    if who not in self.game.live_players:
       self.reply(e, "That player either doesn't exist, or is dead.")
       return
     
-    wolf = nm_to_n(e.source()).strip("&")
-    if self.wolf_sleep or wolf in self.sleeping_wolves:
+    wolf = e.nick().strip("&")
+    if self.game.wolf_sleep or wolf in self.game.sleeping_wolves:
       self.reply(e, "Go back to bed!")
       return
       
-    if (len(self.wolves) - len(self.sleeping_wolves)) > 1:
+    if (len(self.game.wolves) - len(self.game.sleeping_wolves)) > 1:
       # Multiple wolves are alive:
-      self.wolf_votes[wolf] = who
+      self.game.wolf_votes[wolf] = who
       self.reply(e, "Your vote is acknowledged.")
 
       # If all wolves have voted, look for agreement:
-      if len(self.wolf_votes) == (len(self.wolves) + len(self.sleeping_wolves)):
+      if len(self.game.wolf_votes) == (len(self.game.wolves) + len(self.game.sleeping_wolves)):
         agree = True
-        for killee in self.wolf_votes.values():
+        for killee in self.game.wolf_votes.values():
           if who != killee:
-            who = self.wolf_votes[self.wolf_votes.keys()[random.randrange(len(self.wolf_votes))]]
+            who = self.game.wolf_votes[self.game.wolf_votes.keys()[random.randrange(len(self.game.wolf_votes))]]
             self.reply(e, "The werewolves ")
             agree = False
             break
-        self.wolf_target = who
+        self.game.wolf_target = who
         if agree:
             self.reply(e, "It is done. The werewolves agree.")
         if self.check_night_done():
@@ -1406,10 +1651,10 @@ class WolfBot(SingleServerIRCBot):
         #self.reply(e, "Hm, I sense disagreement or ambivalence.")
         #self.reply(e, "You wolves should decide on one target.")
       else:
-        self.wolf_target = who
+        self.game.wolf_target = who
     else:
       # only one wolf alive, no need to agree with anyone.
-      self.wolf_target = who
+      self.game.wolf_target = who
       self.reply(e, "Your decision is acknowledged.")
       if self.check_night_done():
         self.day()
@@ -1418,28 +1663,27 @@ class WolfBot(SingleServerIRCBot):
   def kill_player(self, player, check_over = True, del_voter = True):
     "Make a player dead.  Return 1 if game is over, 0 otherwise."
 
-    self.live_players.remove(player)
-    self.dead_players.append(player)
+    self.game.kill(player)
     self.fix_modes()
-    if self.nonvoters and player in self.nonvoters and del_voter:
-      self.nonvoters.remove(player)
+    if self.game.nonvoters and player in self.game.nonvoters and del_voter:
+      self.game.nonvoters.remove(player)
 
-    """if player in self.wolves:
+    """if player in self.game.wolves:
       id = "a " + IRC_BOLD + WOLF_COLOR + "wolf" + IRC_DEFAULT + "!"
-      self.wolves.remove(player)
-    elif player == self.seer:
+      self.game.wolves.remove(player)
+    elif player == self.game.seer:
       id = "the " + IRC_BOLD + SEER_COLOR + "seer" + IRC_DEFAULT + "!"
-    elif player == self.mystic:
+    elif player == self.game.mystic:
       id = "the " + IRC_BOLD + MYSTIC_COLOR + "mystic" + IRC_DEFAULT + "!"
-    elif player == self.angel:
+    elif player == self.game.angel:
       id = "the " + IRC_BOLD + ANGEL_COLOR + "angel" + IRC_DEFAULT + "!"
-    elif player == self.ninja:
+    elif player == self.game.ninja:
       id = "the " + IRC_BOLD + NINJA_COLOR + "ninja" + IRC_DEFAULT + "!"
-    elif player == self.cupid:
+    elif player == self.game.cupid:
       id = "the " + IRC_BOLD + CUPID_COLOR + "cupid" + IRC_DEFAULT + "!"
-    elif player == self.village_elder:
+    elif player == self.game.village_elder:
       id = "the " + IRC_BOLD + ELDER_COLOR + "village elder" + IRC_DEFAULT + "!"
-    elif player == self.watchman:
+    elif player == self.game.watchman:
       id = "the " + IRC_BOLD + WATCHMAN_COLOR + "watchman" + IRC_DEFAULT + "!"
     else:
       id = "a normal villager."
@@ -1449,7 +1693,7 @@ class WolfBot(SingleServerIRCBot):
       if self.check_game_over():
         return 1
     else:
-      self.say_private(player, "You are now " + IRC_BOLD + IRC_RED + "dead" + IRC_DEFAULT + ".  You may observe the game, but please stay quiet until the game is over.")
+      self.say_private(player, "You are now " + IRC_BOLD + IRC_RED + "dead" + IRC_DEFAULT + ".  You may observe the game, but please stay quiet until the game is over.", PRIORITY_CRITICAL)
       
       if check_over:
         return self.check_lovers(player)
@@ -1458,26 +1702,19 @@ class WolfBot(SingleServerIRCBot):
         return 0
   
   def check_lovers(self, player, check = True):
-    if self.lovers and (self.lovers[0] in self.live_players or self.lovers[1] in self.live_players):
-      if player == self.lovers[0]:
-        self.say_public(self.getRole(IRC_BOLD + self.getRole(self.lovers[1]) + IRC_DEFAULT + " cannot live without their lover " +IRC_BOLD + self.lovers[0] + IRC_DEFAULT + "! In grief, they commit suicide."))
-        return self.kill_player(self.lovers[1], check)
-      elif player == self.lovers[1]:
-        self.say_public(self.getRole(IRC_BOLD + self.getRole(self.lovers[0]) + IRC_DEFAULT + " cannot live without their lover " +IRC_BOLD + self.lovers[1] + IRC_DEFAULT + "! In grief, they commit suicide."))
-        return self.kill_player(self.lovers[0], check)
+    if self.game.lovers and (self.game.lovers[0] in self.game.live_players or self.game.lovers[1] in self.game.live_players):
+      if player == self.game.lovers[0]:
+        self.say_public(self.getRole(IRC_BOLD + self.getRole(self.game.lovers[1]) + IRC_DEFAULT + " cannot live without their lover " +IRC_BOLD + self.game.lovers[0] + IRC_DEFAULT + "! In grief, they commit suicide."), PRIORITY_CRITICAL)
+        return self.kill_player(self.game.lovers[1], check)
+      elif player == self.game.lovers[1]:
+        self.say_public(self.getRole(IRC_BOLD + self.getRole(self.game.lovers[0]) + IRC_DEFAULT + " cannot live without their lover " +IRC_BOLD + self.game.lovers[1] + IRC_DEFAULT + "! In grief, they commit suicide."), PRIORITY_CRITICAL)
+        return self.kill_player(self.game.lovers[0], check)
     else: return 0
 
 
   def tally_votes(self):
     "Count votes in villager_votes{}, store results in tally{}."
-
-    self.tally = {}
-    for key in self.villager_votes.keys():
-      lynchee = self.villager_votes[key]
-      if self.tally.has_key(lynchee):
-        self.tally[lynchee] += 1
-      else:
-        self.tally[lynchee] = 1
+    self.game.count_votes()
 
 
   def check_for_votes(self):
@@ -1485,11 +1722,11 @@ class WolfBot(SingleServerIRCBot):
     that player's name.  Else return None."""
     highest = 1
     victims = []
-    for lynchee in self.tally.keys():
-      if self.tally[lynchee] == highest:
+    for lynchee in self.game.tally.keys():
+      if self.game.tally[lynchee] == highest:
         victims.append(lynchee)
-      elif self.tally[lynchee] > highest:
-        highest = self.tally[lynchee]
+      elif self.game.tally[lynchee] > highest:
+        highest = self.game.tally[lynchee]
         del victims[:]
         victims.append(lynchee)
 
@@ -1498,11 +1735,11 @@ class WolfBot(SingleServerIRCBot):
 
   def print_tally(self, ended = True):
     "Publically display the vote tally."
-    if self.tally:
+    if self.game.tally:
       msg = "Current vote tally: "
-      for lynchee in self.tally.keys():
-        if self.tally[lynchee] > 1:
-          msg = msg + ("(%s : %d votes) " % (lynchee, self.tally[lynchee]))
+      for lynchee in self.game.tally.keys():
+        if self.game.tally[lynchee] > 1:
+          msg = msg + ("(%s : %d votes) " % (lynchee, self.game.tally[lynchee]))
         else:
           msg = msg + ("(%s : 1 vote) " % lynchee)
     else:
@@ -1513,56 +1750,54 @@ class WolfBot(SingleServerIRCBot):
     self.say_public(msg)
 
 
-  def print_alive(self):
+  def print_alive(self, priority=PRIORITY_INFO):
     "Declare who's still alive."
-    msg = "The following players are " + IRC_AQUA + IRC_BOLD + "still alive" + IRC_DEFAULT + ": " + IRC_BOLD + "%s"%', '.join(self.live_players)
-    self.say_public(msg)
-    if self.dead_players:
-      msg = "The following players are " + IRC_RED + IRC_BOLD + "dead" + IRC_DEFAULT + ": " + IRC_BOLD + "%s"%', '.join(self.dead_players)
-      self.say_public(msg)
+    segments = ["The following players are " + IRC_AQUA + IRC_BOLD + "still alive" + IRC_DEFAULT + ": " + IRC_BOLD + "%s"%', '.join(self.game.live_players)]
+    if self.game.dead_players:
+      segments.append("The following players are " + IRC_RED + IRC_BOLD + "dead" + IRC_DEFAULT + ": " + IRC_BOLD + "%s"%', '.join(self.game.dead_players))
+    self.say_public_segments(segments, priority)
 
 
   def match_name(self, nick):
-    """Match NICK to a username in users(), insensitively.  Return
-    matching nick, or None if no match."""
-
-    chname, chobj = self.channels.items()[0]
-    users = chobj.users()
-
-    for user in users:
-      if (user.strip("&")).upper() == nick.upper():
-        return user.strip("&")
-    return None
+    """Match NICK to a user in the channel, insensitively, or to the
+    only user whose nick starts with it.  Return matching nick, or
+    None if no match."""
+    if self.channel not in self.channels:
+      return None
+    return self.channels[self.channel].find_user(nick.strip())
 
   def lynch_vote(self, e, lynchee, secret = False):
     "Register a vote to lynch LYNCHEE."
 	
-    lyncher = nm_to_n(e.source())
+    lyncher = e.nick()
     # sanity checks
     if self.gamestate != self.GAMESTATE_RUNNING:
         self.reply(e, "No game is in progress.")
         return
     if self.time != "day":
       self.reply(e, "Sorry, lynching only happens during the day.")
-    elif int(time.time() - self.day_timer) < (DAY_LENGTH / 2):
+    elif not self.voting:
       self.reply(e, "Sorry, you can only vote during the voting period.")
-    elif lyncher not in self.live_players:
+    elif lyncher not in self.game.live_players:
       self.reply(e, "Um, only living players can vote to lynch someone.")
-    elif lynchee not in self.live_players:
+    elif lynchee not in self.game.live_players:
       self.reply(e, "Um, only living players can be lynched.")
     elif lynchee == lyncher:
       self.reply(e, "Um, you can't lynch yourself.")
-    elif secret and self.elder_voted:
+    elif secret and self.game.elder_voted:
       self.reply(e, "You've already used your secret vote.")
-    elif lyncher in self.villager_votes:
+    elif lyncher in self.game.villager_votes:
       self.reply(e, "You've already used your vote today.")
 
     else:
       if not secret:
-        self.villager_votes[lyncher] = lynchee
-        self.say_public(lyncher + " has voted to lynch " + IRC_BOLD + lynchee + IRC_DEFAULT + "!")
+        self.game.villager_votes[lyncher] = lynchee
+        # Critical like the lynch and nightfall a vote can set off, so
+        # it isn't announced after them.
+        self.say_public(lyncher + " has voted to lynch " + IRC_BOLD + lynchee + IRC_DEFAULT + "!",
+            PRIORITY_CRITICAL)
         self.tally_votes()
-        if len(self.villager_votes) == len(self.live_players):
+        if len(self.game.villager_votes) == len(self.game.live_players):
           victims = self.check_for_votes()
           if not victims:
             self.print_tally()
@@ -1572,17 +1807,17 @@ class WolfBot(SingleServerIRCBot):
           else:
             victim = victims[random.randrange(len(victims))]
             
-            self.say_public(self.getLynchText(victim))
+            self.say_public(self.getLynchText(victim), PRIORITY_CRITICAL)
           if not self.kill_player(victim):
           # Day is done;  flip bot back into night-mode.
             self.night()
       else:
         self.say_public("The village elder has voted to lynch " + IRC_BOLD + lynchee + IRC_DEFAULT + "!")
-        if self.tally.has_key(lynchee):
-          self.tally[lynchee] += 1
+        if self.game.tally.has_key(lynchee):
+          self.game.tally[lynchee] += 1
         else:
-          self.tally[lynchee] = 1
-        self.elder_voted = True
+          self.game.tally[lynchee] = 1
+        self.game.elder_voted = True
       
   
   def cmd_help(self, args, e):
@@ -1591,14 +1826,14 @@ class WolfBot(SingleServerIRCBot):
 
   def cmd_stats(self, args, e):
     if self.gamestate == self.GAMESTATE_RUNNING:
-      self.print_alive()
+      self.print_alive(PRIORITY_CHATTER)
       if self.time == "day":
-        if int(time.time() - self.day_timer) > (DAY_LENGTH / 2):
+        if self.voting:
           self.tally_votes()
           self.print_tally(False)
     elif self.gamestate == self.GAMESTATE_STARTING:
       self.reply(e, "A new game is starting, current players are %s"
-          % (self.live_players,))
+          % (self.game.live_players,))
     else:
       self.reply(e, "No game is in progress.")
 
@@ -1606,7 +1841,7 @@ class WolfBot(SingleServerIRCBot):
     self.cmd_stats(args, e)
 
   def cmd_start(self, args, e):
-    target = nm_to_n(e.source())
+    target = e.nick()
     self.start_game(target)
   
   def cmd_s(self, args, e):
@@ -1620,33 +1855,36 @@ class WolfBot(SingleServerIRCBot):
         self.reply(e, "That command makes no sense.")
       return
       
-    target = nm_to_n(e.source())
+    target = e.nick()
     self.end_game(target)
 
   def cmd_votes(self, args, e):
     non_voters = []
     voters = []
-    if self.villager_votes.keys():
-      for n in self.live_players:
-        if not self.villager_votes.has_key(n):
+    if self.game.villager_votes.keys():
+      for n in self.game.live_players:
+        if not self.game.villager_votes.has_key(n):
           non_voters.append(n)
         else:
           voters.append(n)
       if non_voters:
         self.say_public("The following have no votes registered: %s"
-            % (non_voters))
+            % (non_voters), PRIORITY_CHATTER, "votes-status", VOTES_TTL)
         self.say_public("The votes are as follows: %s"
-	    % (self.villager_votes))
+	    % (self.game.villager_votes), PRIORITY_CHATTER, "votes-tally", VOTES_TTL)
       else:
-        self.say_public("Everyone has voted.")
+        self.say_public("Everyone has voted.", PRIORITY_CHATTER,
+            "votes-status", VOTES_TTL)
         self.say_public("The votes are as follows: %s"
-	    % (self.villager_votes))
+	    % (self.game.villager_votes), PRIORITY_CHATTER, "votes-tally", VOTES_TTL)
     else:
-      self.say_public("Nobody has voted yet.")
+      self.say_public("Nobody has voted yet.", PRIORITY_CHATTER,
+          "votes-status", VOTES_TTL)
 
   def cmd_del(self, args, e):
     for nick in args:
-      if nick not in self.live_players + self.dead_players:
+      if nick not in self.game.live_players and \
+          nick not in self.game.dead_players:
         self.reply(e, "There's nobody playing by the name %s" % nick)
       self._removeUser(nick)
 
@@ -1657,7 +1895,7 @@ class WolfBot(SingleServerIRCBot):
       self.connection.nick(args[0])
 
   def cmd_see(self, args, e):
-    target = nm_to_n(e.source())
+    target = e.nick()
     if len(args) == 1:
       viewee = self.match_name(args[0].strip())
       if viewee is not None:
@@ -1666,7 +1904,7 @@ class WolfBot(SingleServerIRCBot):
     self.reply(e, "See whom?")
   
   def cmd_guard(self, args, e):
-    target = nm_to_n(e.source())
+    target = e.nick()
     if len(args) == 1:
       guarded = self.match_name(args[0].strip())
       if guarded is not None:
@@ -1675,7 +1913,7 @@ class WolfBot(SingleServerIRCBot):
     self.reply(e, "Guard whom?")
     
   def cmd_assassinate(self, args, e):
-    target = nm_to_n(e.source())
+    target = e.nick()
     if len(args) == 1:
       ass_target = self.match_name(args[0].strip())
       if ass_target is not None:
@@ -1687,7 +1925,7 @@ class WolfBot(SingleServerIRCBot):
     self.cmd_assassinate(args, e)
   
   def cmd_lovers(self, args, e):
-    target = nm_to_n(e.source())
+    target = e.nick()
     if len(args) == 2:
       lover1 = self.match_name(args[0].strip())
       if lover1 is not None:
@@ -1700,8 +1938,8 @@ class WolfBot(SingleServerIRCBot):
     self.reply(e, "Lover who?")
   
   def cmd_secretvote(self, args, e):
-    target = nm_to_n(e.source())
-    if self.village_elder is None or self.village_elder not in self.live_players or target != self.village_elder:
+    target = e.nick()
+    if self.game.village_elder is None or self.game.village_elder not in self.game.live_players or target != self.game.village_elder:
       self.reply(e, "Huh?")
     if len(args) == 1:
       lynchee = self.match_name(args[0])
@@ -1711,7 +1949,7 @@ class WolfBot(SingleServerIRCBot):
     self.reply(e, "Vote for whom?")
     
   def cmd_kill(self, args, e):
-    target = nm_to_n(e.source())
+    target = e.nick()
     if len(args) == 1:
       killee = self.match_name(args[0].strip())
       if killee is not None:
@@ -1720,7 +1958,7 @@ class WolfBot(SingleServerIRCBot):
     self.reply(e, "Kill whom?")
 
   def cmd_vote(self, args, e):
-    target = nm_to_n(e.source())
+    target = e.nick()
     if len(args) == 1:
       lynchee = self.match_name(args[0])
       if lynchee is not None:
@@ -1741,11 +1979,11 @@ class WolfBot(SingleServerIRCBot):
     if self.gamestate == self.GAMESTATE_RUNNING:
       self.reply(e, 'Game is in progress; please wait for the next game.')
       return
-    player = nm_to_n(e.source())
-    if player in self.live_players:
+    player = e.nick()
+    if player in self.game.live_players:
       self.reply(e, 'You were already in the game!')
     else:
-      self.live_players.append(player)
+      self.game.live_players.append(player)
       self.reply(e, 'You are now in the game.')
       self.fix_modes()
   
@@ -1758,9 +1996,9 @@ class WolfBot(SingleServerIRCBot):
     self.reply(e, "My source code is available at %s" % url)
 
   def cmd_moderation(self, args, e):
-    if self.game_starter and self.game_starter != nm_to_n(e.source()):
+    if self.game.game_starter and self.game.game_starter != e.nick():
       self.reply(e, "%s started the game, and so has administrative control. "
-          "Request denied." % self.game_starter)
+          "Request denied." % self.game.game_starter)
       return
     if len(args) != 1:
       self.reply(e, "Usage: moderation on|off")
@@ -1773,7 +2011,7 @@ class WolfBot(SingleServerIRCBot):
       self.reply(e, "Usage: moderation on|off")
       return
     self.say_public('Moderation turned %s by %s'
-        % (args[0], nm_to_n(e.source())))
+        % (args[0], e.nick()))
     self.fix_modes()
 
   def do_command(self, e, cmd):
@@ -1787,11 +2025,11 @@ class WolfBot(SingleServerIRCBot):
     cmds[0]=cmds[0].lower()
     if self.debug and e.eventtype() == "pubmsg":
       if cmds[0][0] == '!':
-        e._source = cmds[0][1:] + '!fakeuser@fakehost'
+        e.set_source(cmds[0][1:] + '!fakeuser@fakehost')
         cmds = cmds[1:]
 
     # Dead players should not speak.
-    if nm_to_n(e.source()) in self.dead_players:
+    if e.nick() in self.game.dead_players:
       if (cmd != "stats") and (cmd != "status") and (cmd != "help") and (cmd != "end"):
         self.reply(e, "Please -- dead players should keep quiet.")
         return 0
@@ -1849,6 +2087,15 @@ def main():
   channel = c.get(cfgsect, 'channel')
   nickname = c.get(cfgsect, 'nickname')
   nickpass = c.get(cfgsect, 'nickpass')
+  # Optional flood control settings; see botcommon.TokenBucket.
+  flood_control = {}
+  for option in ('burst', 'rate', 'line_cost', 'byte_cost', 'min_rate'):
+    if c.has_option(cfgsect, 'flood_' + option):
+      flood_control[option] = c.getfloat(cfgsect, 'flood_' + option)
+  # Joins private lines sent together; see botcommon.OutputManager.
+  separator = ' | '
+  if c.has_option(cfgsect, 'separator'):
+    separator = ' %s ' % c.get(cfgsect, 'separator', raw=True)
 
   s = string.split(host, ":", 1)
   server = s[0]
@@ -1861,7 +2108,17 @@ def main():
   else:
     port = defaultPort
 
-  bot = WolfBot(channel, nickname, nickpass, server, port, debug)
+  bot = WolfBot(channel, nickname, nickpass, server, port, debug,
+      flood_control=flood_control, separator=separator)
+  try:
+    bot.start()
+  except KeyboardInterrupt:
+    # disconnect() flushes the QUIT before closing; quit() only queues it.
+    bot.connection.disconnect("Ctrl-C at console")
+    print "Quit IRC."
+  except Exception, e:
+    bot.connection.disconnect("%s: %s" % (e.__class__.__name__, e.args))
+    raise
 
 
 if __name__ == "__main__":